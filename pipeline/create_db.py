@@ -2,9 +2,19 @@
 
 import sqlalchemy
 import os.path
+import sys
+import csv
+import time
+import resource
+import argparse
+import datetime
+import collections
 
-import db
-import models
+import pipeline.db as db
+import pipeline.models as models
+
+
+BULK_BATCH_SIZE = 10000
 
 
 def _create_and_populate_db():
@@ -16,83 +26,381 @@ def _create_and_populate_db():
     proposicoes = models.Proposicao.create_from_csv(proposicoes_path)
     for proposicao in proposicoes:
         session.merge(proposicao)
-    votacoes = models.Votacao.create_from_file(session, votacoes_path)
+    proposicoes_index = models.ProposicaoIndex.from_session(session)
+    votacoes = models.Votacao.create_from_file(session, votacoes_path,
+                                               proposicoes_index)
     session.add_all(votacoes)
     session.commit()
+    with db.engine.begin() as connection:
+        _record_carga(connection, len(votacoes))
+    _report_unmatched_proposicoes(proposicoes_index.unmatched)
+
+
+def _bulk_create_and_populate_db(batch_size=BULK_BATCH_SIZE):
+    """Populates the DB streaming the source files into batched inserts
+
+    Unlike `_create_and_populate_db`, it never builds ORM objects nor holds
+    the whole JSON in memory. Rows are buffered and written with Core
+    `executemany` inserts every `batch_size` rows, so memory usage stays flat
+    and the load time grows linearly with the number of votes.
+    """
+    proposicoes_path = os.path.join(db.DATA_PATH, 'proposicoes.csv')
+    votacoes_path = os.path.join(db.DATA_PATH, 'votacoes_proposicoes.json')
+
+    started_at = time.time()
+    models.Base.metadata.create_all(db.engine)
+    with db.engine.begin() as connection:
+        counts = _bulk_insert_proposicoes(connection, proposicoes_path,
+                                          batch_size)
+        proposicoes_index = models.ProposicaoIndex.from_connection(connection)
+        counts.update(_bulk_insert_votacoes(connection, votacoes_path,
+                                            proposicoes_index, batch_size))
+        _record_carga(connection, counts['votacoes'])
+    _report_unmatched_proposicoes(proposicoes_index.unmatched)
+    _report_throughput(counts, time.time() - started_at)
 
 
-def _normalize_parties_names():
-    """Normalize parties that changed name in a single one
+def _incremental_update_db(batch_size=BULK_BATCH_SIZE):
+    """Loads only the proposições and rollcalls that aren't in the DB yet
 
-    The source data comes from the CEBRAP database's table tbl_Partido.
+    Rollcalls are matched by `models.Votacao.key`, and the existing rows are
+    left untouched. The last `models.Carga` watermark tells which votes are
+    new, so only the legislators that voted on them (or that authored new
+    proposições) have their names normalized again.
     """
-    def _generate_normalizations(model_party, model_party_attr_name):
-        def renomeia_partido(*nomes):
-            nome = '>'.join(nomes)
-            return {
-                'filter': model_party.in_(nomes),
-                'update': {model_party_attr_name: nome},
-            }
-
-        normalizations = {
-            'PCB>PPS': renomeia_partido('PCB', 'PPS'),
-            'PFL>DEM': renomeia_partido('PFL', 'DEM'),
-            'PMR>PRB': renomeia_partido('PMR', 'PRB'),
-            'PL>PR': renomeia_partido('PL', 'PR'),
-            'PDS>PP': {
-                'filter': model_party.in_(['PDS', 'PDC', 'PPR', 'PPB', 'PP']),
-                'update': {model_party_attr_name: 'PDS>PP'},
-            },
-            'PJ>PTC': {
-                'filter': model_party.in_(['PJ', 'PRN', 'PTC']),
-                'update': {model_party_attr_name: 'PJ>PTC'},
-            },
-            'SD': {
-                'filter': model_party.in_(['SDD', 'Solidaried']),
-                'update': {model_party_attr_name: 'SD'},
-            },
-            'PCDOB': {
-                'filter': (sqlalchemy.func.lower(model_party) == 'pcdob'),
-                'update': {model_party_attr_name: 'PCdoB'},
-            }
+    proposicoes_path = os.path.join(db.DATA_PATH, 'proposicoes.csv')
+    votacoes_path = os.path.join(db.DATA_PATH, 'votacoes_proposicoes.json')
+
+    started_at = time.time()
+    models.Base.metadata.create_all(db.engine)
+    with db.engine.begin() as connection:
+        watermark = _get_watermark(connection)
+        counts, autores_ids = _insert_new_proposicoes(connection,
+                                                      proposicoes_path,
+                                                      batch_size)
+        proposicoes_index = models.ProposicaoIndex.from_connection(connection)
+        counts.update(_bulk_insert_votacoes(connection, votacoes_path,
+                                            proposicoes_index, batch_size,
+                                            _get_loaded_votacoes(connection)))
+        _record_carga(connection, counts['votacoes'])
+
+        votos = models.Voto.__table__
+        parlamentares_ids = sqlalchemy.select([votos.c.parlamentar_id])\
+                                      .where(votos.c.votacao_id > watermark)\
+                                      .distinct()
+        affected_ids = autores_ids | {
+            row[0] for row in connection.execute(parlamentares_ids)
         }
+    _report_unmatched_proposicoes(proposicoes_index.unmatched)
+    _report_throughput(counts, time.time() - started_at)
+    return affected_ids
 
-        return normalizations
 
-    normalizations = _generate_normalizations(models.Voto.parlamentar_partido,
-                                              'parlamentar_partido')
-    for normalization in normalizations.values():
-        db.session.query(models.Voto)\
-          .filter(normalization['filter'])\
-          .update(normalization['update'], synchronize_session=False)
+def _get_watermark(connection):
+    cargas = models.Carga.__table__
+    query = sqlalchemy.select([cargas.c.ultima_votacao_id])\
+                      .order_by(cargas.c.id.desc())\
+                      .limit(1)
+    watermark = connection.execute(query).scalar()
+    if watermark is None:
+        # The DB was created before we kept track of the loads, so everything
+        # in it was loaded already
+        max_id = sqlalchemy.select([sqlalchemy.func.max(models.Votacao.id)])
+        watermark = connection.execute(max_id).scalar()
+    return watermark or 0
 
-    normalizations = _generate_normalizations(models.Proposicao.autor_partido,
-                                              'autor_partido')
-    for normalization in normalizations.values():
-        db.session.query(models.Proposicao)\
-          .filter(normalization['filter'])\
-          .update(normalization['update'], synchronize_session=False)
 
-    db.session.commit()
+def _get_loaded_votacoes(connection):
+    """Maps each loaded rollcall's key to its (id, proposicao_id)"""
+    votacoes = models.Votacao.__table__
+    query = sqlalchemy.select([votacoes.c.id,
+                               votacoes.c.id_sessao,
+                               votacoes.c.data,
+                               votacoes.c.obj_votacao,
+                               votacoes.c.proposicao_id])
+    return {
+        models.Votacao.key(row): (row['id'], row['proposicao_id'])
+        for row in connection.execute(query)
+    }
+
+
+def _record_carga(connection, num_votacoes):
+    max_id = sqlalchemy.select([sqlalchemy.func.max(models.Votacao.id)])
+    connection.execute(models.Carga.__table__.insert(), {
+        'data': datetime.datetime.now(),
+        'ultima_votacao_id': connection.execute(max_id).scalar() or 0,
+        'num_votacoes': num_votacoes,
+    })
+
+
+def _bulk_insert_proposicoes(connection, proposicoes_path, batch_size):
+    # Same semantics as `session.merge`: existing proposições are replaced
+    insert = models.Proposicao.__table__.insert().prefix_with('OR REPLACE')
+    writer = _BatchWriter(connection, batch_size)
+    with open(proposicoes_path, 'r') as proposicoes_csv:
+        for proposicao in csv.DictReader(proposicoes_csv):
+            writer.add(insert, models.Proposicao.build_row(proposicao))
+    return writer.close()
+
+
+def _insert_new_proposicoes(connection, proposicoes_path, batch_size):
+    """Inserts the proposições that aren't in the DB yet
+
+    Returns the insert counts and the IDs of the new proposições' authors.
+    """
+    proposicoes = models.Proposicao.__table__
+    existing_ids = {
+        row[0] for row in connection.execute(
+            sqlalchemy.select([proposicoes.c.id])
+        )
+    }
+    autores_ids = set()
+    writer = _BatchWriter(connection, batch_size)
+    with open(proposicoes_path, 'r') as proposicoes_csv:
+        for proposicao in csv.DictReader(proposicoes_csv):
+            row = models.Proposicao.build_row(proposicao)
+            if row['id'] in existing_ids:
+                continue
+            existing_ids.add(row['id'])
+            if row['autor_id']:
+                autores_ids.add(row['autor_id'])
+            writer.add(proposicoes.insert(), row)
+    return writer.close(), autores_ids
+
+
+def _bulk_insert_votacoes(connection, votacoes_path, proposicoes_index,
+                          batch_size, loaded_votacoes=None):
+    """Inserts the rollcalls with their votes and orientations
+
+    Rollcalls whose `models.Votacao.key` is in `loaded_votacoes` (as returned
+    by `_get_loaded_votacoes`) are skipped. If they were loaded before their
+    proposição, it's filled in. The inserted rollcalls are added to it, so
+    the ones repeated in the file are only inserted once.
+    """
+    skip_loaded = loaded_votacoes is not None
+    if not skip_loaded:
+        loaded_votacoes = {}
+    found_proposicoes = []
+    votacoes_insert = models.Votacao.__table__.insert()
+    votos_insert = models.Voto.__table__.insert()
+    orientacoes_insert = models.Orientacao.__table__.insert()
 
+    # The votes need their rollcall's ID before it's inserted, so we assign
+    # them ourselves instead of relying on SQLite's autoincrement
+    max_id = sqlalchemy.select([sqlalchemy.func.max(models.Votacao.id)])
+    votacao_id = connection.execute(max_id).scalar() or 0
 
-def _normalize_names():
-    votos = db.session.query(models.Voto)\
-              .group_by(models.Voto.parlamentar_id)\
-              .filter(models.Voto.parlamentar_id != None)\
-              .all()
-    for voto in votos:
-        db.session.query(models.Voto)\
-          .filter(models.Voto.parlamentar_id == voto.parlamentar_id)\
-          .update({models.Voto.parlamentar_nome: voto.parlamentar_nome})
+    writer = _BatchWriter(connection, batch_size)
+    with open(votacoes_path, 'r') as votacoes_json:
+        for votacao_proposicao in models.iter_json_array(votacoes_json):
+            proposicao_id = proposicoes_index.get(votacao_proposicao)
+            for votacao in votacao_proposicao.get('votacoes', []):
+                row = models.Votacao.build_row(proposicao_id, votacao)
+                key = models.Votacao.key(row)
+                if key in loaded_votacoes:
+                    loaded_id, loaded_proposicao_id = loaded_votacoes[key]
+                    if loaded_proposicao_id is None and proposicao_id:
+                        found_proposicoes.append({
+                            'votacao_id': loaded_id,
+                            'proposicao_id': proposicao_id,
+                        })
+                    continue
+                votacao_id += 1
+                row['id'] = votacao_id
+                writer.add(votacoes_insert, row)
+                if skip_loaded:
+                    loaded_votacoes[key] = (votacao_id, proposicao_id)
+                for voto in votacao.get('votos', []):
+                    row = models.Voto.build_row(votacao_id, voto)
+                    if row:
+                        writer.add(votos_insert, row)
+                for orientacao in votacao.get('orientacao_bancada', []):
+                    row = models.Orientacao.build_row(votacao_id, orientacao)
+                    writer.add(orientacoes_insert, row)
 
-        db.session.query(models.Proposicao)\
-          .filter(models.Proposicao.autor_id == voto.parlamentar_id)\
-          .update({models.Proposicao.autor: voto.parlamentar_nome})
+    # The rollcalls being filled in might still be buffered
+    counts = writer.close()
+    if found_proposicoes:
+        votacoes = models.Votacao.__table__
+        bindparam = sqlalchemy.bindparam
+        connection.execute(
+            votacoes.update()
+                    .where(votacoes.c.id == bindparam('votacao_id'))
+                    .values(proposicao_id=bindparam('proposicao_id')),
+            found_proposicoes
+        )
+    return counts
+
+
+class _BatchWriter(object):
+    """Buffers rows per insert statement and runs them with `executemany`
+
+    Statements are flushed in the order they were first seen, so parent
+    tables (e.g. `votacoes`) are written before their children.
+    """
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.buffers = collections.OrderedDict()
+        self.buffered = 0
+        self.counts = collections.Counter()
+
+    def add(self, insert, row):
+        self.buffers.setdefault(insert, []).append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for insert, rows in self.buffers.items():
+            if rows:
+                self.connection.execute(insert, rows)
+                self.counts[insert.table.name] += len(rows)
+                del rows[:]
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        return self.counts
+
+
+def _report_unmatched_proposicoes(unmatched):
+    if not unmatched:
+        return
+    print('%d proposições in the rollcalls file were not found, their '
+          'rollcalls were loaded without one:' % len(unmatched))
+    for ano, numero, tipo in sorted(unmatched):
+        print('  %s %d/%d' % (tipo, numero, ano))
+
+
+def _report_throughput(counts, elapsed):
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss /= 1024
+    total = sum(counts.values())
+
+    for table, count in sorted(counts.items()):
+        print('%s: %d rows' % (table, count))
+    print('Loaded %d rows in %.1fs (%.0f rows/s), peak RSS: %.1f MB' %
+          (total, elapsed, total / max(elapsed, 1e-9), peak_rss / 1024.0))
+
+
+def _normalize_names(parlamentares_ids=None):
+    """Uses a single name for each legislator in `votos` and `proposicoes`
+
+    The names are picked once, in a single grouped query, into a temporary
+    table. Both tables are then rewritten with one correlated UPDATE each,
+    instead of two UPDATEs per legislator.
+
+    Args:
+        parlamentares_ids (iterable): Only normalize these legislators.
+            Defaults to None, which normalizes everyone.
+    """
+    started_at = time.time()
+    votos = models.Voto.__table__
+    proposicoes = models.Proposicao.__table__
+    nomes = sqlalchemy.Table(
+        'nomes_parlamentares', sqlalchemy.MetaData(),
+        sqlalchemy.Column('parlamentar_id', sqlalchemy.Integer,
+                          primary_key=True),
+        sqlalchemy.Column('parlamentar_nome', sqlalchemy.String),
+        prefixes=['TEMPORARY'],
+    )
+    connection = db.session.connection()
+    temporary_tables = [nomes]
+
+    nomes.create(connection)
+    try:
+        nomes_por_parlamentar = sqlalchemy.select(
+            [votos.c.parlamentar_id, votos.c.parlamentar_nome]
+        ).where(
+            votos.c.parlamentar_id != None
+        ).group_by(votos.c.parlamentar_id)
+        if parlamentares_ids is not None:
+            afetados = _temporary_ids_table(connection, parlamentares_ids)
+            temporary_tables.append(afetados)
+            nomes_por_parlamentar = nomes_por_parlamentar.where(
+                votos.c.parlamentar_id.in_(sqlalchemy.select([afetados.c.id]))
+            )
+        db.session.execute(nomes.insert().from_select(
+            ['parlamentar_id', 'parlamentar_nome'], nomes_por_parlamentar
+        ))
+
+        def nome_of(parlamentar_id):
+            return sqlalchemy.select([nomes.c.parlamentar_nome])\
+                             .where(nomes.c.parlamentar_id == parlamentar_id)\
+                             .as_scalar()
+        parlamentares_ids = sqlalchemy.select([nomes.c.parlamentar_id])
+
+        db.session.execute(
+            votos.update()
+                 .where(votos.c.parlamentar_id.in_(parlamentares_ids))
+                 .values(parlamentar_nome=nome_of(votos.c.parlamentar_id))
+        )
+        db.session.execute(
+            proposicoes.update()
+                       .where(proposicoes.c.autor_id.in_(parlamentares_ids))
+                       .values(autor=nome_of(proposicoes.c.autor_id))
+        )
+        num_parlamentares = db.session.execute(
+            sqlalchemy.select([sqlalchemy.func.count()]).select_from(nomes)
+        ).scalar()
+    finally:
+        for table in temporary_tables:
+            table.drop(connection, checkfirst=True)
 
     db.session.commit()
+    print('Normalized the names of %d legislators in %.1fs' %
+          (num_parlamentares, time.time() - started_at))
+
+
+def _temporary_ids_table(connection, ids):
+    """Returns a temporary table filled with `ids`, to be dropped after use
+
+    SQLite limits how many parameters a query can have, so large `IN`
+    clauses have to go through a table.
+    """
+    table = sqlalchemy.Table(
+        'parlamentares_afetados', sqlalchemy.MetaData(),
+        sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+        prefixes=['TEMPORARY'],
+    )
+    table.create(connection, checkfirst=True)
+    connection.execute(table.delete())
+    if ids:
+        connection.execute(table.insert(), [{'id': the_id} for the_id in ids])
+    return table
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        description="Creates and populates the votes' DB"
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--bulk", action="store_true",
+        help="stream the source files using batched inserts (default: False)"
+    )
+    mode.add_argument(
+        "--incremental", action="store_true",
+        help="only load rollcalls that aren't in the DB yet (default: False)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=BULK_BATCH_SIZE,
+        help="rows per insert batch in bulk and incremental modes "
+             "(default: %d)" % BULK_BATCH_SIZE
+    )
+    return parser
+
 
 if __name__ == '__main__':
-    _create_and_populate_db()
-    _normalize_parties_names()
-    _normalize_names()
+    options = _create_parser().parse_args()
+    if options.incremental:
+        _normalize_names(_incremental_update_db(options.batch_size))
+    else:
+        if options.bulk:
+            _bulk_create_and_populate_db(options.batch_size)
+        else:
+            _create_and_populate_db()
+        _normalize_names()
@@ -1,15 +1,102 @@
 # -*- coding: utf-8 -*-
 
+import os
 import os.path
+import threading
 
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 
 
 DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                          os.path.pardir,
                          'data')
-engine = sqlalchemy.create_engine('sqlite:///%s/dados.db' % DATA_PATH)
-engine.raw_connection().connection.text_factory = str
-Session = sessionmaker(bind=engine)
-session = Session()
+# The DB path can be changed with this environment variable or `configure`
+DB_PATH_VARIABLE = 'PIPELINE_DB_PATH'
+# Set on every connection. Our queries read large ranges of the votes, so
+# they benefit from a larger page cache (in KiB, when negative) and from
+# reading the DB file through mmap instead of copying its pages.
+PRAGMAS = [
+    ('cache_size', -64 * 1024),
+    ('mmap_size', 256 * 2 ** 20),
+]
+# Lets the exports read while the DB is updated. It's kept in the DB file,
+# so it's only set when the DB is writable.
+WRITABLE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+]
+
+Session = sessionmaker()
+_engine = None
+_db_path = None
+_read_only = False
+_lock = threading.Lock()
+
+
+def configure(db_path=None, read_only=False):
+    """Sets up the DB used by `get_engine` and `session`
+
+    The engine is only created when it's first used. If it was already
+    created, it's disposed, and so are the current thread's session.
+
+    Args:
+        db_path (string): The SQLite file path. Defaults to the
+            `PIPELINE_DB_PATH` environment variable or `data/dados.db`.
+        read_only (bool): Opens the DB in read-only mode, so any write
+            fails. Defaults to False.
+    """
+    global _engine, _db_path, _read_only
+    with _lock:
+        if _engine is not None:
+            session.remove()
+            _engine.dispose()
+        _engine = None
+        _db_path = db_path
+        _read_only = read_only
+
+
+def get_engine():
+    """Returns the engine, creating it on the first call"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = _create_engine(_get_db_path(), _read_only)
+        return _engine
+
+
+def _get_db_path():
+    return _db_path or os.environ.get(DB_PATH_VARIABLE) or \
+        os.path.join(DATA_PATH, 'dados.db')
+
+
+def _create_engine(db_path, read_only=False):
+    if read_only:
+        url = 'sqlite:///file:%s?mode=ro&uri=true' % db_path
+    else:
+        url = 'sqlite:///%s' % db_path
+    engine = sqlalchemy.create_engine(url)
+
+    pragmas = PRAGMAS if read_only else WRITABLE_PRAGMAS + PRAGMAS
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.text_factory = str
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    return engine
+
+
+# Each thread has its own session, created on first use. Threads running
+# queries on a pool should call `session.remove()` when they're done.
+session = scoped_session(lambda: Session(bind=get_engine()))
+
+
+def __getattr__(name):
+    # `engine` used to be created at import time, so it's still available
+    # as an attribute, but only created when accessed
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """Returns a module that's only loaded when one of its attributes is used
+
+    NumPy, pandas and SQLAlchemy take most of our scripts' startup time, even
+    when they only parse their arguments (e.g. `--help`). Importing them with
+    `np = lazy_import('numpy')` instead of `import numpy as np` defers that
+    cost until they're needed.
+
+    The module is added to `sys.modules`, so later imports get the same
+    (possibly still unloaded) module. If it was imported already, it's
+    returned as is.
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '%s'" % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
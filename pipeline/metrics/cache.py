@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+class ResultCache(object):
+    """On-disk cache of results, keyed by their inputs' contents
+
+    Each value is pickled to a file named by the SHA-256 of its key, a
+    JSON-serializable list which usually has the input file's digest (see
+    `digest`) and the parameters, and the cache's `VERSION`. When the cache
+    is larger than `max_size` bytes, the least recently used values are
+    removed.
+
+    Args:
+        path (string): The cache directory.
+        max_size (int): Maximum size in bytes. Defaults to 1 GiB.
+    """
+    EXTENSION = '.pickle'
+    # Part of every key, so the values cached by older versions are never
+    # used. Bump it whenever a metric's implementation or the cached values'
+    # format changes (their old values are evicted as the least used).
+    VERSION = 1
+
+    def __init__(self, path, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+
+    def get_or_compute(self, key, compute):
+        """Returns the value of `key`, calling `compute()` if there's none"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as value_file:
+                value = pickle.load(value_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            value = compute()
+            self._write(path, value)
+            self._evict()
+        else:
+            # The access time might not be updated (e.g. noatime), so the
+            # modification time is used to sort the values by their last use
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Another process evicted it after it was read, so it's a
+                # miss for the next get, but the value read is still valid
+                pass
+        return value
+
+    def digest(self, path):
+        """Returns the SHA-256 of a file's contents
+
+        If `path` is a directory (e.g. a `VoteMatrixStore`), it's the digest
+        of its files' names and contents.
+        """
+        sha256 = hashlib.sha256()
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [os.path.join(path, filename)
+                     for filename in sorted(os.listdir(path))]
+        for file_path in paths:
+            if file_path != path:
+                sha256.update(os.path.basename(file_path).encode('utf-8'))
+            with open(file_path, 'rb') as input_file:
+                for chunk in iter(lambda: input_file.read(2 ** 20), b''):
+                    sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _path(self, key):
+        serialized_key = json.dumps([self.VERSION, key],
+                                    sort_keys=True).encode('utf-8')
+        filename = hashlib.sha256(serialized_key).hexdigest()
+        return os.path.join(self.path, filename + self.EXTENSION)
+
+    def _write(self, path, value):
+        """Writes to a temporary file first, so there're no partial values"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, temporary_path = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as value_file:
+                pickle.dump(value, value_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def _evict(self):
+        """Removes the least recently used values over `max_size`
+
+        Other processes sharing the cache may remove the same values, so a
+        value that's already gone is skipped.
+        """
+        values = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(self.EXTENSION):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            values.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        total_size = sum(size for _, _, size in values)
+        values.sort(key=lambda value: value[0])
+        for _, path, size in values:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import csv
+import multiprocessing
+import sys
+
+from pipeline.lazy import lazy_import
+from pipeline.metrics import series
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+class ChangePoints(object):
+    """Finds where the mean of a series (e.g. a party's cohesion) changes
+
+    The cost of a segment is its sum of squared errors around its mean,
+    calculated in O(1) from the prefix sums of the series' values and squared
+    values, which are standardized first. A change point is only accepted if
+    it reduces the cost by more than `penalty`.
+
+    Args:
+        method (string): "amoc" for at most one change, or "multi" for any
+            number of changes (using PELT). Defaults to "amoc".
+        min_size (int): Minimum number of values between change points.
+            Defaults to 30.
+        penalty (float): Cost of adding a change point. Defaults to
+            2 * log(n), where n is the series' length.
+    """
+    METHODS = ["amoc", "multi"]
+
+    def __init__(self, method="amoc", min_size=30, penalty=None):
+        if method not in self.METHODS:
+            raise ValueError('invalid method "%s"' % method)
+        self.method = method
+        self.min_size = min_size
+        self.penalty = penalty
+
+    def run(self, args=sys.argv[1:], output=sys.stdout):
+        """Writes the segments of each series in the input CSVs
+
+        Each input row is a series, with rollcalls IDs as columns, as written
+        by `bin/rice_index --metric`. The rollcalls metadata is read only once
+        and each series is ordered by the rollcalls dates. With
+        `--input-format binary`, the inputs are binary series, whose dates are
+        used if there's no metadata.
+        """
+        options = self._create_parser().parse_args(args)
+        detector = ChangePoints(options.method, options.min_size,
+                                options.penalty)
+
+        dates = None
+        if options.metadata_csv_path:
+            dates = self._read_dates(options.metadata_csv_path)
+        names, all_series = [], []
+        for input_file in options.input:
+            name = getattr(input_file, 'name', input_file)
+            rows = self._read_rows(input_file, options.input_format)
+            for row_number, (row, row_dates) in enumerate(rows, 1):
+                names.append('%s:%d' % (name, row_number))
+                all_series.append(self._sort_by_date(row, dates or row_dates))
+
+        results = detector.segments_of_many(all_series, options.jobs)
+
+        fieldnames = ['start_id', 'end_id', 'start', 'end',
+                      'mean', 'median', 'sd', 'length']
+        if all(a_series[2] is None for a_series in all_series):
+            fieldnames = [f for f in fieldnames if f not in ('start', 'end')]
+        if len(all_series) > 1:
+            fieldnames = ['series'] + fieldnames
+        writer = csv.DictWriter(output, fieldnames=fieldnames,
+                                extrasaction='ignore')
+        writer.writeheader()
+        for name, segments in zip(names, results):
+            for segment in segments:
+                segment['series'] = name
+                writer.writerow(segment)
+
+    def detect(self, values):
+        """Returns the positions where new segments start
+
+        Args:
+            values (array-like): The series. Null values are ignored.
+
+        Returns:
+            list(int): The change points positions in `values`, sorted.
+        """
+        values = np.asarray(values, dtype=float)
+        notnull = np.flatnonzero(~np.isnan(values))
+        change_points = self._detect(values[notnull])
+        return notnull[change_points].tolist()
+
+    def segments(self, values, ids, dates=None):
+        """Returns the statistics of each segment between change points
+
+        As in `bin/breakout_detection`, consecutive segments share their
+        boundary, and there're no segments if there's no change point.
+
+        Args:
+            values (array-like): The series.
+            ids (list): Each value's rollcall ID.
+            dates (list): Each value's rollcall date. Defaults to None.
+
+        Returns:
+            list(OrderedDict): The segments' start_id, end_id, start and end
+                (if there're `dates`), mean, median, sd and length. The
+                statistics ignore null values, and are None if all are null.
+        """
+        values = np.asarray(values, dtype=float)
+        change_points = self.detect(values)
+        if not change_points:
+            return []
+
+        bounds = [0] + change_points + [len(values) - 1]
+        result = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            segment_values = values[start:end + 1]
+            segment_values = segment_values[~np.isnan(segment_values)]
+            segment = collections.OrderedDict()
+            segment['start_id'] = ids[start]
+            segment['end_id'] = ids[end]
+            if dates is not None:
+                segment['start'] = dates[start]
+                segment['end'] = dates[end]
+            segment['mean'] = self._none_if_empty(np.mean, segment_values)
+            segment['median'] = self._none_if_empty(np.median, segment_values)
+            segment['sd'] = None
+            if len(segment_values) > 1:
+                segment['sd'] = np.std(segment_values, ddof=1)
+            segment['length'] = end - start + 1
+            result.append(segment)
+        return result
+
+    def segments_of_many(self, many_series, jobs=1):
+        """Calls `segments` on each (values, ids, dates) of `many_series`
+
+        With `jobs` larger than 1, they're split across a process pool.
+        """
+        if jobs > 1 and len(many_series) > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                return pool.starmap(self.segments, many_series)
+            finally:
+                pool.close()
+                pool.join()
+        return [self.segments(*a_series) for a_series in many_series]
+
+    def _detect(self, values):
+        length = len(values)
+        std = np.std(values) if length else 0
+        if length < 2 * self.min_size or std == 0:
+            return []
+
+        values = (values - np.mean(values)) / std
+        sums = np.concatenate([[0], np.cumsum(values)])
+        squares = np.concatenate([[0], np.cumsum(values ** 2)])
+
+        def cost(start, end):
+            """Sum of squared errors of values[start:end] (may be arrays)"""
+            segment_sum = sums[end] - sums[start]
+            return squares[end] - squares[start] - \
+                segment_sum ** 2 / (end - start)
+
+        penalty = self.penalty
+        if penalty is None:
+            penalty = 2 * np.log(length)
+
+        if self.method == "amoc":
+            return self._amoc(cost, length, penalty)
+        return self._pelt(cost, length, penalty)
+
+    def _amoc(self, cost, length, penalty):
+        candidates = np.arange(self.min_size, length - self.min_size + 1)
+        costs = cost(0, candidates) + cost(candidates, length)
+        best = np.argmin(costs)
+        if cost(0, length) - costs[best] > penalty:
+            return [int(candidates[best])]
+        return []
+
+    def _pelt(self, cost, length, penalty):
+        """Optimal partitioning, pruning candidates that can't be optimal"""
+        min_size = self.min_size
+        best_costs = np.full(length + 1, np.inf)
+        best_costs[0] = -penalty
+        last_change = np.zeros(length + 1, dtype=int)
+        candidates = np.array([], dtype=int)
+
+        for end in range(min_size, length + 1):
+            new_candidate = end - min_size
+            if new_candidate == 0 or new_candidate >= min_size:
+                candidates = np.append(candidates, new_candidate)
+            costs = best_costs[candidates] + cost(candidates, end)
+            best = np.argmin(costs)
+            best_costs[end] = costs[best] + penalty
+            last_change[end] = candidates[best]
+            candidates = candidates[costs <= best_costs[end]]
+
+        change_points = []
+        end = last_change[length]
+        while end > 0:
+            change_points.append(int(end))
+            end = last_change[end]
+        return sorted(change_points)
+
+    def _none_if_empty(self, function, values):
+        if len(values):
+            return function(values)
+
+    def _read_dates(self, metadata_csv_path):
+        with open(metadata_csv_path, 'r', newline='') as metadata_file:
+            reader = csv.DictReader(metadata_file)
+            if not {'id', 'data'}.issubset(reader.fieldnames or []):
+                raise ValueError("the metadata CSV needs to have at least an "
+                                 "'id' and 'data' columns")
+            return {row['id']: row['data'] for row in reader}
+
+    def _read_rows(self, input_file, input_format="csv"):
+        """Yields each series' (row, dates), where dates may be None"""
+        if input_format == "binary":
+            if isinstance(input_file, str):
+                with open(input_file, 'rb') as binary_file:
+                    values, ids, dates = series.read_series(binary_file)
+            else:
+                values, ids, dates = series.read_series(
+                    getattr(input_file, 'buffer', input_file)
+                )
+            ids = [str(rollcall_id) for rollcall_id in ids.tolist()]
+            if dates is not None:
+                dates = dict(zip(ids, dates.astype(str).tolist()))
+            for row in series.series_to_rows(values, ids):
+                yield row, dates
+        elif isinstance(input_file, str):
+            with open(input_file, 'r', newline='') as csv_file:
+                for row in csv.DictReader(csv_file):
+                    yield row, None
+        else:
+            for row in csv.DictReader(input_file):
+                yield row, None
+
+    def _sort_by_date(self, row, dates):
+        """Returns the row's (values, ids, dates), sorted by date
+
+        Without `dates`, the row is kept in its order. Otherwise, it's sorted
+        by the parsed dates, and the rollcalls without a valid date (e.g.
+        empty or NaT) are removed.
+        """
+        ids = list(row.keys())
+        if dates is not None:
+            ids = [rollcall_id for rollcall_id in ids if rollcall_id in dates]
+            timestamps = pd.to_datetime([dates[rollcall_id]
+                                         for rollcall_id in ids],
+                                        errors='coerce')
+            dated_ids = [(timestamp, rollcall_id) for timestamp, rollcall_id
+                         in zip(timestamps, ids) if not pd.isnull(timestamp)]
+            dated_ids.sort(key=lambda dated_id: dated_id[0])
+            ids = [rollcall_id for _, rollcall_id in dated_ids]
+        values = [np.nan if row[rollcall_id] in ('', None)
+                  else float(row[rollcall_id]) for rollcall_id in ids]
+        rollcalls_dates = None
+        if dates is not None:
+            rollcalls_dates = [dates[rollcall_id] for rollcall_id in ids]
+        return values, ids, rollcalls_dates
+
+    def _create_parser(self):
+        parser = argparse.ArgumentParser(
+            description="Finds the change points of cohesion series"
+        )
+        parser.add_argument(
+            "-i", "--input", nargs="+", default=[sys.stdin],
+            help="CSV files with a series per row and rollcalls IDs as "
+                 "columns (default: stdin)"
+        )
+        parser.add_argument(
+            "--input-format", type=str, choices=series.FORMATS,
+            default="csv", help="inputs format (default: csv)"
+        )
+        parser.add_argument(
+            "-m", "--metadata-csv-path", type=str,
+            help="rollcalls metadata CSV, with at least 'id' and 'data' "
+                 "columns, used to sort the series by date"
+        )
+        parser.add_argument(
+            "--method", type=str, choices=self.METHODS, default="amoc",
+            help="at most one change (amoc) or many (multi) (default: amoc)"
+        )
+        parser.add_argument(
+            "--min-size", type=int, default=30,
+            help="minimum number of rollcalls between changes (default: 30)"
+        )
+        parser.add_argument(
+            "--penalty", type=float, default=None,
+            help="cost of each change, in standard deviations squared "
+                 "(default: 2 * log(series length))"
+        )
+        parser.add_argument(
+            "--jobs", type=int, default=1,
+            help="processes detecting the series' changes in parallel "
+                 "(default: 1)"
+        )
+        return parser
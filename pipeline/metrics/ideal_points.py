@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+from pipeline.lazy import lazy_import
+from pipeline.metrics.rollcall import Rollcall
+
+np = lazy_import('numpy')
+
+
+IdealPointsFit = collections.namedtuple('IdealPointsFit', [
+    'ideal_points', 'intercepts', 'slopes', 'log_likelihood', 'iterations',
+])
+
+
+class IdealPoints(object):
+    """One-dimensional spatial model of the legislators' votes
+
+    A legislator `i` votes YES on rollcall `j` with probability
+    `sigmoid(intercepts[j] + slopes[j] * ideal_points[i])`. The parameters
+    maximize the votes' likelihood, with normal priors around 0 keeping them
+    finite even for legislators (or rollcalls) that always vote the same way.
+
+    They're fitted by alternating optimization: with the ideal points fixed,
+    every rollcall's intercept and slope get a Newton step at once, and then
+    every legislator's ideal point gets one, with the rollcalls fixed. The
+    ideal points are standardized after each round, so they have mean 0 and
+    standard deviation 1.
+
+    Args:
+        max_iterations (int): Maximum number of rounds. Defaults to 500.
+        tolerance (float): Stops when no parameter changes more than this in
+            a round. Defaults to 1e-6.
+        prior_variance (float): Variance of the rollcalls' parameters prior.
+            The ideal points' prior has variance 1. Defaults to 25.
+    """
+    # Newton steps larger than this are clipped, so they can't overshoot
+    # while the parameters are far from their optimum
+    MAX_STEP = 1.0
+
+    def __init__(self, max_iterations=500, tolerance=1e-6,
+                 prior_variance=25.0):
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.prior_variance = prior_variance
+
+    def fit(self, votes, init=None, polarity=None):
+        """Estimates the legislators' ideal points and the rollcalls' params
+
+        Args:
+            votes (Rollcall or 2D array-like): The votes, with a row per
+                legislator and a column per rollcall. YES is 1, NO is 0, and
+                any other value (e.g. NaN or `MISSING`) is ignored.
+            init (IdealPointsFit): Warm start, usually the fit of a similar
+                matrix (e.g. the same votes with a legislator split in two).
+                Its ideal points can be None, so they're estimated from its
+                rollcalls' parameters first. Defaults to None.
+            polarity (int): Position of a legislator whose ideal point must
+                be positive, as the model can't tell left from right.
+                Defaults to None.
+
+        Returns:
+            IdealPointsFit: The ideal points, intercepts and slopes as arrays,
+                the votes' log-likelihood and the number of rounds.
+        """
+        yes, observed = self._encode(votes)
+        num_legislators, num_rollcalls = yes.shape
+
+        if init is None:
+            intercepts, slopes = self._init_rollcalls(yes, observed)
+            ideal_points = self._init_ideal_points(yes, observed)
+        else:
+            intercepts = np.array(init.intercepts, dtype=float)
+            slopes = np.array(init.slopes, dtype=float)
+            if init.ideal_points is None:
+                ideal_points = self._fit_ideal_points(yes, observed,
+                                                      intercepts, slopes)
+            else:
+                ideal_points = np.array(init.ideal_points, dtype=float)
+        if intercepts.shape != (num_rollcalls,) or \
+                ideal_points.shape != (num_legislators,):
+            raise ValueError("the initial parameters don't match the %d "
+                             "legislators and %d rollcalls" %
+                             (num_legislators, num_rollcalls))
+
+        iteration = 0
+        for iteration in range(1, self.max_iterations + 1):
+            previous = np.concatenate([ideal_points, intercepts, slopes])
+            intercepts, slopes = self._rollcalls_step(
+                yes, observed, ideal_points, intercepts, slopes
+            )
+            ideal_points = self._ideal_points_step(
+                yes, observed, ideal_points, intercepts, slopes
+            )
+            # The prior shrinks the ideal points towards 0 on every step, so
+            # the steps never vanish, but the standardized parameters converge
+            ideal_points, intercepts, slopes = self._standardize(
+                ideal_points, intercepts, slopes
+            )
+            current = np.concatenate([ideal_points, intercepts, slopes])
+            if np.abs(current - previous).max(initial=0) < self.tolerance:
+                break
+
+        if polarity is not None and ideal_points[polarity] < 0:
+            ideal_points, slopes = -ideal_points, -slopes
+        log_likelihood = self._log_likelihood(yes, observed, ideal_points,
+                                              intercepts, slopes)
+        return IdealPointsFit(ideal_points, intercepts, slopes,
+                              log_likelihood, iteration)
+
+    def fit_ideal_points(self, votes, fit, init=None):
+        """Estimates only the ideal points, keeping `fit`'s rollcalls
+
+        It's much cheaper than `fit`, as each legislator is independent given
+        the rollcalls' parameters. Use it to place legislators (or parts of
+        them, like a legislator's votes before and after some date) on an
+        existing fit's scale.
+
+        Args:
+            votes (Rollcall or 2D array-like): The legislators' votes, on the
+                same rollcalls as `fit`.
+            fit (IdealPointsFit): The fit with the rollcalls' parameters.
+            init (array-like): Initial ideal points. Defaults to None.
+
+        Returns:
+            np.ndarray: The ideal points, in the same order as `votes` rows.
+        """
+        yes, observed = self._encode(votes)
+        intercepts = np.asarray(fit.intercepts, dtype=float)
+        slopes = np.asarray(fit.slopes, dtype=float)
+        if yes.shape[1] != len(intercepts):
+            raise ValueError("there're %d rollcalls, but the fit has %d" %
+                             (yes.shape[1], len(intercepts)))
+        return self._fit_ideal_points(yes, observed, intercepts, slopes,
+                                      init)
+
+    def _fit_ideal_points(self, yes, observed, intercepts, slopes,
+                          init=None):
+        if init is None:
+            ideal_points = np.zeros(yes.shape[0])
+        else:
+            ideal_points = np.array(init, dtype=float)
+        for _ in range(self.max_iterations):
+            previous = ideal_points
+            ideal_points = self._ideal_points_step(
+                yes, observed, ideal_points, intercepts, slopes
+            )
+            if np.abs(ideal_points - previous).max(initial=0) < \
+                    self.tolerance:
+                break
+        return ideal_points
+
+    def _encode(self, votes):
+        """Returns the YES and the observed votes as float matrices"""
+        if isinstance(votes, Rollcall):
+            votes = votes.data
+        votes = np.asarray(votes, dtype=float)
+        if votes.ndim != 2:
+            raise ValueError("the votes must be a matrix")
+        yes = (votes == 1).astype(float)
+        observed = yes + (votes == 0)
+        return yes, observed
+
+    def _init_rollcalls(self, yes, observed):
+        """Each rollcall's intercept starts at the log-odds of a YES"""
+        yes_share = (yes.sum(axis=0) + 0.5) / (observed.sum(axis=0) + 1)
+        intercepts = np.log(yes_share / (1 - yes_share))
+        return intercepts, np.zeros(yes.shape[1])
+
+    def _init_ideal_points(self, yes, observed):
+        """Starts with the first principal component of the centered votes
+
+        Starting at 0 would make every slope's gradient 0, so the model
+        would never leave it.
+        """
+        yes_share = (yes.sum(axis=0) + 0.5) / (observed.sum(axis=0) + 1)
+        centered = np.where(observed > 0, yes - yes_share, 0)
+        ideal_points = np.ones(yes.shape[0])
+        for _ in range(100):
+            previous = ideal_points
+            ideal_points = centered.dot(centered.T.dot(ideal_points))
+            norm = np.linalg.norm(ideal_points)
+            if norm == 0:
+                return np.zeros(yes.shape[0])
+            ideal_points /= norm
+            if np.abs(ideal_points - previous).max() < 1e-6:
+                break
+        return self._standardize(ideal_points)[0]
+
+    def _rollcalls_step(self, yes, observed, ideal_points, intercepts,
+                        slopes):
+        """Newton step on every rollcall's (intercept, slope) at once"""
+        probabilities = self._probabilities(ideal_points, intercepts, slopes)
+        residuals = observed * (yes - probabilities)
+        weights = observed * probabilities * (1 - probabilities)
+        precision = 1.0 / self.prior_variance
+
+        gradient_intercepts = residuals.sum(axis=0) - intercepts * precision
+        gradient_slopes = ideal_points.dot(residuals) - slopes * precision
+        # The negative Hessian is [[a, b], [b, c]] for each rollcall
+        a = weights.sum(axis=0) + precision
+        b = ideal_points.dot(weights)
+        c = (ideal_points ** 2).dot(weights) + precision
+        determinant = a * c - b ** 2
+
+        step_intercepts = self._clip(
+            (c * gradient_intercepts - b * gradient_slopes) / determinant
+        )
+        step_slopes = self._clip(
+            (a * gradient_slopes - b * gradient_intercepts) / determinant
+        )
+        return intercepts + step_intercepts, slopes + step_slopes
+
+    def _ideal_points_step(self, yes, observed, ideal_points, intercepts,
+                           slopes):
+        """Newton step on every legislator's ideal point at once"""
+        probabilities = self._probabilities(ideal_points, intercepts, slopes)
+        residuals = observed * (yes - probabilities)
+        weights = observed * probabilities * (1 - probabilities)
+
+        gradient = residuals.dot(slopes) - ideal_points
+        hessian = weights.dot(slopes ** 2) + 1
+        return ideal_points + self._clip(gradient / hessian)
+
+    def _standardize(self, ideal_points, intercepts=None, slopes=None):
+        """Rescales the ideal points to mean 0 and standard deviation 1
+
+        The rollcalls' parameters are changed so the probabilities are the
+        same.
+        """
+        mean = ideal_points.mean() if len(ideal_points) else 0
+        std = ideal_points.std() if len(ideal_points) else 0
+        if std == 0:
+            std = 1
+        ideal_points = (ideal_points - mean) / std
+        if intercepts is not None:
+            intercepts = intercepts + slopes * mean
+            slopes = slopes * std
+        return ideal_points, intercepts, slopes
+
+    def _log_likelihood(self, yes, observed, ideal_points, intercepts,
+                        slopes):
+        utilities = intercepts + np.outer(ideal_points, slopes)
+        # log(sigmoid(u)) for YES and log(sigmoid(-u)) for NO
+        signs = 2 * yes - 1
+        return -(observed * np.logaddexp(0, -signs * utilities)).sum()
+
+    def _probabilities(self, ideal_points, intercepts, slopes):
+        utilities = intercepts + np.outer(ideal_points, slopes)
+        return 0.5 * (1 + np.tanh(0.5 * utilities))
+
+    def _clip(self, step):
+        return np.clip(step, -self.MAX_STEP, self.MAX_STEP)
+
+
+class SplitIdealPoints(object):
+    """Estimates a split legislator's ideal points before and after the split
+
+    It's a `SplitLegislators.map` function. The window's votes are fitted
+    once, as every legislator's split in a window is placed on the same
+    scale: the rollcalls' parameters are kept, and only the legislator's two
+    ideal points are estimated. The last window's fit is kept, so the splits
+    should come window by window (as `SplitLegislators.splits` yields them).
+
+    Args:
+        ideal_points (IdealPoints): The model. Defaults to `IdealPoints()`.
+        polarity (int): See `IdealPoints.fit`. Defaults to None.
+    """
+    def __init__(self, ideal_points=None, polarity=None):
+        self.ideal_points = ideal_points or IdealPoints()
+        self.polarity = polarity
+        self._window = None
+        self._fit = None
+
+    def __call__(self, view):
+        """Returns the legislator's window, before and after ideal points"""
+        split = view.split
+        window = (split.start, split.end)
+        if window != self._window:
+            self._fit = self.ideal_points.fit(view.votes,
+                                              polarity=self.polarity)
+            self._window = window
+        before, after = self.ideal_points.fit_ideal_points(
+            np.vstack([view.before, view.after]), self._fit
+        )
+        return collections.OrderedDict([
+            ('window', float(self._fit.ideal_points[split.legislator])),
+            ('before', float(before)),
+            ('after', float(after)),
+        ])
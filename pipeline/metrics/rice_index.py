@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from pipeline.lazy import lazy_import
+
+np = lazy_import('numpy')
+
 
 class RiceIndex(object):
     def __init__(self, yes_value=1, no_value=0):
@@ -32,3 +36,72 @@ class RiceIndex(object):
             return
 
         return (total * (rice_index ** 2) + total - 2) / (2 * (total - 1))
+
+    def calculate_matrix(self, votes):
+        """Calculates the Rice Index of every column of a votes matrix
+
+        It's the same as calling `calculate` on each column, but the votes
+        are counted for all columns at once.
+
+        Args:
+            votes (2D array-like): Rows are people (or groups) and columns
+                are polls.
+
+        Returns:
+            list: The Rice Index of each column, or None if it has less than
+                two non-null votes.
+        """
+        num_yes, num_no = self._count_votes(votes)
+        rice_index = self.calculate_from_counts(num_yes, num_no)
+        return self._none_if_not_enough_votes(rice_index, num_yes + num_no)
+
+    def calculate_adjusted_matrix(self, votes):
+        """Calculates the Adjusted Rice Index of every column of a votes matrix
+
+        It's the same as calling `calculate_adjusted` on each column, but the
+        votes are counted only once, for all columns at once.
+        """
+        num_yes, num_no = self._count_votes(votes)
+        adjusted = self.calculate_adjusted_from_counts(num_yes, num_no)
+        return self._none_if_not_enough_votes(adjusted, num_yes + num_no)
+
+    def calculate_from_counts(self, num_yes, num_no):
+        """Calculates the Rice Index from arrays of YES and NO votes counts
+
+        Returns:
+            np.ndarray: The Rice Indexes, or NaN where there're less than two
+                votes.
+        """
+        num_yes, num_no = np.asarray(num_yes), np.asarray(num_no)
+        total = num_yes + num_no
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rice_index = np.abs(num_yes - num_no) / total
+        return np.where(total < 2, np.nan, rice_index)
+
+    def calculate_adjusted_from_counts(self, num_yes, num_no):
+        """Calculates the Adjusted Rice Index from arrays of votes counts
+
+        Returns:
+            np.ndarray: The Adjusted Rice Indexes, or NaN where there're less
+                than two votes.
+        """
+        total = np.asarray(num_yes) + np.asarray(num_no)
+        rice_index = self.calculate_from_counts(num_yes, num_no)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            adjusted = (total * (rice_index ** 2) + total - 2) / \
+                (2 * (total - 1))
+        return np.where(total < 2, np.nan, adjusted)
+
+    def _count_votes(self, votes):
+        votes = np.asarray(votes)
+        if votes.ndim != 2:
+            votes = votes.reshape(len(votes), -1)
+        num_yes = np.count_nonzero(votes == self.yes, axis=0)
+        num_no = np.count_nonzero(votes == self.no, axis=0)
+        return num_yes, num_no
+
+    def _none_if_not_enough_votes(self, result, total):
+        result = result.tolist()
+        for index in np.flatnonzero(total < 2):
+            result[index] = None
+        return result
@@ -1,28 +1,154 @@
 # -*- coding: utf-8 -*-
 
-import numpy as np
-import pandas as pd
+from pipeline.lazy import lazy_import
+from pipeline.metrics.rice_index import RiceIndex
+from pipeline.metrics.store import VoteMatrixStore, MISSING
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class Rollcall(object):
     METADATA_COLUMNS = ["id", "name", "party", "state"]
+    CATEGORICAL_COLUMNS = ["name", "party", "state"]
+    PERIODS = ["month", "year", "legislative year"]
 
-    def __init__(self, data):
-        intersect = lambda x, y: list(set(x) & set(y))
-        metadata_cols = intersect(self.METADATA_COLUMNS, data.keys().tolist())
-        self.metadata = data[metadata_cols]
-        self.data = data.drop(metadata_cols, axis=1)
+    def __init__(self, data, metadata=None, dates=None):
+        """Args:
+            data (DataFrame): The votes, with polls as columns. Unless
+                `metadata` is given, the `METADATA_COLUMNS` it has are split
+                into `self.metadata`.
+            metadata (DataFrame): The rows' metadata. Defaults to None.
+            dates (array-like): The polls' dates, in the same order as the
+                `data` columns. They're kept in `self.dates`, a Series indexed
+                by poll. Defaults to None.
+        """
+        if metadata is None:
+            intersect = lambda x, y: list(set(x) & set(y))
+            metadata_cols = intersect(self.METADATA_COLUMNS,
+                                      data.keys().tolist())
+            metadata = data[metadata_cols]
+            data = data.drop(metadata_cols, axis=1)
+        self.metadata = self.__categorize(metadata)
+        self.data = data
+        self.dates = None
+        if dates is not None:
+            self.dates = pd.Series(pd.to_datetime(np.asarray(dates)),
+                                   index=data.columns)
+        self.__metadata_index = {}
+        self.__indexed_metadata = self.metadata
 
     @classmethod
-    def from_csv(cls, csv_path):
+    def from_csv(cls, csv_path, rollcalls_csv_path=None):
+        """Reads a votes CSV, as written by `bin/votes_to_csv`
+
+        Args:
+            csv_path (string): The votes CSV path.
+            rollcalls_csv_path (string): The rollcalls metadata CSV path (e.g.
+                "54-votacoes.csv"), with their `id` and `data`. The polls
+                without a date get NaT. Defaults to None.
+        """
         votes = pd.DataFrame.from_csv(csv_path, index_col=None)
-        return cls(votes)
+        rollcall = cls(votes)
+        if rollcalls_csv_path is not None:
+            rollcalls = pd.read_csv(rollcalls_csv_path)
+            dates = pd.Series(rollcalls['data'].values,
+                              index=rollcalls['id'].astype(str))
+            rollcall.dates = pd.Series(
+                pd.to_datetime(dates.reindex(rollcall.data.columns.astype(str))
+                               .values),
+                index=rollcall.data.columns
+            )
+        return rollcall
+
+    @classmethod
+    def from_store(cls, store_path):
+        """Opens a `VoteMatrixStore` without copying its votes
+
+        The votes are an int8 DataFrame over the memory-mapped matrix, where
+        missing votes are `MISSING` instead of NaN. Use `Rollcall.notnull`
+        instead of `pd.notnull` to handle both.
+        """
+        votes, legislators, rollcalls = VoteMatrixStore(store_path).read()
+        metadata_cols = [column for column in cls.METADATA_COLUMNS
+                         if column in legislators]
+        data = pd.DataFrame(votes, columns=rollcalls['id'].tolist(),
+                            copy=False)
+        dates = rollcalls['data'] if 'data' in rollcalls else None
+        return cls(data, legislators[metadata_cols], dates)
+
+    def to_store(self, store_path, rollcalls=None):
+        """Saves the votes as a `VoteMatrixStore`
+
+        Args:
+            store_path (string): The store's directory.
+            rollcalls (DataFrame): The polls' metadata, in the same order
+                as `self.data` columns. Defaults to their IDs and dates.
+        """
+        if rollcalls is None:
+            rollcalls = pd.DataFrame({'id': self.data.columns})
+            if self.dates is not None:
+                rollcalls['data'] = self.dates.values
+        votes = self.data.where(self.notnull(self.data))
+        VoteMatrixStore(store_path).write(votes.values, self.metadata,
+                                          rollcalls)
+        return self
+
+    @staticmethod
+    def notnull(votes):
+        """Like `pd.notnull`, but also considers `MISSING` votes as null"""
+        return pd.notnull(votes) & (votes != MISSING)
 
     def filter(self, filters):
         if len(self.metadata):
-            self.__apply_filters(filters)
+            positions = self.positions(filters)
+            if positions is not None:
+                self.metadata = self.metadata.iloc[positions]
+                self.data = self.data.iloc[positions]
         return self
 
+    def select(self, filters):
+        """Returns a new Rollcall with only the rows matching `filters`
+
+        Unlike `filter`, it doesn't change this rollcall, so its metadata
+        index is reused by every call.
+        """
+        positions = self.positions(filters) if len(self.metadata) else None
+        if positions is None:
+            return Rollcall(self.data, self.metadata, self.dates)
+        return Rollcall(self.data.iloc[positions],
+                        self.metadata.iloc[positions], self.dates)
+
+    def positions(self, filters):
+        """Returns the sorted positions of the rows matching `filters`
+
+        Each filter is resolved with the metadata column's index of value to
+        row positions, and the filters are intersected. It doesn't change the
+        rollcall, so it can be called for many filters on the same votes.
+
+        Args:
+            filters (dict): Metadata column to the list of values to keep.
+                Empty lists are ignored.
+
+        Returns:
+            np.ndarray: The rows positions, or None if there're no filters.
+        """
+        positions = None
+        for key, values in filters.items():
+            if not values:
+                continue
+            index = self.__get_metadata_index(key)
+            no_rows = np.array([], dtype=np.intp)
+            matches = np.unique(np.concatenate(
+                [no_rows] + [index.get(value, no_rows) for value in values]
+            ))
+            if positions is None:
+                positions = matches
+            else:
+                positions = np.intersect1d(positions, matches,
+                                           assume_unique=True)
+        return positions
+
     def median_votes_groupped_by(self, groupby):
         if groupby in self.metadata:
             return self.__get_groups_median_votes(groupby)
@@ -31,72 +157,201 @@ class Rollcall(object):
     def remove_unanimous_votes(self, majority_percentual):
         """Remove votes with majority larget than `majority_percentual`
 
-        It ignores NULL votes.
+        It ignores NULL votes, and also removes votes without any non-NULL
+        vote. The majorities of all votes are calculated at once, counting
+        each distinct vote value over the whole matrix.
         """
-        def unanimous_columns(column):
-            counts = np.unique(column[pd.notnull(column)],
-                               return_counts=True)[1]
-            total = sum(counts)
-            for count in counts:
-                percentual = count/total
-                if percentual >= majority_percentual:
-                    return False
-            return len(counts) > 0
         if majority_percentual is not None:
-            filters = self.data.apply(unanimous_columns)
-            self.data = self.data[filters.index[filters]]
+            self.keep_columns(self.not_unanimous_columns(majority_percentual))
         return self
 
-    def __apply_filters(self, filters):
-        criteria = []
-        for key, values in filters.items():
-            if not values:
-                continue
-            criterion = self.metadata[key].map(lambda k: k in values)
-            if len(criteria) == 0:
-                criteria = criterion
-            criteria = criteria & criterion
-        if len(criteria):
-            self.metadata = self.metadata[criteria]
-            self.data = self.data[criteria]
+    def not_unanimous_columns(self, majority_percentual):
+        """Returns the positions of the polls `remove_unanimous_votes` keeps
+
+        If `majority_percentual` is None, all polls are kept.
+        """
+        if majority_percentual is None:
+            return np.arange(len(self.data.columns))
+        votes = self.data.values
+        notnull = self.notnull(votes)
+        total = np.count_nonzero(notnull, axis=0)
+        majority = np.zeros_like(total)
+        for value in self._vote_values(votes, notnull):
+            counts = np.count_nonzero(votes == value, axis=0)
+            majority = np.maximum(majority, counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unanimous = (majority / total) >= majority_percentual
+        return np.flatnonzero((total > 0) & ~unanimous)
+
+    def keep_columns(self, columns):
+        """Keeps only the polls (and their dates) in the `columns` positions"""
+        self.data = self.data.iloc[:, columns]
+        if self.dates is not None:
+            self.dates = self.dates.iloc[columns]
         return self
 
+    def cohesion_by_period(self, groupby, period, adjusted=True):
+        """Returns each group's mean cohesion over time
+
+        The cohesion is the (Adjusted) Rice Index of each group on each poll,
+        and it's averaged over the polls inside each time window, ignoring
+        the polls where the group had less than two votes.
+
+        Args:
+            groupby (string): Column on the metadata to group the votes by.
+            period (string): "month", "year" or "legislative year" (from
+                February to January) to average over the calendar periods, or
+                a duration such as "30 days" to average over the polls in the
+                previous 30 days of each poll's date.
+            adjusted (bool): Use the Adjusted Rice Index. Defaults to True.
+
+        Returns:
+            DataFrame: The groups as columns, indexed by the periods' first
+                days, or by the polls' dates with a duration `period`.
+        """
+        if self.dates is None:
+            raise ValueError("the rollcall has no dates")
+
+        groups, rows, starts = self.__get_groups_rows(groupby)
+        rice_index = RiceIndex()
+        calculate = rice_index.calculate_from_counts
+        if adjusted:
+            calculate = rice_index.calculate_adjusted_from_counts
+        cohesion = np.empty((len(groups), len(self.data.columns)))
+        if len(groups):
+            votes = self.data.values[rows]
+            cohesion = calculate(
+                np.add.reduceat(votes == rice_index.yes, starts, axis=0,
+                                dtype=np.intp),
+                np.add.reduceat(votes == rice_index.no, starts, axis=0,
+                                dtype=np.intp),
+            )
+
+        # The polls are sorted by date, so each window is a contiguous range
+        dates = self.dates.values
+        columns = np.flatnonzero(~np.isnat(dates))
+        columns = columns[np.argsort(dates[columns], kind='mergesort')]
+        dates = dates[columns]
+        cohesion = cohesion[:, columns]
+        notnull = ~np.isnan(cohesion)
+        sums = np.concatenate([np.zeros((len(groups), 1)),
+                               np.cumsum(np.where(notnull, cohesion, 0),
+                                         axis=1)], axis=1)
+        counts = np.concatenate([np.zeros((len(groups), 1)),
+                                 np.cumsum(notnull, axis=1)], axis=1)
+
+        if period in self.PERIODS:
+            windows_dates, starts = np.unique(
+                self.__get_periods_starts(dates, period), return_index=True
+            )
+            ends = np.append(starts[1:], len(dates))[:len(starts)]
+        else:
+            duration = pd.Timedelta(period).to_timedelta64()
+            windows_dates = np.unique(dates)
+            starts = np.searchsorted(dates, windows_dates - duration, 'right')
+            ends = np.searchsorted(dates, windows_dates, 'right')
+
+        windows_counts = counts[:, ends] - counts[:, starts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(windows_counts > 0,
+                             (sums[:, ends] - sums[:, starts]) /
+                             windows_counts,
+                             np.nan)
+        return pd.DataFrame(means.T,
+                            index=pd.DatetimeIndex(windows_dates, name='date'),
+                            columns=groups)
+
+    def __get_periods_starts(self, dates, period):
+        months = dates.astype('datetime64[M]')
+        if period == "month":
+            starts = months
+        elif period == "year":
+            starts = months.astype('datetime64[Y]').astype('datetime64[M]')
+        else:
+            # The legislative year starts in February
+            starts = (months - 1).astype('datetime64[Y]')\
+                .astype('datetime64[M]') + 1
+        return starts.astype(dates.dtype)
+
+    def __categorize(self, metadata):
+        categorical_cols = {
+            column: metadata[column].astype('category')
+            for column in self.CATEGORICAL_COLUMNS
+            if column in metadata
+        }
+        return metadata.assign(**categorical_cols)
+
+    def __get_metadata_index(self, key):
+        """Returns a dict of `key`'s values to their sorted row positions
+
+        They're calculated once per column, and recalculated only when
+        `self.metadata` changes (e.g. after `filter`).
+        """
+        if self.__indexed_metadata is not self.metadata:
+            self.__metadata_index = {}
+            self.__indexed_metadata = self.metadata
+        if key not in self.__metadata_index:
+            column = pd.Categorical(self.metadata[key])
+            order = np.argsort(column.codes, kind='mergesort')
+            bounds = np.searchsorted(column.codes[order],
+                                     np.arange(len(column.categories)))
+            # The first split has the NaN values, which have code -1
+            positions = np.split(order, bounds)[1:]
+            self.__metadata_index[key] = dict(zip(column.categories,
+                                                  positions))
+        return self.__metadata_index[key]
+
+    def __get_groups_rows(self, groupby):
+        """Returns the (groups, rows, starts) of the `groupby` groups
+
+        `groups` is the sorted Index of the groups' values, `rows` the rows
+        positions sorted by their groups, and `starts` the position in `rows`
+        where each group starts, to be used with `np.add.reduceat`.
+        Legislators without a group (e.g. NaN) are ignored, as in groupby.
+        """
+        codes, groups = pd.factorize(self.metadata[groupby], sort=True)
+        groups = pd.Index(np.asarray(groups), name=groupby)
+        rows = np.flatnonzero(codes >= 0)
+        rows = rows[np.argsort(codes[rows], kind='mergesort')]
+        codes = codes[rows]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        return groups, rows, starts
+
     def __get_groups_median_votes(self, groupby):
-        def mode_removing_nulls(arr):
-            res = mode(arr[pd.notnull(arr)])[0]
-            if len(res):
-                return res[0]
-        return self.data.groupby(self.metadata[groupby])\
-                        .aggregate(mode_removing_nulls)
-
-
-# Copied from scipy.stats to avoid importing an entire library for a
-# single method
-# http://git.io/h1Pv
-def mode(a, axis=0):
-    a, axis = _chk_asarray(a, axis)
-    if a.size == 0:
-        return np.array([]), np.array([])
-
-    scores = np.unique(np.ravel(a))       # get ALL unique values
-    testshape = list(a.shape)
-    testshape[axis] = 1
-    oldmostfreq = np.zeros(testshape, dtype=a.dtype)
-    oldcounts = np.zeros(testshape, dtype=int)
-    for score in scores:
-        template = (a == score)
-        counts = np.expand_dims(np.sum(template, axis), axis)
-        mostfrequent = np.where(counts > oldcounts, score, oldmostfreq)
-        oldcounts = np.maximum(counts, oldcounts)
-        oldmostfreq = mostfrequent
-    return mostfrequent, oldcounts
-
-
-def _chk_asarray(a, axis):
-    if axis is None:
-        a = np.ravel(a)
-        outaxis = 0
-    else:
-        a = np.asarray(a)
-        outaxis = axis
-    return a, outaxis
+        """Returns each group's most common vote on each rollcall
+
+        NULL votes are ignored, and ties go to the lowest vote. The groups are
+        sorted and their votes counted for all rollcalls at once, one vote
+        value at a time. Groups without any non-NULL vote get NaN.
+        """
+        groups, rows, starts = self.__get_groups_rows(groupby)
+        medians = np.full((len(groups), len(self.data.columns)), np.nan)
+        if len(groups) == 0:
+            return pd.DataFrame(medians, index=groups,
+                                columns=self.data.columns)
+
+        votes = self.data.values[rows]
+        medians_counts = np.zeros(medians.shape, dtype=np.intp)
+        for value in self._vote_values(votes, self.notnull(votes)):
+            counts = np.add.reduceat(votes == value, starts, axis=0,
+                                     dtype=np.intp)
+            # The values are sorted, so ties keep the lowest one
+            more_common = counts > medians_counts
+            medians[more_common] = value
+            medians_counts = np.maximum(medians_counts, counts)
+
+        return pd.DataFrame(medians, index=groups, columns=self.data.columns)
+
+    @staticmethod
+    def _vote_values(votes, notnull):
+        """Returns the sorted distinct non-NULL values in `votes`
+
+        The votes are usually only NO (0) and YES (1), so np.unique is only
+        called when there're other values. NO and YES are always returned,
+        even if nobody voted them.
+        """
+        values = np.array([0, 1])
+        others = notnull & (votes != 0) & (votes != 1)
+        if others.any():
+            values = np.union1d(values, votes[others])
+        return values
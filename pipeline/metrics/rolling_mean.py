@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import csv
+import sys
+
+from pipeline.lazy import lazy_import
+from pipeline.metrics import series
+
+np = lazy_import('numpy')
+
+
+class WidthError(ValueError):
+    """A rolling window isn't between 1 and the number of values"""
+
+
+class RollingMean(object):
+    def __init__(self):
+        self.parser = self._create_parser()
+
+    def run(self, args=sys.argv[1:], output=sys.stdout):
+        """Calculates the rolling means of each row of a CSV
+
+        The input is usually the output of `bin/rice_index --metric`, with
+        polls as columns and a single row with their scores. For each row and
+        width, it writes the window means labelled by each window's last poll.
+        With `--input-format binary` and `--output-format binary`, the rows
+        are read and written as binary series (see `pipeline.metrics.series`).
+        """
+        options = self.parser.parse_args(args)
+        if options.input_format == "binary":
+            values, ids, dates = self._read_binary(options.input)
+        else:
+            values, ids = self._read_csv(options.input)
+            dates = None
+        if not len(values):
+            return
+
+        widths = sorted(options.width)
+        rows = values.reshape(-1, values.shape[-1])
+        means = np.full((len(rows) * len(widths),
+                         len(ids) - widths[0] + 1), np.nan)
+        for index, width_means in enumerate(self.calculate(rows, widths)):
+            # Each input row's widths are kept together, as in calculate_row
+            means[index::len(widths), width_means.shape[-1] * -1:] = \
+                width_means
+        ids = ids[widths[0] - 1:]
+        if dates is not None:
+            dates = dates[widths[0] - 1:]
+
+        if options.output_format == "binary":
+            series.write_series(getattr(output, "buffer", output),
+                                means, ids, dates)
+        else:
+            rows = series.series_to_rows(means, ids)
+            writer = csv.DictWriter(output, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def calculate(self, values, widths):
+        """Calculates the rolling means ignoring null values
+
+        The sums and counts of non-null values are accumulated only once, so
+        each window's mean is the difference between two of them, no matter
+        its width.
+
+        Args:
+            values (array-like): The series. If it's a 2D array, the rolling
+                means are calculated on each row.
+            widths (list of ints): The windows widths.
+
+        Returns:
+            list: A rolling means array for each width, in the same order.
+                Their last axis has `len(values) - width + 1` means, where the
+                first one is the mean of the first `width` values. A window
+                without any non-null value has NaN.
+
+        Raises:
+            WidthError: If a width isn't between 1 and `len(values)`.
+        """
+        values = np.asarray(values, dtype=float)
+        length = values.shape[-1]
+        for width in widths:
+            if not 0 < width <= length:
+                raise WidthError("can't calculate rolling mean with width %d "
+                                 "on %d values" % (width, length))
+
+        notnull = ~np.isnan(values)
+        zeros = np.zeros(values.shape[:-1] + (1,))
+        sums = np.concatenate(
+            [zeros, np.cumsum(np.where(notnull, values, 0), axis=-1)], axis=-1
+        )
+        counts = np.concatenate(
+            [zeros, np.cumsum(notnull, axis=-1)], axis=-1
+        )
+
+        result = []
+        for width in widths:
+            windows_sums = sums[..., width:] - sums[..., :-width]
+            windows_counts = counts[..., width:] - counts[..., :-width]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result.append(np.where(windows_counts > 0,
+                                       windows_sums / windows_counts,
+                                       np.nan))
+        return result
+
+    def calculate_row(self, row, widths):
+        """Calculates the rolling means of a poll to score dict
+
+        Args:
+            row (dict): Polls as keys and their scores as values, in order.
+                Empty strings and None are null.
+            widths (list of ints): The windows widths.
+
+        Returns:
+            list(OrderedDict): A dict for each width, sorted by width. Its keys
+                are the windows last polls, and its values the means (or None).
+        """
+        columns = list(row.keys())
+        values = [np.nan if value in ('', None) else value
+                  for value in row.values()]
+        widths = sorted(widths)
+
+        rows = []
+        for width, means in zip(widths, self.calculate(values, widths)):
+            means = [None if np.isnan(mean) else mean
+                     for mean in means.tolist()]
+            rows.append(collections.OrderedDict(zip(columns[width - 1:],
+                                                    means)))
+        return rows
+
+    def _read_csv(self, input_file):
+        if isinstance(input_file, str):
+            input_file = open(input_file, 'r', newline='')
+        with input_file:
+            rows = list(csv.DictReader(input_file))
+        ids = list(rows[0].keys()) if rows else []
+        rows = [[np.nan if row[key] in ('', None) else row[key]
+                 for key in ids] for row in rows]
+        return np.array(rows, dtype=float).reshape(len(rows), len(ids)), ids
+
+    def _read_binary(self, input_file):
+        if isinstance(input_file, str):
+            with open(input_file, 'rb') as binary_file:
+                return series.read_series(binary_file)
+        return series.read_series(getattr(input_file, "buffer", input_file))
+
+    def _create_parser(self):
+        parser = argparse.ArgumentParser(
+            description="Calculates the rolling means of a CSV's rows"
+        )
+        parser.add_argument(
+            "-i", "--input", type=str, default=sys.stdin,
+            help="input CSV file path (default: stdin)"
+        )
+        parser.add_argument(
+            "-w", "--width", nargs="+", type=int, default=[100],
+            help="rolling windows sizes, writing a row for each in "
+                 "ascending order (default: 100)"
+        )
+        parser.add_argument(
+            "--input-format", type=str, choices=series.FORMATS,
+            default="csv", help="input format (default: csv)"
+        )
+        parser.add_argument(
+            "--output-format", type=str, choices=series.FORMATS,
+            default="csv", help="output format (default: csv)"
+        )
+        return parser
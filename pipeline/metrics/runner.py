@@ -2,37 +2,126 @@
 
 import csv
 import argparse
+import json
 import sys
 import collections
 
-import numpy as np
-import pandas as pd
-
+from pipeline.lazy import lazy_import
+from pipeline.metrics.cache import ResultCache
 from pipeline.metrics.rice_index import RiceIndex
 from pipeline.metrics.rollcall import Rollcall
+from pipeline.metrics.rolling_mean import RollingMean, WidthError
+from pipeline.metrics import series
+from pipeline.metrics.store import VoteMatrixStore
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class Runner(object):
-    def __init__(self):
+    METRICS = ["rice_index", "adjusted_rice_index"]
+    FILTERS = ["name", "party", "state"]
+
+    def __init__(self, cache=None):
+        """Args:
+            cache (ResultCache): Cache for `main`'s results and intermediates.
+                Defaults to None.
+        """
         self.parser = self._create_parser()
+        self.cache = cache
 
     def run(self, args=sys.argv[1:], output=sys.stdout):
         options = self.parser.parse_args(args)
-        result = self.main(options.input,
-                           options.majority_percentual,
-                           options.groupby,
-                           self._get_metric_method(options.metric),
-                           name=options.name,
-                           party=options.party,
-                           state=options.state)
+        if options.cache_dir:
+            self.cache = ResultCache(options.cache_dir,
+                                     options.cache_size * 2 ** 20)
+        if options.rolling_window and not options.metric:
+            self.parser.error("--rolling-window requires --metric")
+        if options.rolling_window and min(options.rolling_window) < 1:
+            self.parser.error("--rolling-window must be positive")
+        if options.output_format == "binary" and not options.metric:
+            self.parser.error("--output-format binary requires --metric")
+        if options.period and not (options.metric and options.groupby):
+            self.parser.error("--period requires --metric and --groupby")
+        if options.batch:
+            with open(options.batch, 'r') as specs_file:
+                self.run_batch(options.input, specs_file)
+            return
 
-        writer = csv.DictWriter(output, fieldnames=result[0].keys())
-        writer.writeheader()
-        writer.writerows(result)
+        if options.period:
+            result = self.main_by_period(
+                options.input, options.period, options.groupby,
+                options.majority_percentual,
+                options.metric == "adjusted_rice_index",
+                options.rollcalls_input,
+                name=options.name, party=options.party, state=options.state
+            )
+            self._write_result(result, output)
+            return
+
+        try:
+            result = self.main(options.input,
+                               options.majority_percentual,
+                               options.groupby,
+                               self._get_metric_method(options.metric),
+                               options.rolling_window,
+                               name=options.name,
+                               party=options.party,
+                               state=options.state)
+        except WidthError as error:
+            # The number of polls is only known after removing the unanimous
+            # votes, so a window wider than them can't be checked before
+            self.parser.error("--rolling-window: %s" % error)
+        if options.output_format == "binary":
+            values, ids = series.rows_to_series(result)
+            dates = self._get_dates(ids, options.input,
+                                    options.rollcalls_input)
+            series.write_series(getattr(output, "buffer", output),
+                                values, ids, dates)
+        else:
+            self._write_result(result, output)
+
+    def run_batch(self, csv_path, specs_file):
+        """Runs many queries over the same votes, reading them only once
+
+        The votes are read once, the unanimous votes are removed once per
+        `majority_percentual`, and every query is filtered from them.
+
+        Args:
+            csv_path (string): The votes, as in `main`.
+            specs_file (file): JSON lines file with a query per line. Their
+                "output" is the path where the query's CSV is written, and
+                the other keys are the same as the command line options
+                (all optional). Example:
+                    {"output": "pt.csv", "party": ["PT"], "groupby": "party",
+                     "metric": "adjusted_rice_index",
+                     "majority_percentual": 0.975}
+        """
+        specs = list(self._parse_specs(specs_file))
+        rollcall = self._read_rollcall(csv_path)
+
+        rollcalls_without_unanimous = {}
+        for spec in specs:
+            majority_percentual = spec["majority_percentual"]
+            if majority_percentual not in rollcalls_without_unanimous:
+                rollcalls_without_unanimous[majority_percentual] = \
+                    Rollcall(rollcall.data, rollcall.metadata)\
+                    .remove_unanimous_votes(majority_percentual)
+
+            filters = {key: spec[key] for key in self.FILTERS}
+            votes = rollcalls_without_unanimous[majority_percentual]\
+                .select(filters)\
+                .median_votes_groupped_by(spec["groupby"])
+            result = self._calculate(votes, spec["groupby"],
+                                     self._get_metric_method(spec["metric"]),
+                                     spec["rolling_window"])
+            with open(spec["output"], 'w', newline='') as output:
+                self._write_result(result, output)
 
     def main(self, csv_path,
              majority_percentual=None, groupby=None,
-             metric_method=RiceIndex().calculate_adjusted, **filters):
+             metric_method=RiceIndex().calculate_adjusted,
+             rolling_windows=None, **filters):
         """Calculates the adjusted Rice Index polls contained in a CSV
 
         Args:
@@ -42,6 +131,7 @@ class Runner(object):
                     poll1,poll2,poll3
                     0,,1
                     1,1,1
+                It can also be the path to a `VoteMatrixStore` directory.
             majority_percentual (float): Removes votes where the majority was
                 greater than this percentual. Defaults to None.
             groupby (string): Column on the metadata to group the votes by.
@@ -52,6 +142,9 @@ class Runner(object):
             metric_method (function): Method that receives a list of votes and
                 returns a score. For an example, check RiceIndex().calculate.
                 Defaults to RiceIndex().calculate_adjusted.
+            rolling_windows (list of ints): Widths of the rolling means to
+                calculate on the metric scores (see `RollingMean`), instead of
+                returning them. Defaults to None.
             filters (kwargs): dict of filters to limit which votes we consider
                 when calculating the metric. Defaults to None.
 
@@ -59,28 +152,134 @@ class Runner(object):
             list(OrderedDict): A list of dicts with each poll name in the keys
                 and the resulting metric score in the values. If there's no
                 `metric_method`, it'll simply remove unanimous votes, apply
-                groups and filters.
+                groups and filters. With `rolling_windows`, there's a dict
+                per width, sorted by width, with the rolling means labelled
+                by each window's last poll.
+
+            If the runner has a cache, the results are cached by the input's
+            contents and the parameters, as are the polls kept after removing
+            the unanimous votes and the groups' votes, which are reused by
+            calls with other metrics.
         """
-        votes = Rollcall.from_csv(csv_path)\
-                        .remove_unanimous_votes(majority_percentual)\
-                        .filter(filters)\
-                        .median_votes_groupped_by(groupby)
+        filters = {key: sorted(values)
+                   for key, values in filters.items() if values}
+        digest = None
+        if self.cache is not None and isinstance(csv_path, str):
+            digest = self.cache.digest(csv_path)
 
+        def calculate():
+            votes = self._get_votes(csv_path, majority_percentual, groupby,
+                                    filters, digest)
+            return self._calculate(votes, groupby, metric_method,
+                                   rolling_windows)
+
+        metric_name = self._get_metric_name(metric_method)
+        if digest is None or metric_name is False:
+            return calculate()
+        key = ["result", digest, majority_percentual, groupby, metric_name,
+               sorted(rolling_windows or []), filters]
+        return self.cache.get_or_compute(key, calculate)
+
+    def _get_votes(self, csv_path, majority_percentual, groupby, filters,
+                   digest=None):
+        """Returns the votes grouped by `groupby`, caching the intermediates
+
+        Without a `digest` of the input, nothing is cached.
+        """
+        if digest is None:
+            return self._read_rollcall(csv_path)\
+                       .remove_unanimous_votes(majority_percentual)\
+                       .filter(filters)\
+                       .median_votes_groupped_by(groupby)
+
+        def calculate_votes():
+            rollcall = self._read_rollcall(csv_path)
+            columns = self.cache.get_or_compute(
+                ["not_unanimous_columns", digest, majority_percentual],
+                lambda: rollcall.not_unanimous_columns(majority_percentual)
+            )
+            return rollcall.keep_columns(columns)\
+                           .filter(filters)\
+                           .median_votes_groupped_by(groupby)
+
+        if not groupby:
+            # The ungrouped votes are the whole matrix, not worth caching
+            return calculate_votes()
+        key = ["votes", digest, majority_percentual, groupby, filters]
+        return self.cache.get_or_compute(key, calculate_votes)
+
+    def _get_metric_name(self, metric_method):
+        """Returns a name identifying `metric_method` in the cache keys
+
+        It's False if it can't be identified (e.g. lambdas).
+        """
+        if metric_method is None:
+            return None
+        metric = getattr(metric_method, '__self__', None)
+        if isinstance(metric, RiceIndex):
+            return [metric_method.__name__, metric.yes, metric.no]
+        name = '%s.%s' % (getattr(metric_method, '__module__', None),
+                          getattr(metric_method, '__qualname__', None))
+        if '<' in name or metric is not None:
+            return False
+        return name
+
+    def _calculate(self, votes, groupby, metric_method, rolling_windows=None):
         if metric_method:
             metrics = self.calculate_metric(votes, metric_method)
-            return [collections.OrderedDict(zip(votes.columns, metrics))]
+            result = collections.OrderedDict(zip(votes.columns, metrics))
+            if rolling_windows:
+                return RollingMean().calculate_row(result, rolling_windows)
+            return [result]
 
         if groupby:
             votes.insert(0, groupby, votes.index)
 
         rows = []
         columns = votes.columns.tolist()
-        replace_nan_with_none = lambda df: df.where(pd.notnull(df), None)
+        replace_nan_with_none = lambda df: df.astype(object)\
+                                             .where(Rollcall.notnull(df), None)
         for row in replace_nan_with_none(votes).itertuples(False):
             row = [self._convert_to_int_if_possible(r) for r in row]
             rows.append(collections.OrderedDict(zip(columns, row)))
         return rows
 
+    def main_by_period(self, csv_path, period, groupby,
+                       majority_percentual=None, adjusted=True,
+                       rollcalls_csv_path=None, **filters):
+        """Calculates each group's cohesion over time
+
+        Args:
+            csv_path (string): The votes, as in `main`. If it's a CSV, the
+                rollcalls dates are read from `rollcalls_csv_path`.
+            period (string): The time windows (see
+                `Rollcall.cohesion_by_period`).
+            groupby (string): Column on the metadata to group the votes by.
+            majority_percentual (float): As in `main`. Defaults to None.
+            adjusted (bool): Use the Adjusted Rice Index instead of the Rice
+                Index. Defaults to True.
+            rollcalls_csv_path (string): The rollcalls metadata CSV, with their
+                `id` and `data`. Defaults to None.
+            filters (kwargs): As in `main`.
+
+        Returns:
+            list(OrderedDict): A dict per window, with its `date` and each
+                group's cohesion (or None).
+        """
+        cohesion = self._read_rollcall(csv_path, rollcalls_csv_path)\
+                       .remove_unanimous_votes(majority_percentual)\
+                       .filter(filters)\
+                       .cohesion_by_period(groupby, period, adjusted)
+
+        rows = []
+        columns = ["date"] + cohesion.columns.tolist()
+        for date, values in zip(cohesion.index, cohesion.values.tolist()):
+            values = [None if np.isnan(value) else value for value in values]
+            rows.append(collections.OrderedDict(
+                zip(columns, [date.isoformat()] + values)
+            ))
+        return rows
+
     def calculate_metric(self, votes, metric_method):
         """Takes list of poll votes and returns result of metric on each poll.
 
@@ -102,12 +301,119 @@ class Runner(object):
 
         if (len(votes) != 0):
             votes = np.array(votes)
+            matrix_method = self._get_matrix_method(metric_method)
+            if matrix_method:
+                return matrix_method(votes)
             for column_index in range(0, len(votes[0])):
                 the_votes = votes[:, column_index]
                 result.append(metric_method(the_votes))
 
         return result
 
+    def _get_matrix_method(self, metric_method):
+        """Returns the whole-matrix version of the built-in metrics
+
+        They calculate the metric on every poll at once, instead of calling
+        `metric_method` for each one.
+        """
+        metric = getattr(metric_method, '__self__', None)
+        if isinstance(metric, RiceIndex):
+            method_name = metric_method.__name__ + '_matrix'
+            return getattr(metric, method_name, None)
+
+    def _parse_specs(self, specs_file):
+        defaults = {
+            "metric": None,
+            "majority_percentual": None,
+            "groupby": None,
+            "rolling_window": None,
+            "name": [],
+            "party": [],
+            "state": [],
+        }
+        for line_number, line in enumerate(specs_file, 1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            unknown_keys = set(spec) - set(defaults) - {"output"}
+            if "output" not in spec:
+                raise ValueError('line %d: missing "output"' % line_number)
+            if unknown_keys:
+                raise ValueError('line %d: unknown keys %s' %
+                                 (line_number, sorted(unknown_keys)))
+            if isinstance(spec.get("rolling_window"), int):
+                spec["rolling_window"] = [spec["rolling_window"]]
+            spec = dict(defaults, **spec)
+            error = self._check_spec(spec)
+            if error:
+                raise ValueError('line %d: %s' % (line_number, error))
+            yield spec
+
+    def _check_spec(self, spec):
+        """Returns what's wrong with a spec's values, or None if nothing is
+
+        The values are checked like the command line options, so a typo
+        (e.g. a filter that isn't a list) isn't silently a different query.
+        """
+        def is_number(value):
+            return isinstance(value, (int, float)) and \
+                not isinstance(value, bool)
+
+        if not isinstance(spec["output"], str):
+            return '"output" must be a path'
+        if spec["metric"] not in self.METRICS + [None]:
+            return 'invalid metric "%s"' % spec["metric"]
+        if spec["groupby"] not in Rollcall.METADATA_COLUMNS + [None]:
+            return 'invalid groupby "%s", it must be one of %s' % \
+                (spec["groupby"], Rollcall.METADATA_COLUMNS)
+        for key in self.FILTERS:
+            if not isinstance(spec[key], list) or \
+                    not all(isinstance(value, str) for value in spec[key]):
+                return '"%s" must be a list of strings' % key
+        majority_percentual = spec["majority_percentual"]
+        if majority_percentual is not None and \
+                not (is_number(majority_percentual) and
+                     0 <= majority_percentual <= 1):
+            return '"majority_percentual" must be a number from 0 to 1'
+        rolling_window = spec["rolling_window"]
+        if rolling_window is not None:
+            if not spec["metric"]:
+                return '"rolling_window" requires "metric"'
+            if not isinstance(rolling_window, list) or not rolling_window or \
+                    not all(isinstance(width, int) and
+                            not isinstance(width, bool) and width > 0
+                            for width in rolling_window):
+                return '"rolling_window" must be a positive integer or a ' \
+                    'list of them'
+
+    def _write_result(self, result, output):
+        writer = csv.DictWriter(output, fieldnames=result[0].keys())
+        writer.writeheader()
+        writer.writerows(result)
+
+    def _read_rollcall(self, path, rollcalls_csv_path=None):
+        if isinstance(path, str) and VoteMatrixStore.is_store(path):
+            return Rollcall.from_store(path)
+        return Rollcall.from_csv(path, rollcalls_csv_path)
+
+    def _get_dates(self, ids, path, rollcalls_csv_path=None):
+        """Returns the `ids` rollcalls' dates, or None if they're unknown
+
+        They're read from `rollcalls_csv_path` or, if `path` is a store,
+        from its rollcalls. The rollcalls without a date get NaT.
+        """
+        if rollcalls_csv_path is not None:
+            rollcalls = pd.read_csv(rollcalls_csv_path)
+        elif isinstance(path, str) and VoteMatrixStore.is_store(path):
+            _, _, rollcalls = VoteMatrixStore(path).read()
+        else:
+            return None
+        if 'data' not in rollcalls:
+            return None
+        dates = pd.Series(pd.to_datetime(rollcalls['data']).values,
+                          index=rollcalls['id'].astype(str))
+        return dates.reindex([str(the_id) for the_id in ids]).values
+
     def _get_metric_method(self, method_name):
         if method_name == "rice_index":
             return RiceIndex().calculate
@@ -128,11 +434,12 @@ class Runner(object):
         )
         parser.add_argument(
             "--input", type=str, default=sys.stdin,
-            help="path for CSV with polls as columns and rows with votes"
+            help="path for CSV with polls as columns and rows with votes, or "
+                 "for a votes store directory (see --store-output-path in "
+                 "votes_to_csv)"
         )
         parser.add_argument(
-            "--metric", type=str,
-            choices=["rice_index", "adjusted_rice_index"],
+            "--metric", type=str, choices=self.METRICS,
             help="defines the metric algorithm to calculate (default: None)"
         )
         parser.add_argument(
@@ -155,4 +462,46 @@ class Runner(object):
             "--state", nargs="*", type=str, default=[],
             help="states to use when calculating cohesion (default: all)"
         )
+        parser.add_argument(
+            "--rolling-window", nargs="+", type=int, default=None,
+            help="write the rolling means of the metric with these windows "
+                 "sizes, a row for each in ascending order (default: None)"
+        )
+        parser.add_argument(
+            "--period", type=str,
+            help="write each group's mean cohesion per period (month, year "
+                 "or \"legislative year\") or over the polls in a duration "
+                 "(e.g. \"30 days\") before each date (default: None)"
+        )
+        parser.add_argument(
+            "--rollcalls-input", type=str,
+            help="path for the rollcalls CSV with their dates, as written by "
+                 "bin/votes_to_csv, used by --period when --input is a CSV "
+                 "and by --output-format binary"
+        )
+        parser.add_argument(
+            "--output-format", type=str, choices=series.FORMATS,
+            default="csv",
+            help="write the metric as CSV or as a binary series, which "
+                 "bin/rollmean and bin/change_points read with "
+                 "--input-format binary. The series has the rollcalls' dates "
+                 "if --input is a store or with --rollcalls-input, and only "
+                 "their ids otherwise (default: csv)"
+        )
+        parser.add_argument(
+            "--cache-dir", type=str,
+            help="directory where the results are cached, by the input's "
+                 "contents and the options (default: None)"
+        )
+        parser.add_argument(
+            "--cache-size", type=int, default=1024,
+            help="cache size in MB, removing the least recently used "
+                 "results when it's larger (default: 1024)"
+        )
+        parser.add_argument(
+            "--batch", type=str,
+            help="path for a JSON lines file with a query per line, each "
+                 "written to its \"output\" path. The votes are read only "
+                 "once, and the other options but --input are ignored"
+        )
         return parser
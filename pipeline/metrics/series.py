@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Binary format for the series passed between the pipeline stages
+
+It's a JSON header line followed by the arrays it lists, each in the .npy
+format:
+    values: float64 matrix with a row per series and a column per rollcall,
+        with NaN for null values.
+    ids: the rollcalls' IDs (int64 if they're all numbers).
+    dates: optional, the rollcalls' dates as datetime64.
+
+Unlike a .npy file with a JSON sidecar, it can be written to and read from a
+pipe, and the values are never converted to text.
+"""
+
+import collections
+import io
+import json
+
+from pipeline.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+FORMATS = ["csv", "binary"]
+HEADER = {"format": "pipeline.series", "version": 1}
+
+
+def write_series(output, values, ids, dates=None):
+    """Writes the series to a binary file object
+
+    Args:
+        output (file): A binary file object (e.g. `sys.stdout.buffer`).
+        values (2D array-like): A row per series and a column per rollcall,
+            with NaN or None for null values.
+        ids (list): The rollcalls' IDs.
+        dates (list): The rollcalls' dates. Defaults to None.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values.reshape(1, -1)
+    arrays = collections.OrderedDict([
+        ("values", values),
+        ("ids", _encode_ids(ids)),
+    ])
+    if dates is not None:
+        arrays["dates"] = np.asarray(dates, dtype="datetime64[s]")
+    if values.shape[1] != len(arrays["ids"]):
+        raise ValueError("there're %d values columns but %d ids" %
+                         (values.shape[1], len(arrays["ids"])))
+
+    header = dict(HEADER, arrays=list(arrays.keys()))
+    output.write((json.dumps(header) + "\n").encode("utf-8"))
+    for array in arrays.values():
+        # np.save() might seek or use file descriptors, which pipes don't
+        # support, so the array is serialized in memory first
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        output.write(buffer.getvalue())
+    output.flush()
+
+
+def read_series(input_file):
+    """Reads a binary file object written by `write_series`
+
+    Returns:
+        tuple: (values, ids, dates), where `dates` is None if they weren't
+            written.
+    """
+    header = json.loads(input_file.readline().decode("utf-8") or "{}")
+    if any(header.get(key) != value for key, value in HEADER.items()):
+        raise ValueError("the input isn't a binary series")
+
+    arrays = {name: _read_array(input_file) for name in header["arrays"]}
+    return arrays["values"], arrays["ids"], arrays.get("dates")
+
+
+def rows_to_series(rows):
+    """Converts a list of poll to value dicts to (values, ids)
+
+    The columns are the first row's keys, as in `csv.DictWriter`, and the
+    missing keys and None values are NaN.
+    """
+    ids = list(rows[0].keys()) if rows else []
+    values = np.array([[row.get(key) for key in ids] for row in rows],
+                      dtype=float).reshape(len(rows), len(ids))
+    return values, ids
+
+
+def series_to_rows(values, ids):
+    """Converts (values, ids) to a list of poll to value dicts
+
+    The NaN values are None.
+    """
+    ids = np.asarray(ids).tolist()
+    rows = []
+    for row in np.asarray(values, dtype=float).tolist():
+        row = [None if np.isnan(value) else value for value in row]
+        rows.append(collections.OrderedDict(zip(ids, row)))
+    return rows
+
+
+def _encode_ids(ids):
+    try:
+        return np.asarray(ids, dtype=np.int64)
+    except ValueError:
+        return np.asarray(ids, dtype=str)
+
+
+def _read_array(input_file):
+    version = np.lib.format.read_magic(input_file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = \
+            np.lib.format.read_array_header_1_0(input_file)
+    else:
+        shape, fortran_order, dtype = \
+            np.lib.format.read_array_header_2_0(input_file)
+    if dtype.hasobject:
+        raise ValueError("the series can't have object arrays")
+
+    size = dtype.itemsize * int(np.prod(shape))
+    data = input_file.read(size)
+    if len(data) != size:
+        raise ValueError("the series ended unexpectedly")
+    order = "F" if fortran_order else "C"
+    return np.frombuffer(data, dtype=dtype).reshape(shape, order=order)
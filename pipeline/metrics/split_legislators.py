@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import multiprocessing
+
+from pipeline.lazy import lazy_import
+from pipeline.metrics.store import MISSING
+
+np = lazy_import('numpy')
+
+
+# A legislator's row position, split between the window's `start` and `mid`
+# columns (inclusive) and the ones after `mid`, up to `end` (inclusive)
+Split = collections.namedtuple('Split', ['legislator', 'start', 'mid', 'end'])
+
+
+class SplitLegislators(object):
+    """Splits each legislator in two rows, before and after a rollcall
+
+    It's what the behaviour change analysis estimates for every legislator
+    and window: the window's votes, where one legislator's row is replaced by
+    their votes up to a rollcall and their votes after it. Instead of copying
+    the votes for each legislator, every `SplitLegislatorView` shares the
+    rollcall's votes matrix and only has the two new rows.
+
+    Args:
+        rollcall (Rollcall): The votes. If it was read with
+            `Rollcall.from_store`, the votes are used memory-mapped.
+    """
+    def __init__(self, rollcall):
+        # The votes are converted to a single array only once. It's already
+        # one if they come from a store, so there's no copy at all.
+        self.votes = np.asarray(rollcall.data.values)
+        self.metadata = rollcall.metadata
+
+    def splits(self, windows, legislators=None):
+        """Yields a `Split` for each window and legislator, lazily
+
+        Args:
+            windows (iterable): (start, mid, end) column positions. The
+                "before" row has the votes from `start` to `mid`, and the
+                "after" row the ones after `mid` up to `end`.
+            legislators (iterable): The legislators' row positions. Defaults
+                to every legislator.
+        """
+        if legislators is None:
+            legislators = range(self.votes.shape[0])
+        legislators = list(legislators)
+        for start, mid, end in windows:
+            if not 0 <= start <= mid <= end < self.votes.shape[1]:
+                raise ValueError("invalid window (%d, %d, %d) for %d "
+                                 "rollcalls" % (start, mid, end,
+                                                self.votes.shape[1]))
+            for legislator in legislators:
+                yield Split(legislator, start, mid, end)
+
+    def views(self, windows, legislators=None):
+        """Yields a `SplitLegislatorView` for each window and legislator"""
+        for split in self.splits(windows, legislators):
+            yield self.view(split)
+
+    def view(self, split):
+        return SplitLegislatorView(self.votes, split)
+
+    def map(self, function, windows, legislators=None, jobs=1):
+        """Yields each split's `(split, function(view))`
+
+        With `jobs` larger than 1, the views are built and passed to
+        `function` on a process pool. The workers are forked with the votes
+        matrix, which isn't copied (nor pickled) for each split. The results
+        are yielded as they're finished, so they might be out of order.
+
+        Args:
+            function (function): Receives a `SplitLegislatorView`. It must be
+                picklable (e.g. a module's function) if `jobs` > 1.
+            windows (iterable): See `splits`.
+            legislators (iterable): See `splits`.
+            jobs (int): Number of processes. Defaults to 1.
+        """
+        splits = self.splits(windows, legislators)
+        if jobs <= 1:
+            for split in splits:
+                yield split, function(self.view(split))
+            return
+
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                    initargs=(self, function))
+        try:
+            for result in pool.imap_unordered(_apply, splits):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class SplitLegislatorView(object):
+    """A window's votes with a legislator split in two rows
+
+    Its rows are the other legislators, in order, followed by the
+    legislator's votes before and after the split. The votes the legislator
+    couldn't have cast in each row are missing (NaN, or `MISSING` for integer
+    votes), as the R scripts' "not in legislature" code.
+
+    `votes` is a view of the window's columns on the shared matrix, and only
+    `before` and `after` are new arrays. Use `np.asarray(view)` to get the
+    whole matrix.
+    """
+    def __init__(self, votes, split):
+        self.split = split
+        self.votes = votes[:, split.start:split.end + 1]
+
+        legislator_votes = self.votes[split.legislator]
+        missing = np.nan if votes.dtype.kind == 'f' else MISSING
+        before_mid = np.arange(self.votes.shape[1]) <= split.mid - split.start
+        self.before = np.where(before_mid, legislator_votes, missing)\
+                        .astype(votes.dtype)
+        self.after = np.where(before_mid, missing, legislator_votes)\
+                       .astype(votes.dtype)
+
+    @property
+    def shape(self):
+        return (self.votes.shape[0] + 1, self.votes.shape[1])
+
+    @property
+    def others(self):
+        """The other legislators' row positions, in the view's order"""
+        legislator = self.split.legislator
+        return np.r_[0:legislator, legislator + 1:self.votes.shape[0]]
+
+    def __array__(self, dtype=None):
+        legislator = self.split.legislator
+        result = np.concatenate([self.votes[:legislator],
+                                 self.votes[legislator + 1:],
+                                 [self.before, self.after]])
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+
+
+_worker = None
+
+
+def _init_worker(split_legislators, function):
+    global _worker
+    _worker = (split_legislators, function)
+
+
+def _apply(split):
+    split_legislators, function = _worker
+    return split, function(split_legislators.view(split))
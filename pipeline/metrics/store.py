@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from pipeline.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+MISSING = -1
+
+
+class VoteMatrixStore(object):
+    """Binary store for a legislature's legislators x rollcalls votes
+
+    It's a directory with:
+        votes.npy: int8 matrix with a row per legislator and a column per
+            rollcall. The votes are 1 for YES, 0 for NO and `MISSING` if the
+            legislator didn't vote. It's opened memory-mapped, so reading it
+            doesn't load (nor copy) the votes.
+        legislators.csv: the rows' metadata (id, name, party and state).
+        rollcalls.csv: the columns' metadata. It has at least their IDs, and
+            usually their dates as well (id, data).
+    """
+    VOTES_FILENAME = 'votes.npy'
+    LEGISLATORS_FILENAME = 'legislators.csv'
+    ROLLCALLS_FILENAME = 'rollcalls.csv'
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """Returns a (votes, legislators, rollcalls) tuple
+
+        `votes` is a read-only memory-mapped array, and the others are
+        DataFrames.
+        """
+        votes = np.load(self._path(self.VOTES_FILENAME), mmap_mode='r')
+        legislators = pd.read_csv(self._path(self.LEGISLATORS_FILENAME))
+        rollcalls = pd.read_csv(self._path(self.ROLLCALLS_FILENAME))
+        return votes, legislators, rollcalls
+
+    def write(self, votes, legislators, rollcalls):
+        """Saves the votes matrix and its metadata
+
+        Args:
+            votes (2D array-like): The votes, with NaN, None or `MISSING`
+                when the legislator didn't vote.
+            legislators (DataFrame): One row per `votes` row.
+            rollcalls (DataFrame): One row per `votes` column, with at least
+                an `id` column.
+        """
+        shape = (len(legislators), len(rollcalls))
+        votes = np.asarray(votes, dtype=float)
+        if votes.size == 0:
+            votes = votes.reshape(shape)
+        if votes.shape != shape:
+            raise ValueError('votes shape %s doesn\'t match the metadata %s' %
+                             (votes.shape, shape))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        np.save(self._path(self.VOTES_FILENAME), encode_votes(votes))
+        legislators.to_csv(self._path(self.LEGISLATORS_FILENAME), index=False)
+        rollcalls.to_csv(self._path(self.ROLLCALLS_FILENAME), index=False)
+
+    @classmethod
+    def is_store(cls, path):
+        return os.path.isfile(os.path.join(path, cls.VOTES_FILENAME))
+
+    def _path(self, filename):
+        return os.path.join(self.path, filename)
+
+
+def encode_votes(votes):
+    """Converts votes to the store's int8, with NaN and None as `MISSING`"""
+    votes = np.asarray(votes, dtype=float)
+    return np.where(pd.notnull(votes), votes, MISSING).astype(np.int8)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import collections
+import csv
+import datetime
+import multiprocessing
+import os
+import pickle
+import struct
+
+from pipeline.metrics.split_legislators import SplitLegislators
+
+
+# The rollcalls' ids where a window starts, is split and ends
+Window = collections.namedtuple('Window', ['start', 'mid', 'end'])
+
+
+class WindowScheduler(object):
+    """Schedules the behaviour change analysis' windows over the rollcalls
+
+    A window's dates are resolved to the rollcalls closest to them, as the R
+    script does, but by bisecting an index of the days with rollcalls instead
+    of scanning every rollcall's date. Windows resolved to the same rollcalls
+    are the same window, so each one is estimated only once.
+
+    Args:
+        rollcalls (iterable): (id, datetime) of each rollcall. Their order on
+            the same date is kept.
+    """
+    def __init__(self, rollcalls):
+        rollcalls = sorted(rollcalls, key=lambda rollcall: rollcall[1])
+        self.ids = [rollcall_id for rollcall_id, _ in rollcalls]
+        self._dates = [date for _, date in rollcalls]
+        self._indexes = _indexes(self.ids)
+
+        # The days with rollcalls, with the positions of their earliest and
+        # latest rollcall (the first one, if there're many at that time)
+        self._days = []
+        self._earliest = []
+        self._latest = []
+        for position, (_, date) in enumerate(rollcalls):
+            if not self._days or self._days[-1] != date.date():
+                self._days.append(date.date())
+                self._earliest.append(position)
+                self._latest.append(position)
+            elif date > rollcalls[self._latest[-1]][1]:
+                self._latest[-1] = position
+
+    @classmethod
+    def from_csv(cls, path, ids=None):
+        """Reads the rollcalls from a `-votacoes.csv` file
+
+        Args:
+            path (string): The CSV path, with the rollcalls' `id` and `data`.
+            ids (iterable): Only keep these rollcalls, e.g. the votes' columns
+                left after removing the nearly unanimous ones. Defaults to
+                every rollcall.
+        """
+        if ids is not None:
+            ids = set(str(rollcall_id) for rollcall_id in ids)
+        with open(path, 'r', newline='', encoding='utf-8') as csv_file:
+            rollcalls = [
+                (row['id'], datetime.datetime.fromisoformat(row['data']))
+                for row in csv.DictReader(csv_file)
+                if ids is None or row['id'] in ids
+            ]
+        return cls(rollcalls)
+
+    def vote_after(self, date):
+        """Latest rollcall on the first day with rollcalls from `date` on"""
+        index = bisect.bisect_left(self._days, _day(date))
+        if index < len(self._days):
+            return self.ids[self._latest[index]]
+
+    def vote_before(self, date):
+        """Earliest rollcall on the last day with rollcalls up to `date`"""
+        index = bisect.bisect_right(self._days, _day(date)) - 1
+        if index >= 0:
+            return self.ids[self._earliest[index]]
+
+    def closest_vote(self, date):
+        """Rollcall on the day with rollcalls closest to `date`
+
+        It's the earliest rollcall on that day if it's not after `date`, or
+        the latest one otherwise. As in the R script, a `date` without time
+        is its midnight, so on its own day it's the latest rollcall. On ties,
+        the day before `date` wins.
+        """
+        day = _day(date)
+        index = bisect.bisect_left(self._days, day)
+        candidates = [i for i in (index - 1, index)
+                      if 0 <= i < len(self._days)]
+        if not candidates:
+            return None
+        index = min(candidates, key=lambda i: abs(self._days[i] - day))
+        if self._dates[self._earliest[index]] <= _datetime(date):
+            return self.ids[self._earliest[index]]
+        return self.ids[self._latest[index]]
+
+    def window(self, start_date, mid_date, end_date):
+        """Returns the dates' `Window`, or None if there's none
+
+        There's none if there're no rollcalls between the dates, or if the
+        rollcall closest to `mid_date` isn't between them.
+        """
+        window = Window(self.vote_after(start_date),
+                        self.closest_vote(mid_date),
+                        self.vote_before(end_date))
+        if None in window:
+            return None
+        positions = self.positions(window)
+        if not positions[0] <= positions[1] <= positions[2]:
+            return None
+        return window
+
+    def windows(self, first_start, last_start, mid_months=6, end_months=12):
+        """Returns the unique windows starting every month
+
+        Args:
+            first_start (date): The first window's start.
+            last_start (date): The last window's start (inclusive).
+            mid_months (int): Months from the start to the split. Defaults
+                to 6.
+            end_months (int): Months from the start to the end. Defaults to
+                12.
+        """
+        windows = collections.OrderedDict()
+        start_date = first_start
+        months = 0
+        while start_date <= last_start:
+            window = self.window(start_date,
+                                 _add_months(first_start, months + mid_months),
+                                 _add_months(first_start, months + end_months))
+            if window is not None:
+                windows[window] = None
+            months += 1
+            start_date = _add_months(first_start, months)
+        return list(windows)
+
+    def positions(self, window, columns=None):
+        """Returns the window's (start, mid, end) positions
+
+        Args:
+            window (Window): The window.
+            columns (iterable): The votes' columns (the rollcalls' ids). They
+                must be sorted by date, like the `votes_to_csv` output.
+                Defaults to this scheduler's rollcalls, by date.
+        """
+        indexes = self._indexes if columns is None else _indexes(columns)
+        return tuple(indexes[str(rollcall_id)] for rollcall_id in window)
+
+    def run(self, function, rollcall, windows, checkpoint_path,
+            legislators=None, jobs=1):
+        """Calls `function` on each window's split legislators
+
+        Each window is a task for the worker pool, so the work every
+        legislator shares in a window (like `SplitIdealPoints`' window fit)
+        is done only once. Each finished (window, legislator) unit is
+        written to a checkpoint right away, so when it's run again (e.g.
+        after a crash), only the units that weren't finished are computed.
+
+        Args:
+            function (function): See `SplitLegislators.map`, like a
+                `SplitIdealPoints`.
+            rollcall (Rollcall): The votes, with the rollcalls as columns.
+            windows (iterable): The `Window`s.
+            checkpoint_path (string): The checkpoint file.
+            legislators (iterable): The legislators' row positions. Defaults
+                to every legislator.
+            jobs (int): Number of processes. Defaults to 1.
+
+        Returns:
+            dict: The results by (window, legislator's id). The legislator's
+                id is their row position if the rollcall has no `id`.
+        """
+        columns = [str(column) for column in rollcall.data.columns]
+        self._check_order(columns)
+        if 'id' in rollcall.metadata:
+            legislator_ids = rollcall.metadata['id'].tolist()
+        else:
+            legislator_ids = list(range(len(rollcall.data)))
+        if legislators is None:
+            legislators = range(len(legislator_ids))
+        legislators = list(legislators)
+
+        checkpoint = Checkpoint(checkpoint_path)
+        results = checkpoint.read()
+        tasks = []
+        for window in windows:
+            remaining = [legislator for legislator in legislators
+                         if (window, legislator_ids[legislator])
+                         not in results]
+            if remaining:
+                tasks.append((window, self.positions(window, columns),
+                              remaining))
+
+        worker = (SplitLegislators(rollcall), function, checkpoint,
+                  legislator_ids)
+        if jobs <= 1:
+            for task in tasks:
+                results.update(_run_window(worker, task))
+            return results
+
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                    initargs=(worker,))
+        try:
+            for window_results in pool.imap_unordered(_apply, tasks):
+                results.update(window_results)
+        finally:
+            pool.terminate()
+            pool.join()
+        return results
+
+    def _check_order(self, columns):
+        indexes = _indexes(columns)
+        positions = [indexes[str(rollcall_id)] for rollcall_id in self.ids
+                     if str(rollcall_id) in indexes]
+        if positions != sorted(positions):
+            raise ValueError("the votes' columns aren't sorted by date")
+
+
+class Checkpoint(object):
+    """Append-only file of finished units and their results
+
+    Each result is appended as a pickle, prefixed by its size, as soon as
+    it's finished, so a crash only loses the units being computed. A result
+    that was being written when it crashed is discarded on `read`.
+
+    Args:
+        path (string): The checkpoint file.
+    """
+    HEADER = struct.Struct('<Q')
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """Returns the results by key, discarding a partially written one
+
+        A complete result that can't be unpickled is skipped, keeping the
+        results after it.
+        """
+        results = collections.OrderedDict()
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, 'r+b') as checkpoint_file:
+            position = 0
+            while True:
+                header = checkpoint_file.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                size, = self.HEADER.unpack(header)
+                data = checkpoint_file.read(size)
+                if len(data) < size:
+                    break
+                position = checkpoint_file.tell()
+                try:
+                    key, result = pickle.loads(data)
+                except (pickle.UnpicklingError, ValueError, TypeError,
+                        AttributeError, IndexError, EOFError):
+                    continue
+                results[key] = result
+            if checkpoint_file.tell() != position:
+                checkpoint_file.truncate(position)
+        return results
+
+    def write(self, key, result):
+        """Appends a result
+
+        It's written in append mode, so many processes can write to the
+        same checkpoint.
+        """
+        data = pickle.dumps((key, result), pickle.HIGHEST_PROTOCOL)
+        data = memoryview(self.HEADER.pack(len(data)) + data)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        try:
+            # os.write may write only part of the data
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+
+_worker = None
+
+
+def _init_worker(worker):
+    global _worker
+    _worker = worker
+
+
+def _apply(task):
+    return _run_window(_worker, task)
+
+
+def _run_window(worker, task):
+    """Computes and checkpoints a window's legislators, one by one"""
+    split_legislators, function, checkpoint, legislator_ids = worker
+    window, positions, legislators = task
+    results = {}
+    for split, result in split_legislators.map(function, [positions],
+                                               legislators):
+        key = (window, legislator_ids[split.legislator])
+        checkpoint.write(key, result)
+        results[key] = result
+    return results
+
+
+def _indexes(ids):
+    return {str(rollcall_id): position
+            for position, rollcall_id in enumerate(ids)}
+
+
+def _day(date):
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    return date
+
+
+def _datetime(date):
+    if isinstance(date, datetime.datetime):
+        return date
+    return datetime.datetime.combine(date, datetime.time())
+
+
+def _add_months(date, months):
+    """Adds months to a date, clamping its day to the month's last day"""
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last_day = (next_month - datetime.timedelta(days=1)).day
+    return date.replace(year=year, month=month, day=min(date.day, last_day))
@@ -4,9 +4,13 @@ import csv
 import json
 import datetime
 from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import select
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 
+import pipeline.parties as parties
+
 Base = declarative_base()
 
 
@@ -45,8 +49,13 @@ class Proposicao(Base):
 
     @classmethod
     def build(cls, proposicao_dict):
+        return cls(**cls.build_row(proposicao_dict))
+
+    @classmethod
+    def build_row(cls, proposicao_dict):
+        """Returns the `proposicoes` columns as a dict, without the ORM"""
         proposicao_dict = _strip_all_values(proposicao_dict)
-        return cls(
+        return dict(
             id=_parse_int(proposicao_dict['id']),
             nome=proposicao_dict['nome'],
             tipo=proposicao_dict['tipo'],
@@ -57,7 +66,9 @@ class Proposicao(Base):
             autor=proposicao_dict['autor'],
             autor_id=_parse_int(proposicao_dict['autor_id']),
             autor_uf=proposicao_dict['autor_uf'],
-            autor_partido=proposicao_dict['autor_partido'],
+            autor_partido=parties.normalize_party_name(
+                proposicao_dict['autor_partido']
+            ),
             ementa=proposicao_dict['ementa'],
             explicacao_ementa=proposicao_dict['explicacao_ementa'],
             situacao=proposicao_dict['situacao'],
@@ -82,7 +93,8 @@ class Votacao(Base):
 
     id = Column(Integer, primary_key=True)
     id_sessao = Column(Integer)
-    data = Column(DateTime)
+    # The exports and coalitions' queries filter by date ranges
+    data = Column(DateTime, index=True)
     obj_votacao = Column(String)
     resumo = Column(String)
     proposicao_id = Column(Integer, ForeignKey('proposicoes.id'))
@@ -90,37 +102,63 @@ class Votacao(Base):
                                                             order_by=id))
 
     @classmethod
-    def create_from_file(cls, session, file_path):
+    def create_from_file(cls, session, file_path, proposicoes_index=None):
+        """Builds the rollcalls in `file_path` with their votes
+
+        The proposições are resolved through `proposicoes_index`, which is
+        built from `session` if not given. Pass your own to check its
+        `unmatched` keys after the load.
+        """
+        if proposicoes_index is None:
+            proposicoes_index = ProposicaoIndex.from_session(session)
         votacoes = []
         with open(file_path, 'r') as votacoes_json:
             votacoes_proposicoes = json.load(votacoes_json)
             for votacao_proposicao in votacoes_proposicoes:
-                proposicao = session.query(Proposicao).\
-                    filter_by(ano=int(votacao_proposicao['ano'])).\
-                    filter_by(numero=int(votacao_proposicao['numero'])).\
-                    filter_by(tipo=votacao_proposicao['sigla']).\
-                    first()
+                proposicao = proposicoes_index.get(votacao_proposicao)
                 for votacao in votacao_proposicao.get('votacoes', []):
                     votacoes += [cls.build(proposicao, votacao)]
         return votacoes
 
     @classmethod
     def build(cls, proposicao, sessao_dict):
-        sessao_dict = _strip_all_values(sessao_dict)
-        datahora = '%s %s' % ((sessao_dict['data'], sessao_dict['hora']))
-        votacao = cls(
-            proposicao=proposicao,
-            id_sessao=sessao_dict['cod_sessao'],
-            data=cls._parse_date(datahora),
-            obj_votacao=sessao_dict['obj_votacao'],
-            resumo=_none_if_empty(sessao_dict['resumo']),
-        )
+        votacao = cls(proposicao=proposicao, **cls._columns(sessao_dict))
         [Voto.build(votacao, voto)
          for voto in sessao_dict.get('votos', [])]
         [Orientacao.build(votacao, orientacao)
          for orientacao in sessao_dict.get('orientacao_bancada', [])]
         return votacao
 
+    @classmethod
+    def build_row(cls, proposicao_id, sessao_dict):
+        """Returns the `votacoes` columns as a dict, without the ORM
+
+        The votes and orientations aren't included, build them with
+        `Voto.build_row` and `Orientacao.build_row`.
+        """
+        row = cls._columns(sessao_dict)
+        row['proposicao_id'] = proposicao_id
+        return row
+
+    @classmethod
+    def _columns(cls, sessao_dict):
+        sessao_dict = _strip_all_values(sessao_dict)
+        datahora = '%s %s' % ((sessao_dict['data'], sessao_dict['hora']))
+        return {
+            'id_sessao': sessao_dict['cod_sessao'],
+            'data': cls._parse_date(datahora),
+            'obj_votacao': sessao_dict['obj_votacao'],
+            'resumo': _none_if_empty(sessao_dict['resumo']),
+        }
+
+    @staticmethod
+    def key(row):
+        """Identifies a rollcall across loads, as their IDs are ours
+
+        `row` can be either a DB row or the result of `build_row`.
+        """
+        return (str(row['id_sessao']), row['data'], row['obj_votacao'])
+
     @staticmethod
     def _parse_date(date, date_format='%d/%m/%Y %H:%M'):
         if date:
@@ -129,6 +167,12 @@ class Votacao(Base):
 
 class Voto(Base):
     __tablename__ = 'votos'
+    __table_args__ = (
+        # The primary key starts with the legislator, so joining the
+        # rollcalls in a date range needs its own index
+        Index('ix_votos_votacao_id_parlamentar',
+              'votacao_id', 'parlamentar_id', 'parlamentar_partido'),
+    )
 
     parlamentar_id = Column(Integer, primary_key=True)
     parlamentar_nome = Column(String, index=True)
@@ -141,16 +185,34 @@ class Voto(Base):
 
     @classmethod
     def build(cls, votacao, voto_dict):
+        columns = cls._columns(voto_dict)
+        if columns:
+            return cls(votacao=votacao, **columns)
+
+    @classmethod
+    def build_row(cls, votacao_id, voto_dict):
+        """Returns the `votos` columns as a dict, without the ORM
+
+        Votes without a legislator ID return None, just like `build`.
+        """
+        row = cls._columns(voto_dict)
+        if row:
+            row['votacao_id'] = votacao_id
+            return row
+
+    @staticmethod
+    def _columns(voto_dict):
         voto_dict = _strip_all_values(voto_dict)
         if voto_dict.get('ide_cadastro'):
-            return cls(
-                votacao=votacao,
-                parlamentar_id=_parse_int(voto_dict['ide_cadastro']),
-                parlamentar_nome=voto_dict['nome'],
-                parlamentar_partido=voto_dict['partido'],
-                parlamentar_uf=voto_dict['uf'],
-                voto=voto_dict['voto'],
-            )
+            return {
+                'parlamentar_id': _parse_int(voto_dict['ide_cadastro']),
+                'parlamentar_nome': voto_dict['nome'],
+                'parlamentar_partido': parties.normalize_party_name(
+                    voto_dict['partido']
+                ),
+                'parlamentar_uf': voto_dict['uf'],
+                'voto': voto_dict['voto'],
+            }
 
 
 class Orientacao(Base):
@@ -164,12 +226,127 @@ class Orientacao(Base):
 
     @classmethod
     def build(cls, votacao, orientacao_dict):
+        return cls(votacao=votacao, **cls._columns(orientacao_dict))
+
+    @classmethod
+    def build_row(cls, votacao_id, orientacao_dict):
+        """Returns the `orientacoes` columns as a dict, without the ORM"""
+        row = cls._columns(orientacao_dict)
+        row['votacao_id'] = votacao_id
+        return row
+
+    @staticmethod
+    def _columns(orientacao_dict):
         orientacao_dict = _strip_all_values(orientacao_dict)
-        return cls(
-            votacao=votacao,
-            sigla=orientacao_dict['sigla'],
-            orientacao=orientacao_dict['orientacao'],
-        )
+        return {
+            'sigla': orientacao_dict['sigla'],
+            'orientacao': orientacao_dict['orientacao'],
+        }
+
+
+class ProposicaoIndex(object):
+    """Resolves the proposição of a rollcall by its (ano, numero, tipo) key
+
+    It's built from a single scan of the `proposicoes` table, so each lookup
+    is a dict access instead of a query. Keys without a matching proposição
+    are collected in `unmatched`, so they can be reported all at once after
+    the load.
+    """
+    def __init__(self, proposicoes):
+        """Args:
+            proposicoes (iterable): (ano, numero, tipo, value) tuples. If
+                there're repeated keys, the first value wins.
+        """
+        self.unmatched = set()
+        self._index = {}
+        for ano, numero, tipo, value in proposicoes:
+            self._index.setdefault((ano, numero, tipo), value)
+
+    @classmethod
+    def from_session(cls, session):
+        """Indexes the `Proposicao` objects themselves"""
+        proposicoes = session.query(Proposicao).order_by(Proposicao.id)
+        return cls((p.ano, p.numero, p.tipo, p) for p in proposicoes)
+
+    @classmethod
+    def from_connection(cls, connection):
+        """Indexes only the proposições' IDs"""
+        table = Proposicao.__table__
+        query = select([table.c.ano, table.c.numero, table.c.tipo,
+                        table.c.id]).order_by(table.c.id)
+        return cls(connection.execute(query))
+
+    def get(self, votacao_proposicao):
+        key = self.key(votacao_proposicao)
+        try:
+            return self._index[key]
+        except KeyError:
+            self.unmatched.add(key)
+
+    @staticmethod
+    def key(votacao_proposicao):
+        return (int(votacao_proposicao['ano']),
+                int(votacao_proposicao['numero']),
+                votacao_proposicao['sigla'])
+
+    def __len__(self):
+        return len(self._index)
+
+
+def iter_json_array(json_file, chunk_size=2 ** 16):
+    """Yields each element of a top-level JSON array, one at a time
+
+    Only the element being decoded (plus a read chunk) is kept in memory, so
+    huge files like `votacoes_proposicoes.json` can be processed without
+    loading them whole like `json.load` does.
+    """
+    decoder = json.JSONDecoder()
+    buffer = json_file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('expected a JSON array')
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer)
+            # A number at the end of the buffer might be truncated
+            complete = end < len(buffer) or eof
+        except ValueError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            # Read at least as much as we have buffered, so large elements
+            # aren't decoded from scratch once per chunk
+            chunk = json_file.read(max(chunk_size, len(buffer)))
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        yield element
+        buffer = buffer[end:]
+
+
+class Carga(Base):
+    """A load of the source files into the DB
+
+    `ultima_votacao_id` works as a watermark: rollcalls with larger IDs were
+    inserted by later loads.
+    """
+    __tablename__ = 'cargas'
+
+    id = Column(Integer, primary_key=True)
+    data = Column(DateTime)
+    ultima_votacao_id = Column(Integer)
+    num_votacoes = Column(Integer)
 
 
 def _none_if_empty(value):
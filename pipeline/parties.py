@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""Parties that changed their names, merged into a single one
+
+The source data comes from the CEBRAP database's table tbl_Partido.
+"""
+
+PARTIES_ALIASES = (
+    ('PCB>PPS', ('PCB', 'PPS')),
+    ('PFL>DEM', ('PFL', 'DEM')),
+    ('PMR>PRB', ('PMR', 'PRB')),
+    ('PL>PR', ('PL', 'PR')),
+    ('PDS>PP', ('PDS', 'PDC', 'PPR', 'PPB', 'PP')),
+    ('PJ>PTC', ('PJ', 'PRN', 'PTC')),
+    ('SD', ('SDD', 'Solidaried')),
+    ('PCdoB', ('PCdoB',)),
+    ('PV', ('PV1',)),
+)
+
+# Compiled once, so normalizing is a single dict lookup
+_PARTIES_BY_ALIAS = {
+    alias.lower(): party
+    for party, aliases in PARTIES_ALIASES
+    for alias in aliases
+}
+
+
+def normalize_party_name(party_name):
+    """Returns the party's merged name, or `party_name` if it has none
+
+    The comparison is case insensitive (e.g. "PCDOB" becomes "PCdoB").
+    """
+    if not party_name:
+        return party_name
+    return _PARTIES_BY_ALIAS.get(party_name.lower(), party_name)
@@ -1,19 +1,32 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import csv
 import math
+import argparse
+import heapq
 import collections
 from operator import itemgetter
-from datetime import datetime
+from datetime import datetime, time
 from itertools import groupby
 
+import sqlalchemy
+
 import pipeline.db as db
 import pipeline.models as models
+import pipeline.parties as parties
 
 
 class PartiesAndCoalitionsChanges(object):
-    def run(self):
+    BATCH_SIZE = 10000
+
+    def __init__(self):
+        self.parser = self._create_parser()
+
+    def run(self, args=sys.argv[1:]):
+        options = self.parser.parse_args(args)
+        db.configure(options.db_path, read_only=True)
         path = 'parties_and_coalitions_changes.csv'
         result = self._legislators_groupped_by_party_and_coalition()
 
@@ -31,18 +44,14 @@ class PartiesAndCoalitionsChanges(object):
         the coalition, he would be returned only once (the first one).
         """
         coalizoes = self._get_coalizoes()
-        coalizoes_partidos = self._get_coalizoes_partidos()
+        partidos_coalizoes = self._get_partidos_coalizoes()
+        votos_coalizoes = self._get_parlamentares_by_coalizao(coalizoes)
         intermediary_results = []
-        for coalizao in coalizoes:
-            partidos_na_coalizao = coalizoes_partidos[coalizao["Id_Clz"]]
-
+        for coalizao, votos_coalizao in zip(coalizoes, votos_coalizoes):
             start_date = coalizao["DataInicial"]
-            end_date = coalizao["DataFinal"]
-            votos_coalizao = self._get_parlamentares_between(start_date,
-                                                             end_date)
-
-            data = self._add_extra_columns_and_convert_to_dict(votos_coalizao,
-                                                               partidos_na_coalizao)
+            data = self._add_extra_columns_and_convert_to_dict(
+                votos_coalizao, coalizao["Id_Clz"], partidos_coalizoes
+            )
             for row in data:
                 row["coalition_start_date"] = start_date
 
@@ -89,10 +98,12 @@ class PartiesAndCoalitionsChanges(object):
                 ]))
         return result
 
-    def _add_extra_columns_and_convert_to_dict(self, votos_coalizao, partidos_coalizao):
+    def _add_extra_columns_and_convert_to_dict(self, votos_coalizao,
+                                               id_coalizao, partidos_coalizoes):
         result = [collections.OrderedDict(v) for v in votos_coalizao]
         for voto in result:
-            voto["coalizao"] = voto["party"] in partidos_coalizao
+            coalizoes_partido = partidos_coalizoes.get(voto["party"], ())
+            voto["coalizao"] = id_coalizao in coalizoes_partido
             voto["legislature"] = self._get_legislature(voto["rollcall_date"])
             voto["legislature_year"] = self._get_legislature_year(voto["rollcall_date"])
         return result
@@ -116,22 +127,74 @@ class PartiesAndCoalitionsChanges(object):
         base_year = 1987
         return 1 + ((date.year % base_year) % 4)
 
-    def _get_parlamentares_between(self, start_date, end_date):
-        between = models.Votacao.data.between(start_date,
-                                              end_date)
-        stmt = db.session.query(models.Voto)\
-                 .join(models.Votacao)\
-                 .filter(between)\
-                 .filter(models.Voto.parlamentar_partido != 'S.Part.')\
-                 .order_by(models.Voto.parlamentar_id)\
-                 .order_by(models.Votacao.data.desc())\
-                 .subquery()
-        votos = db.session.query().add_entity(models.Voto, alias=stmt)\
-                  .group_by(stmt.c.parlamentar_id)\
-                  .group_by(stmt.c.parlamentar_partido)\
-                  .all()
-        votos = [self._convert_to_dict(v) for v in votos]
-        return votos
+    def _get_parlamentares_by_coalizao(self, coalizoes):
+        """Returns each coalition's legislators' latest vote by party
+
+        The votes are read once, ordered by date, and merged with the
+        coalitions' periods sorted by their start. A vote belongs to every
+        period that has started and not ended by its date, which are kept in
+        a heap by their end. Among votes on the same date, the rollcall with
+        the lowest ID is kept. Each coalition's votes are sorted by legislator
+        and party.
+        """
+        periods = []
+        for index, coalizao in enumerate(coalizoes):
+            if coalizao["DataInicial"] and coalizao["DataFinal"]:
+                periods.append((
+                    datetime.combine(coalizao["DataInicial"], time()),
+                    datetime.combine(coalizao["DataFinal"], time()),
+                    index,
+                ))
+        periods.sort()
+
+        latest_votos = [{} for _ in coalizoes]
+        active_periods = []
+        next_period = 0
+        for voto in self._get_votos_by_date(periods):
+            while next_period < len(periods) and \
+                    periods[next_period][0] <= voto.data:
+                _, end, index = periods[next_period]
+                heapq.heappush(active_periods, (end, index))
+                next_period += 1
+            while active_periods and active_periods[0][0] < voto.data:
+                heapq.heappop(active_periods)
+            key = (voto.parlamentar_id, voto.parlamentar_partido)
+            for _, index in active_periods:
+                latest_votos[index][key] = voto
+
+        return [[self._convert_to_dict(voto)
+                 for _, voto in sorted(votos.items(), key=itemgetter(0))]
+                for votos in latest_votos]
+
+    def _get_votos_by_date(self, periods):
+        """Streams the votes inside the periods ordered by date"""
+        if not periods:
+            return
+        start = min(period[0] for period in periods)
+        end = max(period[1] for period in periods)
+        result = db.session.execute(self._votos_by_date_query(start, end))
+        while True:
+            rows = result.fetchmany(self.BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def _votos_by_date_query(self, start, end):
+        votos = models.Voto.__table__
+        votacoes = models.Votacao.__table__
+        query = sqlalchemy.select([votos.c.parlamentar_id,
+                                   votos.c.parlamentar_nome,
+                                   votos.c.parlamentar_partido,
+                                   votos.c.votacao_id,
+                                   votacoes.c.data])\
+                          .select_from(votos.join(votacoes))\
+                          .where(votacoes.c.data.between(start, end))\
+                          .where(votos.c.parlamentar_partido != 'S.Part.')\
+                          .order_by(votacoes.c.data)\
+                          .order_by(votos.c.votacao_id.desc())\
+                          .execution_options(stream_results=True)
+        return query
 
     def _get_coalizoes(self):
         path = os.path.join(db.DATA_PATH, 'tbl_CoalizaoP.csv')
@@ -149,69 +212,34 @@ class PartiesAndCoalitionsChanges(object):
                 coalizao[key] = parse_date(coalizao[key])
         return coalizao
 
-    def _get_coalizoes_partidos(self):
+    def _get_partidos_coalizoes(self):
+        """Returns a dict of each party to the IDs of its coalitions"""
         path = os.path.join(db.DATA_PATH, 'tbl_CoalizaoP_X_Partido.csv')
         with open(path, 'r') as csv_file:
             reader = csv.DictReader(csv_file)
-            result = {}
+            result = collections.defaultdict(set)
             for coalizao_partido in reader:
-                id_coalizao = coalizao_partido["Id_Clz"]
-                partido = self._normalize_party_name(coalizao_partido["Sigla_Partido"])
-                result[id_coalizao] = result.get(id_coalizao, [])
-                result[id_coalizao].append(partido)
+                partido = parties.normalize_party_name(coalizao_partido["Sigla_Partido"])
+                result[partido].add(coalizao_partido["Id_Clz"])
             return result
 
-    def _normalize_party_name(self, party_name):
-        normalizations = (
-            {
-                'names': ('pcb', 'pps'),
-                'result': 'PCB>PPS'
-            },
-            {
-                'names': ('pfl', 'dem'),
-                'result': 'PFL>DEM'
-            },
-            {
-                'names': ('pmr', 'prb'),
-                'result': 'PMR>PRB'
-            },
-            {
-                'names': ('pl', 'pr'),
-                'result': 'PL>PR'
-            },
-            {
-                'names': ('pds', 'pdc', 'ppr', 'ppb', 'pp'),
-                'result': 'PDS>PP'
-            },
-            {
-                'names': ('pj', 'prn', 'ptc'),
-                'result': 'PJ>PTC'
-            },
-            {
-                'names': ('sdd', 'solidaried'),
-                'result': 'SD'
-            },
-            {
-                'names': ('pcdob'),
-                'result': 'PCdoB'
-            },
-            {
-                'names': ('pv1'),
-                'result': 'PV'
-            }
-        )
-
-        for normalization in normalizations:
-            if party_name.lower() in normalization['names']:
-                return normalization['result']
-
-        return party_name
-
     def _convert_to_dict(self, parlamentar):
         return collections.OrderedDict([
             ('id', parlamentar.parlamentar_id),
             ('name', parlamentar.parlamentar_nome),
             ('party', parlamentar.parlamentar_partido),
             ('rollcall_id', parlamentar.votacao_id),
-            ('rollcall_date', parlamentar.votacao.data),
+            ('rollcall_date', parlamentar.data),
         ])
+
+    def _create_parser(self):
+        parser = argparse.ArgumentParser(
+            description="Writes the legislators' party and coalition changes "
+                        "to parties_and_coalitions_changes.csv"
+        )
+        parser.add_argument(
+            "--db-path", default=None,
+            help="path to the votes' DB, opened as read-only (default: "
+                 "$%s or data/dados.db)" % db.DB_PATH_VARIABLE
+        )
+        return parser
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pipeline.metrics.cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_get_or_compute_only_computes_once(self):
+        cache = ResultCache(self.path)
+        calls = []
+
+        def compute():
+            calls.append(True)
+            return {'poll1': 0.5}
+
+        for _ in range(3):
+            result = cache.get_or_compute(['result', 'digest', 0.9], compute)
+            self.assertEqual(result, {'poll1': 0.5})
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_compute_keys_by_value(self):
+        cache = ResultCache(self.path)
+        cache.get_or_compute(['result', {'party': ['PT']}], lambda: 'PT')
+        cache.get_or_compute(['result', {'party': ['PV']}], lambda: 'PV')
+
+        result = cache.get_or_compute(['result', {'party': ['PT']}],
+                                      lambda: 'recomputed')
+
+        self.assertEqual(result, 'PT')
+
+    def test_get_or_compute_ignores_other_versions_values(self):
+        cache = ResultCache(self.path)
+        cache.get_or_compute(['result', 'digest'], lambda: 'old')
+        cache.VERSION += 1
+
+        result = cache.get_or_compute(['result', 'digest'], lambda: 'new')
+
+        self.assertEqual(result, 'new')
+
+    def test_removes_least_recently_used_values(self):
+        cache = ResultCache(self.path)
+        for key in ['a', 'b', 'c']:
+            cache.get_or_compute([key], lambda: 'x' * 1000)
+            time.sleep(0.01)
+        # Using "a" makes "b" the least recently used value
+        cache.get_or_compute(['a'], lambda: 'recomputed')
+        cache.max_size = 2500
+
+        cache.get_or_compute(['d'], lambda: 'y')
+
+        self.assertEqual(cache.get_or_compute(['a'], lambda: None), 'x' * 1000)
+        self.assertEqual(cache.get_or_compute(['c'], lambda: None), 'x' * 1000)
+        self.assertIsNone(cache.get_or_compute(['b'], lambda: None))
+
+    def test_get_or_compute_ignores_values_removed_by_other_processes(self):
+        cache = ResultCache(self.path)
+        cache.get_or_compute(['a'], lambda: 'x' * 1000)
+        cache.max_size = 500
+
+        with mock.patch('os.utime', side_effect=FileNotFoundError):
+            result = cache.get_or_compute(['a'], lambda: 'recomputed')
+        with mock.patch('os.remove', side_effect=FileNotFoundError):
+            cache.get_or_compute(['b'], lambda: 'y' * 1000)
+
+        self.assertEqual(result, 'x' * 1000)
+
+    def test_digest_changes_with_the_contents(self):
+        cache = ResultCache(self.path)
+        input_path = os.path.join(self.path, 'votes.csv')
+        digests = []
+        for contents in ['poll1\n1\n', 'poll1\n0\n', 'poll1\n1\n']:
+            with open(input_path, 'w') as input_file:
+                input_file.write(contents)
+            digests.append(cache.digest(input_path))
+
+        self.assertNotEqual(digests[0], digests[1])
+        self.assertEqual(digests[0], digests[2])
+        self.assertNotEqual(cache.digest(self.path), digests[0])
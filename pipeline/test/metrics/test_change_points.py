@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import csv
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pipeline.metrics.change_points import ChangePoints
+from pipeline.metrics import series
+
+
+class TestChangePoints(unittest.TestCase):
+    def test_amoc_detects_a_mean_change(self):
+        random = np.random.RandomState(0)
+        values = np.r_[random.normal(0.8, 0.05, 120),
+                       random.normal(0.5, 0.05, 80)]
+
+        change_points = ChangePoints('amoc', min_size=10).detect(values)
+
+        self.assertEqual(change_points, [120])
+
+    def test_amoc_detects_at_most_one_change(self):
+        values = np.repeat([0.8, 0.5, 0.8], 50)
+
+        change_points = ChangePoints('amoc', min_size=10).detect(values)
+
+        self.assertEqual(len(change_points), 1)
+
+    def test_multi_detects_many_changes(self):
+        random = np.random.RandomState(0)
+        values = np.r_[random.normal(0.8, 0.05, 60),
+                       random.normal(0.5, 0.05, 60),
+                       random.normal(0.9, 0.05, 60)]
+
+        change_points = ChangePoints('multi', min_size=10).detect(values)
+
+        self.assertEqual(change_points, [60, 120])
+
+    def test_multi_is_the_same_as_optimal_partitioning(self):
+        random = np.random.RandomState(0)
+        for seed_index in range(5):
+            values = np.r_[random.normal(0.7, 0.1, 40),
+                           random.normal(0.6, 0.1, 35),
+                           random.normal(0.75, 0.1, 45)]
+            for min_size in [2, 5, 20]:
+                with self.subTest(seed_index=seed_index, min_size=min_size):
+                    detector = ChangePoints('multi', min_size, penalty=4)
+                    expected_change_points = _optimal_partitioning(
+                        values, min_size, penalty=4
+                    )
+
+                    self.assertEqual(detector.detect(values),
+                                     expected_change_points)
+
+    def test_detect_returns_nothing_without_changes(self):
+        test_cases = [
+            ('constant', np.repeat(0.5, 100)),
+            ('too short', np.repeat([0.8, 0.2], 10)),
+            ('empty', []),
+        ]
+
+        for name, values in test_cases:
+            for method in ChangePoints.METHODS:
+                with self.subTest(name=name, method=method):
+                    detector = ChangePoints(method, min_size=15)
+                    self.assertEqual(detector.detect(values), [])
+
+    def test_detect_ignores_null_values(self):
+        values = np.repeat([0.8, 0.5], 50)
+        values_with_nulls = np.insert(values, [0, 10, 10, 70], np.nan)
+
+        change_points = ChangePoints(min_size=10).detect(values_with_nulls)
+
+        self.assertEqual(change_points, [53])
+
+    def test_segments(self):
+        values = [0.8, 0.8, np.nan, 0.7, 0.2, 0.3, 0.2]
+        ids = [1, 2, 3, 4, 5, 6, 7]
+        dates = ['2015-01-0%d' % rollcall_id for rollcall_id in ids]
+        expected_segments = [
+            {'start_id': 1, 'end_id': 5, 'start': '2015-01-01',
+             'end': '2015-01-05', 'mean': 0.625, 'median': 0.75,
+             'sd': np.std([0.8, 0.8, 0.7, 0.2], ddof=1), 'length': 5},
+            {'start_id': 5, 'end_id': 7, 'start': '2015-01-05',
+             'end': '2015-01-07', 'mean': 0.7 / 3, 'median': 0.2,
+             'sd': np.std([0.2, 0.3, 0.2], ddof=1), 'length': 3},
+        ]
+
+        segments = ChangePoints(min_size=2).segments(values, ids, dates)
+
+        self.assertEqual(len(segments), len(expected_segments))
+        for segment, expected_segment in zip(segments, expected_segments):
+            self.assertEqual(segment.keys(), expected_segment.keys())
+            for key, value in expected_segment.items():
+                self.assertAlmostEqual(segment[key], value)
+
+    def test_segments_of_many_in_parallel(self):
+        random = np.random.RandomState(0)
+        series = []
+        for _ in range(4):
+            values = np.r_[random.normal(0.8, 0.05, 50),
+                           random.normal(0.5, 0.05, 50)]
+            series.append((values, list(range(100)), None))
+        detector = ChangePoints('multi', min_size=10)
+
+        self.assertEqual(detector.segments_of_many(series, jobs=2),
+                         detector.segments_of_many(series))
+
+    def test_run_sorts_the_series_by_date(self):
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        ids = list(range(1, 61))
+        # The values are sorted by ID, but the dates are in reverse order
+        values = ['0.2'] * 30 + ['0.8'] * 30
+        input_path = os.path.join(output_path, 'series.csv')
+        _write_csv(input_path, [ids, values])
+        metadata_path = os.path.join(output_path, 'votacoes.csv')
+        _write_csv(metadata_path, [['id', 'data']] + [
+            [rollcall_id, (datetime.date(2015, 1, 1) +
+                           datetime.timedelta(days=60 - rollcall_id))]
+            for rollcall_id in ids
+        ])
+        args = ['--input', input_path, '--metadata-csv-path', metadata_path,
+                '--min-size', '10']
+        output = io.StringIO()
+
+        ChangePoints().run(args, output)
+        output.seek(0)
+        result = list(csv.DictReader(output))
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0]['start_id'], '60')
+        self.assertEqual(result[0]['end_id'], '30')
+        self.assertEqual(result[0]['start'], '2015-01-01')
+        self.assertAlmostEqual(float(result[0]['mean']), 0.8 - 0.6 / 31)
+        self.assertEqual(result[1]['start_id'], '30')
+        self.assertEqual(result[1]['end_id'], '1')
+        self.assertEqual(float(result[1]['median']), 0.2)
+        self.assertEqual(result[1]['length'], '30')
+
+    def test_sort_by_date_removes_the_rollcalls_without_dates(self):
+        row = collections.OrderedDict([('1', '0.1'), ('2', '0.2'),
+                                       ('3', ''), ('4', '0.4'), ('5', '0.5')])
+        # Dates aren't sorted as strings, e.g. without zero padding
+        dates = {'1': '2015-01-10', '2': 'NaT', '3': '2015-01-02',
+                 '4': '2015-01-9', '5': ''}
+
+        result = ChangePoints()._sort_by_date(row, dates)
+
+        np.testing.assert_equal(result, ([np.nan, 0.4, 0.1], ['3', '4', '1'],
+                                         ['2015-01-02', '2015-01-9',
+                                          '2015-01-10']))
+
+    def test_run_reads_binary_series_with_dates(self):
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        ids = list(range(1, 61))
+        values = [[0.8] * 30 + [0.2] * 30, [0.5] * 60]
+        dates = ['2015-01-01T00:%02d:00' % (60 - rollcall_id)
+                 for rollcall_id in ids]
+        input_path = os.path.join(output_path, 'series.bin')
+        with open(input_path, 'wb') as input_file:
+            series.write_series(input_file, values, ids, dates)
+        args = ['--input', input_path, '--input-format', 'binary',
+                '--min-size', '10']
+        output = io.StringIO()
+
+        ChangePoints().run(args, output)
+        output.seek(0)
+        result = list(csv.DictReader(output))
+
+        self.assertEqual([row['series'] for row in result],
+                         [input_path + ':1'] * 2)
+        self.assertEqual(result[0]['start_id'], '60')
+        self.assertEqual(result[0]['start'], '2015-01-01T00:00:00')
+        self.assertEqual(result[1]['start_id'], '30')
+        self.assertEqual(float(result[1]['median']), 0.8)
+
+
+def _optimal_partitioning(values, min_size, penalty):
+    """Change points minimizing the standardized costs, without pruning"""
+    values = (values - np.mean(values)) / np.std(values)
+    length = len(values)
+
+    def cost(start, end):
+        segment = values[start:end]
+        return np.sum((segment - np.mean(segment)) ** 2)
+
+    best_costs = {0: -penalty}
+    last_change = {}
+    for end in range(min_size, length + 1):
+        costs = {
+            start: best_costs[start] + cost(start, end) + penalty
+            for start in best_costs if end - start >= min_size
+        }
+        if costs:
+            last_change[end] = min(costs, key=costs.get)
+            best_costs[end] = costs[last_change[end]]
+
+    change_points = []
+    end = last_change[length]
+    while end > 0:
+        change_points.insert(0, end)
+        end = last_change[end]
+    return change_points
+
+
+def _write_csv(path, rows):
+    with open(path, 'w', newline='') as csv_file:
+        csv.writer(csv_file).writerows(rows)
+
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from pipeline.metrics.ideal_points import IdealPoints, SplitIdealPoints
+from pipeline.metrics.rollcall import Rollcall
+from pipeline.metrics.split_legislators import SplitLegislators, Split
+from pipeline.metrics.store import MISSING
+
+
+class TestIdealPoints(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.ideal_points = random.normal(size=60)
+        self.votes = _simulate_votes(random, self.ideal_points, 150)
+
+    def test_fit_recovers_the_ideal_points(self):
+        fit = IdealPoints().fit(self.votes, polarity=0)
+
+        self.assertGreater(np.corrcoef(fit.ideal_points,
+                                       self.ideal_points)[0, 1], 0.95)
+        self.assertGreater(fit.ideal_points[0], 0)
+        self.assertAlmostEqual(fit.ideal_points.mean(), 0)
+        self.assertAlmostEqual(fit.ideal_points.std(), 1)
+        self.assertLess(fit.iterations, IdealPoints().max_iterations)
+
+    def test_fit_accepts_rollcalls(self):
+        data = pd.DataFrame(self.votes, columns=range(150))
+        data['name'] = ['Legislator %d' % i for i in range(60)]
+        rollcall = Rollcall(data)
+
+        fit = IdealPoints().fit(rollcall)
+
+        np.testing.assert_allclose(fit.ideal_points,
+                                   IdealPoints().fit(self.votes).ideal_points)
+
+    def test_fit_accepts_dataframes_with_a_data_column(self):
+        votes = pd.DataFrame(self.votes, columns=['data'] + list(range(149)))
+
+        fit = IdealPoints().fit(votes)
+
+        np.testing.assert_allclose(fit.ideal_points,
+                                   IdealPoints().fit(self.votes).ideal_points)
+
+    def test_fit_ignores_other_values(self):
+        votes = self.votes.copy()
+        votes[0, :50] = MISSING
+        # The "not in legislature" code of the R scripts
+        votes[1, 50:] = 9
+        votes_with_nans = self.votes.copy()
+        votes_with_nans[0, :50] = np.nan
+        votes_with_nans[1, 50:] = np.nan
+
+        fit = IdealPoints().fit(votes)
+
+        np.testing.assert_allclose(
+            fit.ideal_points, IdealPoints().fit(votes_with_nans).ideal_points
+        )
+
+    def test_fit_with_warm_start(self):
+        ideal_points = IdealPoints()
+        baseline = ideal_points.fit(self.votes)
+        # The first legislator split in two, before and after the 75th vote
+        before, after = _split(self.votes[0], 75)
+        split_votes = np.vstack([self.votes[1:], before, after])
+        test_cases = {
+            'ideal points': np.r_[baseline.ideal_points[1:],
+                                  baseline.ideal_points[[0, 0]]],
+            'only rollcalls': None,
+        }
+
+        cold_fit = ideal_points.fit(split_votes)
+        for name, init_ideal_points in test_cases.items():
+            with self.subTest(init=name):
+                init = baseline._replace(ideal_points=init_ideal_points)
+                warm_fit = ideal_points.fit(split_votes, init=init)
+
+                self.assertLess(warm_fit.iterations, cold_fit.iterations)
+                np.testing.assert_allclose(warm_fit.ideal_points,
+                                           cold_fit.ideal_points, atol=1e-4)
+
+    def test_fit_raises_if_the_warm_start_doesnt_match(self):
+        baseline = IdealPoints().fit(self.votes)
+
+        with self.assertRaises(ValueError):
+            IdealPoints().fit(self.votes[1:], init=baseline)
+
+    def test_fit_ideal_points_of_a_split_legislator(self):
+        baseline = IdealPoints().fit(self.votes, polarity=0)
+        # Votes like the most extreme legislators on each side, changing
+        # sides after the 75th vote
+        left = np.argmin(baseline.ideal_points)
+        right = np.argmax(baseline.ideal_points)
+        changed_votes = np.r_[self.votes[left, :75], self.votes[right, 75:]]
+        before, after = _split(changed_votes, 75)
+
+        ideal_points = IdealPoints().fit_ideal_points(
+            np.vstack([before, after]), baseline
+        )
+
+        self.assertLess(ideal_points[0], -1)
+        self.assertGreater(ideal_points[1], 1)
+
+    def test_split_ideal_points_fits_each_window_once(self):
+        rollcall = Rollcall(pd.DataFrame(self.votes, columns=range(150)))
+        split_legislators = SplitLegislators(rollcall)
+        split_ideal_points = SplitIdealPoints(polarity=0)
+        window_fit = IdealPoints().fit(self.votes[:, 10:140], polarity=0)
+        before, after = _split(self.votes[3, 10:140], 65)
+        expected = IdealPoints().fit_ideal_points(np.vstack([before, after]),
+                                                  window_fit)
+
+        with mock.patch.object(split_ideal_points.ideal_points, 'fit',
+                               wraps=split_ideal_points.ideal_points.fit) \
+                as fit:
+            results = [
+                split_ideal_points(split_legislators.view(Split(*split)))
+                for split in [(3, 10, 74, 139), (4, 10, 74, 139)]
+            ]
+
+        self.assertEqual(fit.call_count, 1)
+        np.testing.assert_allclose(
+            [results[0]['window'], results[0]['before'], results[0]['after']],
+            [window_fit.ideal_points[3], expected[0], expected[1]]
+        )
+        self.assertEqual(results[1]['window'], window_fit.ideal_points[4])
+
+
+def _simulate_votes(random, ideal_points, num_rollcalls):
+    intercepts = random.normal(size=num_rollcalls)
+    slopes = random.normal(scale=2, size=num_rollcalls)
+    probabilities = 1 / (1 + np.exp(-(intercepts +
+                                      np.outer(ideal_points, slopes))))
+    votes = (random.uniform(size=probabilities.shape) < probabilities)
+    votes = votes.astype(float)
+    votes[random.uniform(size=votes.shape) < 0.1] = np.nan
+    return votes
+
+
+def _split(votes, position):
+    before = np.where(np.arange(len(votes)) < position, votes, np.nan)
+    after = np.where(np.arange(len(votes)) >= position, votes, np.nan)
+    return before, after
@@ -2,6 +2,8 @@
 
 import unittest
 
+import numpy as np
+
 from pipeline.metrics.rice_index import RiceIndex
 
 
@@ -50,3 +52,34 @@ class TestRiceIndex(unittest.TestCase):
 
             with self.subTest(test=test, result=result):
                 self.assertEqual(RiceIndex().calculate_adjusted(test), result)
+
+    def test_matrix_methods_are_the_same_as_calculating_each_column(self):
+        random = np.random.RandomState(0)
+        votes = random.choice([YES, NO, np.nan], size=(20, 200))
+        # Few voters, so some polls have less than two votes
+        votes[3:] = np.nan
+        test_cases = [
+            (RiceIndex().calculate, RiceIndex().calculate_matrix),
+            (RiceIndex().calculate_adjusted,
+             RiceIndex().calculate_adjusted_matrix),
+        ]
+
+        for method, matrix_method in test_cases:
+            with self.subTest(method=method.__name__):
+                expected_result = [method(votes[:, i])
+                                   for i in range(votes.shape[1])]
+                self.assertIn(None, expected_result)
+                self.assertEqual(matrix_method(votes), expected_result)
+
+    def test_matrix_methods_handle_none_and_empty_votes(self):
+        votes = [
+            [NO, YES, None],
+            [NO, None, None],
+            [NO, YES, None],
+        ]
+
+        self.assertEqual(RiceIndex().calculate_matrix(votes),
+                         [1, 1, None])
+        self.assertEqual(RiceIndex().calculate_adjusted_matrix(votes),
+                         [1, 1, None])
+        self.assertEqual(RiceIndex().calculate_matrix([[]]), [])
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
 import pandas as pd
 
+from pipeline.metrics.rice_index import RiceIndex
 from pipeline.metrics.rollcall import Rollcall
 
 
@@ -28,6 +32,52 @@ class TestRollcall(unittest.TestCase):
         self.assertEqual(rollcall.data.to_dict(), expected_votes)
         self.assertEqual(rollcall.metadata.to_dict(), expected_metadata)
 
+    def test_filters_are_the_same_as_per_row(self):
+        random = np.random.RandomState(0)
+        data = pd.DataFrame({
+            'poll1': random.choice([1, 0], size=60),
+            'name': ['Deputado %d' % i for i in range(60)],
+            'party': random.choice(['PT', 'PSDB', 'PMDB', None], size=60),
+            'state': random.choice(['PB', 'PE', 'SP'], size=60),
+        })
+        rollcall = Rollcall(data)
+        all_filters = [
+            {'party': ['PT']},
+            {'party': ['PT', 'PSDB'], 'state': ['PE']},
+            {'party': ['PMDB'], 'state': ['SP', 'PB'], 'name': []},
+            {'name': ['Deputado 3', 'Deputado 42'], 'state': ['PB', 'PE']},
+            {'party': ['PSOL']},
+        ]
+
+        for filters in all_filters:
+            with self.subTest(filters=filters):
+                expected_rows = data.index[np.logical_and.reduce([
+                    data[key].isin(values)
+                    for key, values in filters.items() if values
+                ])]
+
+                positions = rollcall.positions(filters)
+                filtered = Rollcall(data).filter(filters)
+
+                self.assertEqual(positions.tolist(), expected_rows.tolist())
+                self.assertEqual(filtered.data.index.tolist(),
+                                 expected_rows.tolist())
+                self.assertEqual(filtered.metadata.index.tolist(),
+                                 expected_rows.tolist())
+        self.assertEqual(len(rollcall.data), len(data))
+
+    def test_filters_without_values_dont_filter(self):
+        data = pd.core.frame.DataFrame([
+            {'name': 'Joao', 'party': 'PT', 'state': 'PB', 'poll1': 1},
+            {'name': 'Pedro', 'party': 'PSOL', 'state': 'PE', 'poll1': 0},
+        ])
+        filters = {'party': [], 'state': []}
+
+        rollcall = Rollcall(data)
+
+        self.assertIsNone(rollcall.positions(filters))
+        self.assertEqual(len(rollcall.filter(filters).data), 2)
+
     def test_median_votes_groupped_by(self):
         data = pd.core.frame.DataFrame([
             {'name': 'Joao', 'party': 'PT', 'state': 'PB', 'poll1': 1},
@@ -48,6 +98,30 @@ class TestRollcall(unittest.TestCase):
 
         self.assertEqual(result.to_dict(), expected_result)
 
+    def test_median_votes_groupped_by_is_the_same_as_per_group(self):
+        random = np.random.RandomState(0)
+        votes = random.choice([1, 0, np.nan], p=[0.5, 0.4, 0.1],
+                              size=(40, 200))
+        votes[:, 20:40] = random.choice([0, 1, 2, 3], size=(40, 20))
+        votes[:, 40:60] = np.nan
+        parties = random.choice(['PT', 'PSDB', 'PMDB', 'PSOL', None],
+                                size=40)
+        votes[parties == 'PSOL', 60:80] = np.nan
+        data = pd.DataFrame(votes,
+                            columns=['poll%d' % i for i in range(200)])
+        data['party'] = parties
+        data['id'] = range(40, 0, -1)
+
+        for groupby in ['party', 'id']:
+            with self.subTest(groupby=groupby):
+                expected_result = _median_votes_per_group(data, groupby)
+                result = Rollcall(data.copy()).median_votes_groupped_by(
+                    groupby
+                )
+
+                pd.testing.assert_frame_equal(result, expected_result,
+                                              check_dtype=False)
+
     def test_remove_unanimous_votes(self):
         data = pd.core.frame.DataFrame([
             {'poll1': 1, 'poll2': 1, 'poll3': None},
@@ -71,3 +145,158 @@ class TestRollcall(unittest.TestCase):
         rollcall = Rollcall(data).remove_unanimous_votes(None)
 
         self.assertEqual(rollcall.data.columns.tolist(), ['poll1'])
+
+    def test_remove_unanimous_votes_is_the_same_as_per_column(self):
+        random = np.random.RandomState(0)
+        votes = random.choice([1, 0, np.nan], p=[0.7, 0.2, 0.1],
+                              size=(30, 300))
+        votes[:, :20] = 1
+        votes[:, 20:40] = np.nan
+        votes[:25, 40:60] = np.nan
+        votes[:, 60:80] = random.choice([0, 1, 2, 3], size=(30, 20))
+        data = pd.DataFrame(votes,
+                            columns=['poll%d' % i for i in range(300)])
+
+        for majority_percentual in [0, 0.5, 0.75, 0.9, 0.975, 1]:
+            with self.subTest(majority_percentual=majority_percentual):
+                expected_columns = _remove_unanimous_votes_per_column(
+                    data, majority_percentual
+                )
+                rollcall = Rollcall(data.copy())\
+                    .remove_unanimous_votes(majority_percentual)
+
+                self.assertEqual(rollcall.data.columns.tolist(),
+                                 expected_columns)
+
+    def test_cohesion_by_period_is_the_same_as_per_window(self):
+        random = np.random.RandomState(0)
+        votes = random.choice([1, 0, np.nan], p=[0.6, 0.3, 0.1],
+                              size=(30, 200))
+        data = pd.DataFrame(votes,
+                            columns=['poll%d' % i for i in range(200)])
+        data['party'] = random.choice(['PT', 'PSDB', 'PSOL', None], size=30)
+        dates = pd.Timestamp('2011-01-15') + pd.to_timedelta(
+            random.randint(0, 3 * 365 * 24, size=200), unit='h'
+        )
+        dates = dates.where(random.rand(200) > 0.05)
+        rollcall = Rollcall(data, dates=dates)
+
+        for period in ['month', 'year', 'legislative year', '30 days']:
+            for adjusted in [True, False]:
+                with self.subTest(period=period, adjusted=adjusted):
+                    expected_result = _cohesion_per_window(
+                        data, dates, 'party', period, adjusted
+                    )
+
+                    result = rollcall.cohesion_by_period('party', period,
+                                                         adjusted)
+
+                    pd.testing.assert_frame_equal(result, expected_result,
+                                                  check_names=False,
+                                                  check_freq=False)
+
+    def test_cohesion_by_period_raises_without_dates(self):
+        data = pd.DataFrame([{'party': 'PT', 'poll1': 1}])
+        with self.assertRaises(ValueError):
+            Rollcall(data).cohesion_by_period('party', 'month')
+
+    def test_dates_are_kept_with_their_polls(self):
+        data = pd.DataFrame([
+            {'id': 1, 'party': 'PT', 'poll1': 1, 'poll2': 1, 'poll3': 0},
+            {'id': 2, 'party': 'PT', 'poll1': 1, 'poll2': 0, 'poll3': 0},
+        ], columns=['id', 'party', 'poll1', 'poll2', 'poll3'])
+        dates = ['2015-02-01', '2015-02-02 14:30', '2015-02-03']
+        store_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_path)
+
+        rollcall = Rollcall(data, dates=dates).remove_unanimous_votes(1)
+        Rollcall(data, dates=dates).to_store(store_path)
+        stored_rollcall = Rollcall.from_store(store_path)
+
+        self.assertEqual(rollcall.dates.to_dict(),
+                         {'poll2': pd.Timestamp('2015-02-02 14:30')})
+        self.assertEqual(stored_rollcall.dates.tolist(),
+                         pd.to_datetime(dates).tolist())
+
+    def test_from_store_doesnt_copy_the_votes(self):
+        data = pd.core.frame.DataFrame([
+            {'name': 'Joao', 'party': 'PT', 'state': 'PB', 'poll1': 1},
+            {'name': 'Pedro', 'party': 'PSOL', 'state': 'PE', 'poll1': None},
+        ])
+        store_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_path)
+
+        Rollcall(data).to_store(store_path)
+        rollcall = Rollcall.from_store(store_path)
+
+        self.assertEqual(rollcall.data.dtypes.tolist(), [np.int8])
+        self.assertTrue(self._is_memory_mapped(rollcall.data.values))
+        self.assertEqual(rollcall.metadata.to_dict(),
+                         data[['name', 'party', 'state']].to_dict())
+        self.assertEqual(Rollcall.notnull(rollcall.data).to_dict(),
+                         {'poll1': {0: True, 1: False}})
+
+    def _is_memory_mapped(self, array):
+        while array is not None:
+            if isinstance(array, np.memmap):
+                return True
+            array = array.base
+        return False
+
+
+def _remove_unanimous_votes_per_column(data, majority_percentual):
+    """The previous, per column, implementation of remove_unanimous_votes"""
+    def unanimous_columns(column):
+        counts = np.unique(column[pd.notnull(column)],
+                           return_counts=True)[1]
+        total = sum(counts)
+        for count in counts:
+            percentual = count/total
+            if percentual >= majority_percentual:
+                return False
+        return len(counts) > 0
+    filters = data.apply(unanimous_columns)
+    return data[filters.index[filters]].columns.tolist()
+
+
+def _median_votes_per_group(data, groupby):
+    """The previous, per group, implementation of median_votes_groupped_by"""
+    def mode_removing_nulls(column):
+        values, counts = np.unique(column[pd.notnull(column)],
+                                   return_counts=True)
+        if len(values):
+            return values[np.argmax(counts)]
+    votes = data.drop(Rollcall.METADATA_COLUMNS, axis=1, errors='ignore')
+    return votes.groupby(data[groupby]).aggregate(mode_removing_nulls)
+
+
+def _cohesion_per_window(data, dates, groupby, period, adjusted):
+    """Averages each group's Rice Index on the polls of each window"""
+    rice_index = RiceIndex()
+    calculate = rice_index.calculate
+    if adjusted:
+        calculate = rice_index.calculate_adjusted
+    votes = data.drop(groupby, axis=1)
+    cohesion = votes.groupby(data[groupby]).aggregate(
+        lambda column: calculate(column.tolist())
+    ).astype(float)
+    cohesion.columns = dates
+    cohesion = cohesion.loc[:, cohesion.columns.notnull()]
+
+    dates = cohesion.columns
+    if period == 'month':
+        windows = dates.to_period('M').to_timestamp()
+    elif period == 'year':
+        windows = dates.to_period('A').to_timestamp()
+    elif period == 'legislative year':
+        windows = (dates - pd.DateOffset(months=1)).to_period('A')\
+            .to_timestamp() + pd.DateOffset(months=1)
+    else:
+        windows = dates.unique().sort_values()
+        result = {}
+        for date in windows:
+            in_window = (dates > date - pd.Timedelta(period)) & \
+                (dates <= date)
+            result[date] = cohesion.loc[:, in_window].mean(axis=1)
+        return pd.DataFrame(result).T.sort_index()
+    return cohesion.T.groupby(windows).mean().sort_index()
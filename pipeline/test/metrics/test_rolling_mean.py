@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import csv
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pipeline.metrics.rolling_mean import RollingMean, WidthError
+from pipeline.metrics import series
+
+
+class TestRollingMean(unittest.TestCase):
+    def test_calculate(self):
+        values = [1, 0, None, 0.5, np.nan, np.nan, 1]
+        expected_result = [
+            [0.5, 0, 0.5, 0.5, np.nan, 1],
+            [0.5, 0.25, 0.5, 0.75],
+        ]
+
+        result = RollingMean().calculate(values, [2, 4])
+
+        for means, expected_means in zip(result, expected_result):
+            np.testing.assert_allclose(means, expected_means)
+
+    def test_calculate_is_the_same_as_pandas_rolling_mean(self):
+        random = np.random.RandomState(0)
+        values = random.choice([1, 0, 0.5, np.nan], size=(3, 500))
+        widths = [1, 10, 100, 500]
+
+        result = RollingMean().calculate(values, widths)
+
+        for width, means in zip(widths, result):
+            with self.subTest(width=width):
+                expected_means = pd.DataFrame(values.T).rolling(
+                    width, min_periods=1
+                ).mean().values.T[:, width - 1:]
+                np.testing.assert_allclose(means, expected_means)
+
+    def test_calculate_raises_if_width_is_larger_than_values(self):
+        for width in [0, 4]:
+            with self.subTest(width=width):
+                with self.assertRaises(WidthError):
+                    RollingMean().calculate([1, 0, 1], [width])
+
+    def test_calculate_row(self):
+        row = collections.OrderedDict([
+            ('poll1', '1'), ('poll2', '0'), ('poll3', ''), ('poll4', None),
+        ])
+        expected_result = [
+            collections.OrderedDict([
+                ('poll2', 0.5), ('poll3', 0.0), ('poll4', None),
+            ]),
+            collections.OrderedDict([('poll3', 0.5), ('poll4', 0.0)]),
+        ]
+
+        result = RollingMean().calculate_row(row, [3, 2])
+
+        self.assertEqual(result, expected_result)
+
+    def test_run_writes_result_in_output(self):
+        input_fd, input_path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, input_path)
+        with os.fdopen(input_fd, 'w') as input_file:
+            input_file.write('poll1,poll2,poll3,poll4\n1,0,,1\n')
+        args = ['--input', input_path, '--width', '2', '3']
+        output = io.StringIO()
+        expected_result = [
+            ['poll2', 'poll3', 'poll4'],
+            ['0.5', '0.0', '1.0'],
+            ['', '0.5', '0.5'],
+        ]
+
+        RollingMean().run(args, output)
+        output.seek(0)
+        result = [row for row in csv.reader(output)]
+
+        self.assertEqual(result, expected_result)
+
+    def test_run_reads_and_writes_binary_series(self):
+        input_fd, input_path = tempfile.mkstemp(suffix='.series')
+        self.addCleanup(os.remove, input_path)
+        values = [[1, 0, np.nan, 1, 0.5], [0, 0, 1, np.nan, np.nan]]
+        dates = ['2015-01-0%d' % day for day in range(1, 6)]
+        with os.fdopen(input_fd, 'wb') as input_file:
+            series.write_series(input_file, values, [1, 2, 3, 4, 5], dates)
+        args = ['--input', input_path, '--width', '3', '2',
+                '--input-format', 'binary']
+        output = io.BytesIO()
+        expected_output = io.StringIO()
+        RollingMean().run(args, expected_output)
+        expected_output.seek(0)
+        expected_rows = list(csv.DictReader(expected_output))
+
+        RollingMean().run(args + ['--output-format', 'binary'], output)
+        output.seek(0)
+        result_values, result_ids, result_dates = series.read_series(output)
+
+        self.assertEqual(result_ids.tolist(), [2, 3, 4, 5])
+        self.assertEqual(result_dates.astype(str).tolist(),
+                         [date + 'T00:00:00' for date in dates[1:]])
+        np.testing.assert_allclose(result_values, [
+            [float(value) if value else np.nan for value in row.values()]
+            for row in expected_rows
+        ])
+        np.testing.assert_allclose(result_values[:2], [
+            [0.5, 0, 1, 0.75],
+            [np.nan, 0.5, 0.5, 0.75],
+        ])
@@ -2,13 +2,20 @@
 
 import unittest
 import os
+import shutil
+import tempfile
 import io
 import csv
 import collections
+from unittest import mock
+import json
 import numpy as np
 
 from pipeline.metrics.runner import Runner
 from pipeline.metrics.runner import Rollcall
+from pipeline.metrics.cache import ResultCache
+from pipeline.metrics.rice_index import RiceIndex
+from pipeline.metrics import series
 
 
 class TestRunner(unittest.TestCase):
@@ -32,6 +39,88 @@ class TestRunner(unittest.TestCase):
 
         self.assertEqual(result, expected_result)
 
+    def test_run_writes_binary_series(self):
+        csv_path = self._get_csv_path('example_votes.csv')
+        args = ['--input', csv_path, '--metric', 'rice_index']
+        output = io.BytesIO()
+        expected_output = io.StringIO()
+        Runner().run(args, expected_output)
+        expected_output.seek(0)
+        expected_rows = list(csv.DictReader(expected_output))
+
+        Runner().run(args + ['--output-format', 'binary'], output)
+        output.seek(0)
+        values, ids, dates = series.read_series(output)
+
+        self.assertEqual(ids.tolist(), list(expected_rows[0].keys()))
+        np.testing.assert_array_equal(
+            values,
+            [[float(value) if value else np.nan
+              for value in expected_rows[0].values()]]
+        )
+        self.assertIsNone(dates)
+
+    def test_run_writes_binary_series_with_dates(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        rollcalls_csv_path = os.path.join(output_path, 'votacoes.csv')
+        with open(rollcalls_csv_path, 'w') as rollcalls_file:
+            rollcalls_file.write('id,data\n'
+                                 'poll2,2015-02-10 10:30:00\n'
+                                 'poll1,2015-01-10 16:00:00\n'
+                                 'poll4,2015-03-01 12:00:00\n')
+        store_path = os.path.join(output_path, 'store')
+        Rollcall.from_csv(csv_path, rollcalls_csv_path).to_store(store_path)
+        expected_dates = np.array(['2015-01-10T16:00:00',
+                                   '2015-02-10T10:30:00', 'NaT',
+                                   '2015-03-01T12:00:00'],
+                                  dtype='datetime64[s]')
+        test_cases = {
+            'rollcalls input': ['--input', csv_path,
+                                '--rollcalls-input', rollcalls_csv_path],
+            'store': ['--input', store_path],
+        }
+
+        for name, args in test_cases.items():
+            with self.subTest(input=name):
+                output = io.BytesIO()
+
+                Runner().run(args + ['--metric', 'rice_index',
+                                     '--output-format', 'binary'], output)
+                output.seek(0)
+                _, ids, dates = series.read_series(output)
+
+                self.assertEqual(ids.tolist(),
+                                 ['poll1', 'poll2', 'poll3', 'poll4'])
+                np.testing.assert_array_equal(dates, expected_dates)
+
+    def test_run_reports_invalid_rolling_windows(self):
+        csv_path = self._get_csv_path('example_votes.csv')
+        test_cases = [['5'], ['2', '5'], ['0']]
+
+        for widths in test_cases:
+            with self.subTest(widths=widths):
+                args = ['--input', csv_path, '--metric', 'rice_index',
+                        '--rolling-window'] + widths
+                with mock.patch('sys.stderr', new_callable=io.StringIO) \
+                        as stderr:
+                    with self.assertRaises(SystemExit) as context:
+                        Runner().run(args, io.StringIO())
+
+                self.assertEqual(context.exception.code, 2)
+                self.assertIn('--rolling-window', stderr.getvalue())
+
+    def test_run_doesnt_report_other_errors_as_rolling_window_ones(self):
+        csv_path = self._get_csv_path('example_votes.csv')
+        args = ['--input', csv_path, '--metric', 'rice_index',
+                '--rolling-window', '2']
+
+        with mock.patch.object(Runner, 'main',
+                               side_effect=ValueError('other error')):
+            with self.assertRaisesRegex(ValueError, 'other error'):
+                Runner().run(args, io.StringIO())
+
     def test_main(self):
         csv_path = self._get_csv_path('example_votes.csv')
         expected_result = [collections.OrderedDict([
@@ -187,6 +276,189 @@ class TestRunner(unittest.TestCase):
             with self.subTest(metadata_column=metadata_column):
                 self.assertNotIn(metadata_column, res)
 
+    def test_main_reads_votes_stores(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        store_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_path)
+        Rollcall.from_csv(csv_path).to_store(store_path)
+        test_cases = [
+            {'metric_method': None},
+            {'metric_method': None, 'groupby': 'party'},
+            {'majority_percentual': 0.9, 'party': ['PT']},
+            {'groupby': 'state', 'state': ['PB', 'SP']},
+        ]
+
+        for kwargs in test_cases:
+            with self.subTest(**kwargs):
+                self.assertEqual(Runner().main(store_path, **kwargs),
+                                 Runner().main(csv_path, **kwargs))
+
+    def test_main_calculates_the_metric_rolling_means(self):
+        csv_path = self._get_csv_path('example_votes.csv')
+        expected_result = [
+            collections.OrderedDict([
+                ('poll2', 0.7), ('poll3', 0.2), ('poll4', 0.0),
+            ]),
+            collections.OrderedDict([('poll3', 1.4 / 3), ('poll4', 0.2)]),
+        ]
+
+        res = Runner().main(csv_path, rolling_windows=[3, 2])
+
+        self.assertEqual(len(res), len(expected_result))
+        for row, expected_row in zip(res, expected_result):
+            self.assertEqual(list(row.keys()), list(expected_row.keys()))
+            np.testing.assert_allclose(list(row.values()),
+                                       list(expected_row.values()))
+
+    def test_run_batch_writes_each_query_output(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        specs = [
+            {'party': ['PT'], 'groupby': 'party'},
+            {'metric': 'adjusted_rice_index', 'majority_percentual': 0.9},
+            {'metric': 'rice_index', 'state': ['PB', 'SP']},
+            {'metric': 'rice_index', 'rolling_window': [1, 2]},
+            {'groupby': 'state', 'majority_percentual': 0.9,
+             'name': ['Joao', 'Pedro']},
+        ]
+        specs_file = io.StringIO()
+        for index, spec in enumerate(specs):
+            spec['output'] = os.path.join(output_path, '%d.csv' % index)
+            specs_file.write(json.dumps(spec) + '\n\n')
+        specs_file.seek(0)
+
+        Runner().run_batch(csv_path, specs_file)
+
+        for spec in specs:
+            with self.subTest(**spec):
+                args = ['--input', csv_path]
+                for key, value in spec.items():
+                    if key == 'output':
+                        continue
+                    if not isinstance(value, list):
+                        value = [value]
+                    option = '--' + key.replace('_', '-')
+                    args += [option] + [str(v) for v in value]
+                expected_output = io.StringIO()
+                Runner().run(args, expected_output)
+                with open(spec['output'], 'r', newline='') as output:
+                    self.assertEqual(output.read(),
+                                     expected_output.getvalue())
+
+    def test_run_batch_raises_on_invalid_specs(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        invalid_specs = [
+            {'party': ['PT']},
+            {'output': 'out.csv', 'parties': ['PT']},
+            {'output': 'out.csv', 'metric': 'invalid_metric'},
+            {'output': 'out.csv', 'groupby': 'parti'},
+            {'output': 'out.csv', 'party': 'PT'},
+            {'output': 'out.csv', 'name': [1]},
+            {'output': 'out.csv', 'state': {'PB': True}},
+            {'output': 'out.csv', 'majority_percentual': '0.9'},
+            {'output': 'out.csv', 'majority_percentual': 97.5},
+            {'output': 'out.csv', 'metric': 'rice_index',
+             'rolling_window': '2'},
+            {'output': 'out.csv', 'metric': 'rice_index',
+             'rolling_window': [2, 0]},
+            {'output': 'out.csv', 'metric': 'rice_index',
+             'rolling_window': [2.5]},
+            {'output': 'out.csv', 'rolling_window': 2},
+            {'output': ['out.csv']},
+        ]
+
+        for spec in invalid_specs:
+            with self.subTest(spec=spec):
+                # The invalid spec is on the second line
+                specs_file = io.StringIO('{"output": "ok.csv"}\n' +
+                                         json.dumps(spec))
+                with self.assertRaisesRegex(ValueError, '^line 2: '):
+                    Runner().run_batch(csv_path, specs_file)
+
+    def test_main_by_period(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        output_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_path)
+        rollcalls_csv_path = os.path.join(output_path, 'votacoes.csv')
+        with open(rollcalls_csv_path, 'w') as rollcalls_file:
+            rollcalls_file.write('id,data\n'
+                                 'poll1,2015-01-10\n'
+                                 'poll2,2015-02-10\n'
+                                 'poll3,2015-02-20\n'
+                                 'poll4,2015-03-01\n')
+        store_path = os.path.join(output_path, 'store')
+        Rollcall.from_csv(csv_path, rollcalls_csv_path).to_store(store_path)
+        expected_result = [
+            collections.OrderedDict([
+                ('date', '2015-01-01T00:00:00'), ('PSOL', 1.0), ('PT', 1.0),
+                ('PV', None),
+            ]),
+            collections.OrderedDict([
+                ('date', '2015-02-01T00:00:00'), ('PSOL', 1.0),
+                ('PT', round(1 / 3, 10)), ('PV', None),
+            ]),
+            collections.OrderedDict([
+                ('date', '2015-03-01T00:00:00'), ('PSOL', None),
+                ('PT', None), ('PV', None),
+            ]),
+        ]
+
+        for path in [csv_path, store_path]:
+            with self.subTest(path=path):
+                res = Runner().main_by_period(
+                    path, 'month', 'party', adjusted=False,
+                    rollcalls_csv_path=rollcalls_csv_path
+                )
+
+                for row in res:
+                    for key, value in row.items():
+                        if isinstance(value, float):
+                            row[key] = round(value, 10)
+                self.assertEqual(res, expected_result)
+
+    def test_main_with_cache_is_the_same_as_without(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+        runner = Runner(ResultCache(cache_path))
+        test_cases = [
+            {},
+            {'metric_method': None},
+            {'metric_method': None, 'groupby': 'party'},
+            {'majority_percentual': 0.9, 'party': ['PT', 'PV']},
+            {'groupby': 'state', 'state': ['PB', 'SP'],
+             'metric_method': RiceIndex().calculate},
+            {'groupby': 'party', 'rolling_windows': [2]},
+        ]
+
+        for kwargs in test_cases:
+            with self.subTest(**kwargs):
+                expected_result = Runner().main(csv_path, **kwargs)
+                self.assertEqual(runner.main(csv_path, **kwargs),
+                                 expected_result)
+                self.assertEqual(runner.main(csv_path, **kwargs),
+                                 expected_result)
+
+    def test_main_with_cache_reuses_the_votes_with_other_metrics(self):
+        csv_path = self._get_csv_path('example_votes_with_metadata.csv')
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+        runner = Runner(ResultCache(cache_path))
+        metric_methods = [
+            RiceIndex().calculate,
+            RiceIndex().calculate_adjusted,
+            RiceIndex().calculate,
+        ]
+
+        with mock.patch.object(runner, '_read_rollcall',
+                               wraps=runner._read_rollcall) as read_rollcall:
+            for metric_method in metric_methods:
+                runner.main(csv_path, 0.9, 'party', metric_method,
+                            party=['PT', 'PSOL'])
+
+        self.assertEqual(read_rollcall.call_count, 1)
+
     def test_calculate_metric(self):
         votes = [
             [0, 1, 0],
@@ -202,6 +474,24 @@ class TestRunner(unittest.TestCase):
         result = Runner().calculate_metric(votes, mock_calculate)
         self.assertEqual(result, expected_result)
 
+    def test_calculate_metric_uses_rice_index_matrix_methods(self):
+        votes = [
+            [0, 1, 0],
+            [1, 1, None],
+            [1, 1, 0],
+        ]
+        rice_index = RiceIndex()
+
+        for metric_method in [rice_index.calculate,
+                              rice_index.calculate_adjusted]:
+            with self.subTest(metric_method=metric_method.__name__):
+                expected_result = [metric_method([v[i] for v in votes])
+                                   for i in range(len(votes[0]))]
+                runner = Runner()
+                self.assertIsNotNone(runner._get_matrix_method(metric_method))
+                result = runner.calculate_metric(votes, metric_method)
+                self.assertEqual(result, expected_result)
+
     def test_calculate_metric_with_empty_polls(self):
         votes = []
         expected_result = []
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import unittest
+
+import numpy as np
+
+from pipeline.metrics import series
+
+
+class TestSeries(unittest.TestCase):
+    def test_write_and_read_series(self):
+        values = [[0.5, np.nan, 1], [None, 0.25, 0]]
+        test_cases = [
+            ('numeric ids', [10, 11, 12], None),
+            ('string ids', ['a', 'b', 'c'], None),
+            ('dates', ['1', '2', '3'],
+             ['2015-02-01 14:30:00', '2015-02-02', '2015-03-01']),
+        ]
+
+        for name, ids, dates in test_cases:
+            with self.subTest(name=name):
+                output = io.BytesIO()
+                series.write_series(output, values, ids, dates)
+                output.seek(0)
+
+                result = series.read_series(output)
+
+                np.testing.assert_array_equal(
+                    result[0], np.array(values, dtype=float)
+                )
+                self.assertEqual(result[1].astype(str).tolist(),
+                                 [str(rollcall_id) for rollcall_id in ids])
+                if dates is None:
+                    self.assertIsNone(result[2])
+                else:
+                    self.assertEqual(result[2].dtype, 'datetime64[s]')
+                    self.assertEqual(str(result[2][0]), '2015-02-01T14:30:00')
+
+    def test_read_series_from_a_pipe(self):
+        values = np.arange(12, dtype=float).reshape(3, 4)
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(write_fd, 'wb') as output:
+            series.write_series(output, values, [1, 2, 3, 4])
+
+        with os.fdopen(read_fd, 'rb') as input_file:
+            result_values, result_ids, _ = series.read_series(input_file)
+
+        np.testing.assert_array_equal(result_values, values)
+        self.assertEqual(result_ids.tolist(), [1, 2, 3, 4])
+        self.assertEqual(result_ids.dtype, np.int64)
+
+    def test_write_series_raises_if_ids_dont_match_values(self):
+        with self.assertRaises(ValueError):
+            series.write_series(io.BytesIO(), [[1, 0, 1]], [1, 2])
+
+    def test_read_series_raises_if_not_a_series(self):
+        for content in [b'', b'poll1,poll2\n1,0\n', b'{"format": "x"}\n']:
+            with self.subTest(content=content):
+                with self.assertRaises(ValueError):
+                    series.read_series(io.BytesIO(content))
+
+    def test_rows_to_series_and_back(self):
+        rows = [
+            {'poll1': 1, 'poll2': 0.5, 'poll3': None},
+            {'poll2': 0.25, 'poll3': 0},
+        ]
+        expected_rows = [
+            {'poll1': 1, 'poll2': 0.5, 'poll3': None},
+            {'poll1': None, 'poll2': 0.25, 'poll3': 0},
+        ]
+
+        values, ids = series.rows_to_series(rows)
+
+        self.assertEqual(ids, ['poll1', 'poll2', 'poll3'])
+        self.assertEqual(series.series_to_rows(values, ids), expected_rows)
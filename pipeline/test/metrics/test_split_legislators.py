@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pipeline.metrics.rollcall import Rollcall
+from pipeline.metrics.split_legislators import SplitLegislators, Split
+from pipeline.metrics.store import MISSING
+
+
+class TestSplitLegislators(unittest.TestCase):
+    def setUp(self):
+        data = pd.DataFrame([[1, 0, 1, 1, 0],
+                             [0, 0, np.nan, 1, 1],
+                             [1, 1, 1, np.nan, 0]],
+                            columns=[10, 20, 30, 40, 50])
+        metadata = pd.DataFrame({'id': [1, 2, 3],
+                                 'name': ['Joao', 'Pedro', 'Juliana']})
+        self.rollcall = Rollcall(data, metadata)
+
+    def test_view(self):
+        split_legislators = SplitLegislators(self.rollcall)
+        nan = np.nan
+        expected_votes = [[0, 1, 1, 0],
+                          [1, 1, nan, 0],
+                          [0, nan, 1, nan],
+                          [nan, nan, nan, 1]]
+
+        view = split_legislators.view(Split(legislator=1, start=1, mid=3,
+                                            end=4))
+
+        self.assertEqual(view.shape, (4, 4))
+        np.testing.assert_array_equal(view.others, [0, 2])
+        np.testing.assert_array_equal(np.asarray(view), expected_votes)
+        self.assertTrue(np.shares_memory(view.votes,
+                                         split_legislators.votes))
+
+    def test_view_of_a_store_uses_missing_votes(self):
+        store_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_path)
+        self.rollcall.to_store(os.path.join(store_path, 'store'))
+        rollcall = Rollcall.from_store(os.path.join(store_path, 'store'))
+        split_legislators = SplitLegislators(rollcall)
+
+        view = split_legislators.view(Split(0, 0, 1, 4))
+
+        self.assertTrue(np.shares_memory(split_legislators.votes,
+                                         rollcall.data.values))
+        np.testing.assert_array_equal(view.before,
+                                      [1, 0] + [MISSING] * 3)
+        np.testing.assert_array_equal(view.after,
+                                      [MISSING] * 2 + [1, 1, 0])
+
+    def test_splits(self):
+        split_legislators = SplitLegislators(self.rollcall)
+        windows = [(0, 1, 2), (1, 2, 4)]
+
+        splits = list(split_legislators.splits(windows, legislators=[2, 0]))
+
+        self.assertEqual(splits, [(2, 0, 1, 2), (0, 0, 1, 2),
+                                  (2, 1, 2, 4), (0, 1, 2, 4)])
+
+    def test_splits_are_lazy(self):
+        def windows():
+            yield (0, 1, 2)
+            raise AssertionError("the windows were read eagerly")
+        split_legislators = SplitLegislators(self.rollcall)
+
+        splits = split_legislators.splits(windows())
+
+        self.assertEqual(next(splits), (0, 0, 1, 2))
+
+    def test_splits_raise_on_invalid_windows(self):
+        split_legislators = SplitLegislators(self.rollcall)
+        windows = [(0, 3, 2), (0, 1, 5), (-1, 1, 2)]
+
+        for window in windows:
+            with self.subTest(window=window):
+                with self.assertRaises(ValueError):
+                    list(split_legislators.splits([window]))
+
+    def test_map_in_parallel(self):
+        split_legislators = SplitLegislators(self.rollcall)
+        windows = [(0, 1, 4), (0, 2, 4), (1, 2, 3)]
+
+        results = split_legislators.map(_count_votes, windows, jobs=2)
+
+        self.assertEqual(sorted(results),
+                         sorted(split_legislators.map(_count_votes, windows)))
+
+
+def _count_votes(view):
+    votes = np.asarray(view)
+    return int(np.count_nonzero(votes == 1)), \
+        int(np.count_nonzero(votes == 0))
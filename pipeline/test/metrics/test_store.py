@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pipeline.metrics.store import VoteMatrixStore, MISSING
+
+
+class TestVoteMatrixStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_write_and_read(self):
+        votes = [[1, None, 0], [np.nan, 1, 1]]
+        legislators = pd.DataFrame([
+            {'id': 1, 'name': 'Joao', 'party': 'PT', 'state': 'PB'},
+            {'id': 2, 'name': 'Pedro', 'party': 'PSOL', 'state': 'PE'},
+        ])
+        rollcalls = pd.DataFrame({'id': [10, 20, 30],
+                                  'data': ['2015-02-01', '2015-02-02',
+                                           '2015-02-03']})
+
+        store = VoteMatrixStore(self.path)
+        store.write(votes, legislators, rollcalls)
+        res_votes, res_legislators, res_rollcalls = store.read()
+
+        self.assertIsInstance(res_votes, np.memmap)
+        self.assertEqual(res_votes.dtype, np.int8)
+        self.assertEqual(res_votes.tolist(), [[1, MISSING, 0], [MISSING, 1, 1]])
+        self.assertEqual(res_legislators.to_dict(), legislators.to_dict())
+        self.assertEqual(res_rollcalls.to_dict(), rollcalls.to_dict())
+
+    def test_write_raises_if_shapes_dont_match(self):
+        legislators = pd.DataFrame({'id': [1, 2]})
+        rollcalls = pd.DataFrame({'id': [10]})
+
+        with self.assertRaises(ValueError):
+            VoteMatrixStore(self.path).write([[1, 0]], legislators, rollcalls)
+
+    def test_is_store(self):
+        self.assertFalse(VoteMatrixStore.is_store(self.path))
+        VoteMatrixStore(self.path).write([[1]],
+                                         pd.DataFrame({'id': [1]}),
+                                         pd.DataFrame({'id': [10]}))
+        self.assertTrue(VoteMatrixStore.is_store(self.path))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from pipeline.metrics.rollcall import Rollcall
+from pipeline.metrics.window_scheduler import (WindowScheduler, Window,
+                                               Checkpoint)
+
+
+class TestWindowScheduler(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.scheduler = WindowScheduler([
+            ('3', datetime(2003, 2, 11, 10)),
+            ('1', datetime(2003, 2, 6, 12)),
+            ('2', datetime(2003, 2, 6, 18)),
+            ('4', datetime(2003, 2, 11, 16)),
+            ('5', datetime(2003, 2, 21, 12)),
+        ])
+
+    def test_closest_votes(self):
+        test_cases = [
+            # (date, vote_after, vote_before, closest_vote)
+            (date(2003, 2, 1), '2', None, '2'),
+            (date(2003, 2, 6), '2', '1', '2'),
+            (date(2003, 2, 7), '4', '1', '1'),
+            (datetime(2003, 2, 6, 15), '2', '1', '1'),
+            (date(2003, 2, 10), '4', '1', '4'),
+            (date(2003, 2, 11), '4', '3', '4'),
+            # As far from the 11th as from the 21st
+            (date(2003, 2, 16), '5', '3', '3'),
+            (datetime(2003, 2, 20, 23), '5', '3', '5'),
+            (date(2003, 2, 21), '5', '5', '5'),
+            (date(2003, 3, 1), None, '5', '5'),
+        ]
+
+        for day, after, before, closest in test_cases:
+            with self.subTest(date=day):
+                self.assertEqual(self.scheduler.vote_after(day), after)
+                self.assertEqual(self.scheduler.vote_before(day), before)
+                self.assertEqual(self.scheduler.closest_vote(day), closest)
+
+    def test_windows_are_unique(self):
+        windows = self.scheduler.windows(date(2002, 12, 15),
+                                         date(2003, 2, 15),
+                                         mid_months=0, end_months=3)
+
+        # The first start's window is the same as the second one's, and the
+        # third one's split is before its start
+        self.assertEqual(windows, [Window('2', '2', '5')])
+
+    def test_window_is_none_without_rollcalls_between_the_dates(self):
+        test_cases = [
+            (date(2003, 2, 12), date(2003, 2, 14), date(2003, 2, 16)),
+            (date(2003, 2, 7), date(2003, 2, 21), date(2003, 2, 12)),
+        ]
+
+        for dates in test_cases:
+            with self.subTest(dates=dates):
+                self.assertIsNone(self.scheduler.window(*dates))
+
+    def test_from_csv(self):
+        csv_path = os.path.join(self.path, '52-votacoes.csv')
+        pd.DataFrame({
+            'id': [580, 169, 521],
+            'data': ['2003-02-11 12:02:00', '2003-02-06 12:02:00',
+                     '2003-02-12 12:02:00'],
+        }).to_csv(csv_path, index=False)
+
+        scheduler = WindowScheduler.from_csv(csv_path, ids=[169, 580])
+
+        self.assertEqual(scheduler.ids, ['169', '580'])
+
+    def test_run_skips_the_checkpointed_units(self):
+        rollcall = self._rollcall()
+        windows = [Window('1', '2', '4'), Window('2', '4', '5')]
+        checkpoint_path = os.path.join(self.path, 'checkpoint')
+        expected = self.scheduler.run(_count_votes, rollcall, windows,
+                                      os.path.join(self.path, 'expected'))
+        crashing_count_votes = _CrashingCountVotes(units=3)
+
+        with self.assertRaises(RuntimeError):
+            self.scheduler.run(crashing_count_votes, rollcall, windows,
+                               checkpoint_path)
+        self.assertEqual(len(Checkpoint(checkpoint_path).read()), 3)
+        results = self.scheduler.run(_count_votes, rollcall, windows,
+                                     checkpoint_path, jobs=2)
+        resumed_results = self.scheduler.run(_CrashingCountVotes(units=0),
+                                             rollcall, windows,
+                                             checkpoint_path)
+
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(dict(results), dict(expected))
+        self.assertEqual(dict(resumed_results), dict(expected))
+        self.assertEqual(expected[(Window('1', '2', '4'), 20)], (7, 3))
+
+    def test_run_raises_if_the_columns_arent_sorted_by_date(self):
+        rollcall = self._rollcall()
+        rollcall.data = rollcall.data[['2', '1', '3', '4', '5']]
+
+        with self.assertRaises(ValueError):
+            self.scheduler.run(_count_votes, rollcall,
+                               [Window('1', '2', '4')],
+                               os.path.join(self.path, 'checkpoint'))
+
+    def test_checkpoint_discards_a_partially_written_result(self):
+        checkpoint_path = os.path.join(self.path, 'checkpoint')
+        checkpoint = Checkpoint(checkpoint_path)
+        checkpoint.write('first', 1)
+        checkpoint.write('second', 2)
+        with open(checkpoint_path, 'r+b') as checkpoint_file:
+            checkpoint_file.truncate(os.path.getsize(checkpoint_path) - 2)
+
+        self.assertEqual(dict(checkpoint.read()), {'first': 1})
+        checkpoint.write('third', 3)
+        self.assertEqual(dict(checkpoint.read()), {'first': 1, 'third': 3})
+
+    def test_checkpoint_skips_only_the_corrupt_result(self):
+        checkpoint_path = os.path.join(self.path, 'checkpoint')
+        checkpoint = Checkpoint(checkpoint_path)
+        checkpoint.write('first', 1)
+        size = os.path.getsize(checkpoint_path)
+        checkpoint.write('second', 2)
+        checkpoint.write('third', 3)
+        with open(checkpoint_path, 'r+b') as checkpoint_file:
+            checkpoint_file.seek(size + Checkpoint.HEADER.size)
+            checkpoint_file.write(b'\x00')
+
+        self.assertEqual(dict(checkpoint.read()), {'first': 1, 'third': 3})
+
+    def test_checkpoint_writes_the_whole_result(self):
+        checkpoint_path = os.path.join(self.path, 'checkpoint')
+        checkpoint = Checkpoint(checkpoint_path)
+        os_write = os.write
+
+        # Writes a byte at a time
+        with mock.patch('os.write', lambda fd, data: os_write(fd, data[:1])):
+            checkpoint.write('first', list(range(10)))
+            checkpoint.write('second', 2)
+
+        self.assertEqual(dict(checkpoint.read()),
+                         {'first': list(range(10)), 'second': 2})
+
+    def _rollcall(self):
+        data = pd.DataFrame([[1, 0, 1, 1, 0],
+                             [0, 0, np.nan, 1, 1],
+                             [1, 1, 1, np.nan, 0]],
+                            columns=['1', '2', '3', '4', '5'])
+        metadata = pd.DataFrame({'id': [10, 20, 30],
+                                 'name': ['Joao', 'Pedro', 'Juliana']})
+        return Rollcall(data, metadata)
+
+
+class _CrashingCountVotes(object):
+    """Counts the votes, crashing after counting `units` splits"""
+    def __init__(self, units):
+        self.units = units
+
+    def __call__(self, view):
+        if self.units == 0:
+            raise RuntimeError("crashed")
+        self.units -= 1
+        return _count_votes(view)
+
+
+def _count_votes(view):
+    votes = np.asarray(view)
+    return int(np.count_nonzero(votes == 1)), \
+        int(np.count_nonzero(votes == 0))
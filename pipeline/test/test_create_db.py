@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import csv
+import json
+import shlex
+import shutil
+import tempfile
+import unittest
+import contextlib
+import collections
+import subprocess
+from unittest import mock
+
+import pipeline.db as db
+import pipeline.models as models
+import pipeline.create_db as create_db
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         os.path.pardir, os.path.pardir)
+
+
+class TestCreateDB(unittest.TestCase):
+    def test_runs_as_the_makefile_runs_it(self):
+        with open(os.path.join(ROOT_PATH, 'Makefile'), 'r') as makefile:
+            commands = [shlex.split(line) for line in makefile
+                        if 'create_db' in line and line.startswith('\t')]
+
+        self.assertNotEqual(commands, [])
+        for command in commands:
+            with self.subTest(command=' '.join(command)):
+                # Only the options change between the Makefile's commands
+                arguments = [argument for argument in command[1:]
+                             if not argument.startswith('--')]
+                result = subprocess.run(
+                    [sys.executable] + arguments + ['--help'],
+                    cwd=ROOT_PATH, stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+
+                self.assertEqual(result.returncode, 0,
+                                 result.stderr.decode('utf-8'))
+
+
+class TestNormalizeNames(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.addCleanup(db.configure)
+
+    def test_uses_the_same_names_as_the_per_legislator_updates(self):
+        votos = [
+            # The name varies across rollcalls
+            (100, 3, 'Ana'), (100, 1, 'ANA'), (100, 2, 'Ana Maria'),
+            # Ties in the most frequent name
+            (200, 4, 'Bruno'), (200, 1, 'BRUNO'), (200, 2, 'Bruno'),
+            (200, 3, 'BRUNO'),
+            (300, 2, 'Carla'),
+        ]
+        autores = [(1, 100, 'Ana M.'), (2, 200, 'B.'), (3, 999, 'Outro'),
+                   (4, None, 'Sem ID')]
+
+        old_tables = self._normalize(votos, autores, _old_normalize_names)
+        new_tables = self._normalize(votos, autores,
+                                     create_db._normalize_names)
+
+        self.assertEqual(new_tables, old_tables)
+        self.assertNotEqual(old_tables, self._normalize(votos, autores,
+                                                        lambda: None))
+
+    def _normalize(self, votos, autores, normalize_names):
+        """Returns the votos and proposicoes after `normalize_names()`"""
+        _, db_path = tempfile.mkstemp(dir=self.path)
+        db.configure(db_path)
+        models.Base.metadata.create_all(db.engine)
+        with db.engine.begin() as connection:
+            connection.execute(models.Proposicao.__table__.insert(), [
+                {'id': the_id, 'autor_id': autor_id, 'autor': autor}
+                for the_id, autor_id, autor in autores
+            ])
+            connection.execute(models.Votacao.__table__.insert(), [
+                {'id': votacao_id} for votacao_id in range(1, 5)
+            ])
+            connection.execute(models.Voto.__table__.insert(), [
+                {'parlamentar_id': parlamentar_id, 'votacao_id': votacao_id,
+                 'parlamentar_nome': nome}
+                for parlamentar_id, votacao_id, nome in votos
+            ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            normalize_names()
+        db.session.remove()
+        with db.engine.connect() as connection:
+            return [
+                [tuple(row) for row in connection.exec_driver_sql(sql)]
+                for sql in ['SELECT parlamentar_id, votacao_id, '
+                            'parlamentar_nome FROM votos '
+                            'ORDER BY parlamentar_id, votacao_id',
+                            'SELECT id, autor_id, autor FROM proposicoes '
+                            'ORDER BY id']
+            ]
+
+
+class TestIncrementalUpdateDB(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.addCleanup(db.configure)
+        db.configure(os.path.join(self.path, 'dados.db'))
+        patcher = mock.patch.object(db, 'DATA_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The second load has a new rollcall (twice), and the proposição of
+        # a rollcall that was loaded without one
+        self.first_affected_ids = self._load(
+            [_proposicao(1, 1, 'Ana', 100)],
+            [_votacao_proposicao(1, [_votacao(1, '01/03/2015', [
+                 _voto(100, 'Ana'), _voto(200, 'Bruno'),
+             ])]),
+             _votacao_proposicao(2, [_votacao(2, '02/03/2015', [
+                 _voto(100, 'Ana'), _voto(200, 'Bruno B'),
+             ])])]
+        )
+        self.watermark = self._watermark()
+        new_votacao = _votacao(3, '03/03/2015', [
+            _voto(100, 'ANA'), _voto(300, 'Carla'),
+        ])
+        self.second_affected_ids = self._load(
+            [_proposicao(1, 1, 'Ana', 100), _proposicao(2, 2, 'Carla', 300)],
+            [_votacao_proposicao(1, [_votacao(1, '01/03/2015', [
+                 _voto(100, 'Ana'), _voto(200, 'Bruno'),
+             ])]),
+             _votacao_proposicao(2, [
+                 _votacao(2, '02/03/2015', [
+                     _voto(100, 'Ana'), _voto(200, 'Bruno B'),
+                 ]),
+                 new_votacao,
+                 new_votacao,
+             ])]
+        )
+
+    def test_loads_only_the_new_rollcalls(self):
+        votacoes = self._query('SELECT id, id_sessao, proposicao_id '
+                               'FROM votacoes ORDER BY id')
+        votos = self._query('SELECT votacao_id, parlamentar_id FROM votos '
+                            'ORDER BY votacao_id, parlamentar_id')
+
+        self.assertEqual(votacoes, [(1, 1, 1), (2, 2, 2), (3, 3, 2)])
+        self.assertEqual(votos, [(1, 100), (1, 200), (2, 100), (2, 200),
+                                 (3, 100), (3, 300)])
+
+    def test_records_each_load_as_a_watermark(self):
+        cargas = self._query('SELECT ultima_votacao_id, num_votacoes '
+                             'FROM cargas ORDER BY id')
+
+        self.assertEqual(cargas, [(2, 2), (3, 1)])
+        self.assertEqual(self.watermark, 2)
+        self.assertEqual(self._watermark(), 3)
+
+    def test_returns_the_affected_legislators(self):
+        self.assertEqual(self.first_affected_ids, {100, 200})
+        self.assertEqual(self.second_affected_ids, {100, 300})
+
+    def test_normalizes_only_the_affected_legislators(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_db._normalize_names(self.second_affected_ids)
+
+        nomes = collections.defaultdict(set)
+        for parlamentar_id, nome in self._query(
+                'SELECT parlamentar_id, parlamentar_nome FROM votos'):
+            nomes[parlamentar_id].add(nome)
+        autores = self._query('SELECT autor_id, autor FROM proposicoes '
+                              'ORDER BY autor_id')
+
+        self.assertEqual(len(nomes[100]), 1)
+        # Bruno didn't vote on the new rollcall, so it's left as it was
+        self.assertEqual(nomes[200], {'Bruno', 'Bruno B'})
+        self.assertEqual(autores, [(100, nomes[100].pop()), (300, 'Carla')])
+
+    def test_normalize_names_drops_its_temporary_tables(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_db._normalize_names(self.second_affected_ids)
+        self.assertEqual(self._temporary_tables(), [])
+
+        with mock.patch.object(db.session, 'execute',
+                               side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                create_db._normalize_names(self.second_affected_ids)
+        self.assertEqual(self._temporary_tables(), [])
+
+    def _temporary_tables(self):
+        # They're only visible to the session's connection
+        return db.session.connection().exec_driver_sql(
+            "SELECT name FROM sqlite_temp_master WHERE type = 'table'"
+        ).fetchall()
+
+    def _load(self, proposicoes, votacoes_proposicoes):
+        proposicoes_path = os.path.join(self.path, 'proposicoes.csv')
+        with open(proposicoes_path, 'w', newline='') as proposicoes_csv:
+            writer = csv.DictWriter(proposicoes_csv, PROPOSICAO_FIELDS)
+            writer.writeheader()
+            writer.writerows(proposicoes)
+        votacoes_path = os.path.join(self.path, 'votacoes_proposicoes.json')
+        with open(votacoes_path, 'w') as votacoes_json:
+            json.dump(votacoes_proposicoes, votacoes_json)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            return create_db._incremental_update_db(batch_size=2)
+
+    def _watermark(self):
+        with db.engine.connect() as connection:
+            return create_db._get_watermark(connection)
+
+    def _query(self, sql):
+        with db.engine.connect() as connection:
+            return [tuple(row) for row in connection.exec_driver_sql(sql)]
+
+
+PROPOSICAO_FIELDS = [
+    'id', 'nome', 'tipo', 'tema', 'ano', 'numero', 'regime_tramitacao',
+    'autor', 'autor_id', 'autor_uf', 'autor_partido', 'ementa',
+    'explicacao_ementa', 'situacao', 'indexacao', 'apreciacao',
+    'data_apresentacao', 'link_inteiro_teor', 'ultimo_despacho',
+    'ultimo_despacho_data', 'id_proposicao_principal',
+    'nome_proposicao_origem',
+]
+
+
+def _proposicao(proposicao_id, numero, autor, autor_id):
+    proposicao = dict.fromkeys(PROPOSICAO_FIELDS, '')
+    proposicao.update(id=proposicao_id, tipo='PL', ano=2015, numero=numero,
+                      autor=autor, autor_id=autor_id, autor_partido='PT')
+    return proposicao
+
+
+def _votacao_proposicao(numero, votacoes):
+    return {'ano': '2015', 'numero': str(numero), 'sigla': 'PL',
+            'votacoes': votacoes}
+
+
+def _votacao(cod_sessao, data, votos):
+    return {'cod_sessao': str(cod_sessao), 'data': data, 'hora': '10:00',
+            'obj_votacao': 'Votação %d' % cod_sessao, 'resumo': '',
+            'votos': votos, 'orientacao_bancada': [
+                {'sigla': 'PT', 'orientacao': 'Sim'},
+            ]}
+
+
+def _voto(parlamentar_id, nome):
+    return {'ide_cadastro': str(parlamentar_id), 'nome': nome,
+            'partido': 'PT', 'uf': 'SP', 'voto': 'Sim'}
+
+
+def _old_normalize_names():
+    """`create_db._normalize_names` before it used set-based statements"""
+    votos = db.session.query(models.Voto)\
+              .group_by(models.Voto.parlamentar_id)\
+              .filter(models.Voto.parlamentar_id != None)\
+              .all()
+    for voto in votos:
+        db.session.query(models.Voto)\
+          .filter(models.Voto.parlamentar_id == voto.parlamentar_id)\
+          .update({models.Voto.parlamentar_nome: voto.parlamentar_nome})
+
+        db.session.query(models.Proposicao)\
+          .filter(models.Proposicao.autor_id == voto.parlamentar_id)\
+          .update({models.Proposicao.autor: voto.parlamentar_nome})
+
+    db.session.commit()
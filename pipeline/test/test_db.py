@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+
+import pipeline.db as db
+import pipeline.models as models
+from pipeline.votes_to_csv import VotesToCSV
+from pipeline.parties_and_coalitions_changes import PartiesAndCoalitionsChanges
+
+
+class TestDB(unittest.TestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.db_path = os.path.join(path, 'dados.db')
+        self.addCleanup(db.configure)
+        db.configure(self.db_path)
+
+    def test_engine_is_created_only_when_used(self):
+        self.assertIsNone(db._engine)
+        self.assertFalse(os.path.exists(self.db_path))
+
+        db.engine.connect().close()
+
+        self.assertIsNotNone(db._engine)
+        self.assertTrue(os.path.exists(self.db_path))
+
+    def test_db_path_defaults_to_the_environment_variable(self):
+        db.configure()
+        os.environ[db.DB_PATH_VARIABLE] = self.db_path
+        self.addCleanup(os.environ.pop, db.DB_PATH_VARIABLE)
+
+        self.assertEqual(db.get_engine().url.database, self.db_path)
+
+    def test_pragmas(self):
+        expected_pragmas = {
+            'journal_mode': 'wal',
+            'cache_size': -64 * 1024,
+            'mmap_size': 256 * 2 ** 20,
+        }
+
+        with db.get_engine().connect() as connection:
+            for name, value in expected_pragmas.items():
+                with self.subTest(pragma=name):
+                    pragma = connection.exec_driver_sql('PRAGMA %s' % name)
+                    self.assertEqual(pragma.scalar(), value)
+
+    def test_read_only_doesnt_write(self):
+        self._create_db()
+        db.configure(self.db_path, read_only=True)
+
+        with db.get_engine().connect() as connection:
+            self.assertEqual(connection.execute(
+                sqlalchemy.select([sqlalchemy.func.count()])
+                          .select_from(models.Voto.__table__)
+            ).scalar(), 3)
+            with self.assertRaises(sqlalchemy.exc.OperationalError):
+                connection.execute(models.Voto.__table__.delete())
+
+    def test_session_is_scoped_per_thread(self):
+        def get_session():
+            try:
+                return id(db.session())
+            finally:
+                db.session.remove()
+
+        with ThreadPoolExecutor(2) as executor:
+            sessions = list(executor.map(lambda _: get_session(), range(2)))
+
+        self.assertNotEqual(sessions[0], sessions[1])
+        self.assertIs(db.session(), db.session())
+
+    def test_queries_run_concurrently_from_threads(self):
+        self._create_db()
+        db.configure(self.db_path, read_only=True)
+        periods = [(datetime.datetime(2011, 1, 1),
+                    datetime.datetime(2011, 12, 31), 0)]
+
+        def run(query):
+            try:
+                return len(list(query()))
+            finally:
+                db.session.remove()
+        queries = [
+            lambda: VotesToCSV()._get_votos([54]),
+            lambda: PartiesAndCoalitionsChanges()._get_votos_by_date(periods),
+        ] * 4
+
+        with ThreadPoolExecutor(4) as executor:
+            counts = list(executor.map(run, queries))
+
+        self.assertEqual(counts, [3, 2] * 4)
+
+    def _create_db(self):
+        engine = db.get_engine()
+        models.Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(models.Votacao.__table__.insert(), [
+                {'id': 1, 'data': datetime.datetime(2011, 3, 1)},
+                {'id': 2, 'data': datetime.datetime(2012, 3, 1)},
+            ])
+            connection.execute(models.Voto.__table__.insert(), [
+                {'parlamentar_id': 1, 'parlamentar_partido': 'PT',
+                 'votacao_id': 1, 'voto': 'Sim'},
+                {'parlamentar_id': 2, 'parlamentar_partido': 'PSDB',
+                 'votacao_id': 1, 'voto': 'Não'},
+                {'parlamentar_id': 1, 'parlamentar_partido': 'PT',
+                 'votacao_id': 2, 'voto': 'Sim'},
+            ])
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+
+from pipeline import models
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_yields_the_same_elements_as_json_load(self):
+        data = [
+            {'ano': '2015', 'votacoes': [{'votos': [1, 2, 3]}]},
+            {'ano': '2014', 'texto': 'com ] e , no meio'},
+            [],
+            1234567,
+        ]
+        json_file = io.StringIO(json.dumps(data, indent=2))
+
+        for chunk_size in [1, 3, 64, 2 ** 16]:
+            with self.subTest(chunk_size=chunk_size):
+                json_file.seek(0)
+                result = list(models.iter_json_array(json_file, chunk_size))
+                self.assertEqual(result, data)
+
+    def test_empty_array(self):
+        json_file = io.StringIO(' [ ] ')
+        self.assertEqual(list(models.iter_json_array(json_file)), [])
+
+    def test_raises_if_not_an_array(self):
+        json_file = io.StringIO('{"ano": 2015}')
+        with self.assertRaises(ValueError):
+            list(models.iter_json_array(json_file))
+
+    def test_raises_if_truncated(self):
+        json_file = io.StringIO('[{"ano": 2015}, {"ano"')
+        with self.assertRaises(ValueError):
+            list(models.iter_json_array(json_file, 4))
+
+
+class TestBuildRow(unittest.TestCase):
+    def test_votacao_build_row(self):
+        sessao = {
+            'cod_sessao': '123',
+            'data': '01/02/2015',
+            'hora': '14:30 ',
+            'obj_votacao': ' Requerimento ',
+            'resumo': '',
+        }
+
+        row = models.Votacao.build_row(42, sessao)
+
+        self.assertEqual(row['proposicao_id'], 42)
+        self.assertEqual(row['id_sessao'], '123')
+        self.assertEqual(row['data'].isoformat(), '2015-02-01T14:30:00')
+        self.assertEqual(row['obj_votacao'], 'Requerimento')
+        self.assertIsNone(row['resumo'])
+
+    def test_voto_build_row(self):
+        voto = {
+            'ide_cadastro': '74',
+            'nome': 'Joao ',
+            'partido': 'PT',
+            'uf': 'PB',
+            'voto': 'Sim',
+        }
+        expected_row = {
+            'votacao_id': 1,
+            'parlamentar_id': 74,
+            'parlamentar_nome': 'Joao',
+            'parlamentar_partido': 'PT',
+            'parlamentar_uf': 'PB',
+            'voto': 'Sim',
+        }
+
+        self.assertEqual(models.Voto.build_row(1, voto), expected_row)
+
+    def test_voto_build_row_ignores_votes_without_legislator_id(self):
+        voto = {'ide_cadastro': '', 'nome': 'Joao'}
+        self.assertIsNone(models.Voto.build_row(1, voto))
+
+
+class TestProposicaoIndex(unittest.TestCase):
+    def test_get(self):
+        index = models.ProposicaoIndex([
+            (2015, 1, 'PL', 'pl-1'),
+            (2015, 1, 'PEC', 'pec-1'),
+            (2015, 1, 'PL', 'repeated'),
+        ])
+        votacao_proposicao = {'ano': '2015', 'numero': '1', 'sigla': 'PL'}
+
+        self.assertEqual(index.get(votacao_proposicao), 'pl-1')
+        self.assertEqual(index.unmatched, set())
+
+    def test_get_collects_unmatched_keys(self):
+        index = models.ProposicaoIndex([(2015, 1, 'PL', 'pl-1')])
+        missing = [
+            {'ano': '2014', 'numero': '1', 'sigla': 'PL'},
+            {'ano': '2015', 'numero': '2', 'sigla': 'PL'},
+            {'ano': '2015', 'numero': '2', 'sigla': 'PL'},
+        ]
+
+        for votacao_proposicao in missing:
+            self.assertIsNone(index.get(votacao_proposicao))
+        self.assertEqual(index.unmatched, {(2014, 1, 'PL'), (2015, 2, 'PL')})
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pipeline.parties import normalize_party_name
+
+
+class TestParties(unittest.TestCase):
+    def test_normalize_party_name(self):
+        test_cases = [
+            ('PFL', 'PFL>DEM'),
+            ('DEM', 'PFL>DEM'),
+            ('PPB', 'PDS>PP'),
+            ('Solidaried', 'SD'),
+            ('PCDOB', 'PCdoB'),
+            ('pcdob', 'PCdoB'),
+            ('pv1', 'PV'),
+            ('PT', 'PT'),
+            ('S.Part.', 'S.Part.'),
+            ('', ''),
+            (None, None),
+        ]
+        for party_name, expected_result in test_cases:
+            with self.subTest(party_name=party_name):
+                self.assertEqual(normalize_party_name(party_name),
+                                 expected_result)
+
+    def test_normalize_party_name_doesnt_match_substrings(self):
+        for party_name in ['P', 'PC', 'DOB', 'PV', 'V1']:
+            with self.subTest(party_name=party_name):
+                self.assertEqual(normalize_party_name(party_name), party_name)
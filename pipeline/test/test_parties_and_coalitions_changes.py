@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import collections
+from datetime import date, datetime
+from unittest import mock
+
+from pipeline.parties_and_coalitions_changes import PartiesAndCoalitionsChanges
+
+
+Voto = collections.namedtuple('Voto', ['parlamentar_id', 'parlamentar_nome',
+                                       'parlamentar_partido', 'votacao_id',
+                                       'data'])
+
+
+class TestPartiesAndCoalitionsChanges(unittest.TestCase):
+    def test_get_parlamentares_by_coalizao_keeps_the_latest_votes(self):
+        coalizoes = [
+            {'Id_Clz': '1', 'DataInicial': date(2003, 1, 1),
+             'DataFinal': date(2003, 1, 31)},
+            # Overlaps the first coalition's last day
+            {'Id_Clz': '2', 'DataInicial': date(2003, 1, 31),
+             'DataFinal': date(2003, 3, 1)},
+            {'Id_Clz': '3', 'DataInicial': None, 'DataFinal': None},
+        ]
+        votos = [
+            Voto(2, 'Pedro', 'PT', 10, datetime(2003, 1, 2)),
+            Voto(1, 'Joao', 'PT', 30, datetime(2003, 1, 10)),
+            Voto(1, 'Joao', 'PT', 20, datetime(2003, 1, 10)),
+            Voto(1, 'Joao', 'PSDB', 40, datetime(2003, 1, 31)),
+            Voto(2, 'Pedro', 'PT', 50, datetime(2003, 2, 10)),
+            # After the first day's start, so outside the last coalition
+            Voto(2, 'Pedro', 'PT', 60, datetime(2003, 3, 1, 12)),
+        ]
+        expected_rollcalls = [
+            [(1, 'PSDB', 40), (1, 'PT', 20), (2, 'PT', 10)],
+            [(1, 'PSDB', 40), (2, 'PT', 50)],
+            [],
+        ]
+        changes = PartiesAndCoalitionsChanges()
+
+        with mock.patch.object(changes, '_get_votos_by_date',
+                               return_value=iter(votos)):
+            result = changes._get_parlamentares_by_coalizao(coalizoes)
+
+        for coalizao, votos_coalizao, rollcalls in zip(coalizoes, result,
+                                                       expected_rollcalls):
+            with self.subTest(coalizao=coalizao['Id_Clz']):
+                self.assertEqual([(v['id'], v['party'], v['rollcall_id'])
+                                  for v in votos_coalizao], rollcalls)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import pandas as pd
+
+from pipeline.metrics.store import VoteMatrixStore
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         os.path.pardir, os.path.pardir)
+BIN_PATH = os.path.join(ROOT_PATH, 'bin')
+# Seconds each script may take to start, on top of a bare interpreter's
+# startup. The Makefile calls them in pipelines, and batch jobs call them
+# hundreds of times, so keep them within these budgets.
+HELP_BUDGET = 0.25
+RUN_BUDGET = 1.5
+# Best of how many runs, so a busy machine doesn't fail the tests
+RUNS = 3
+
+# Runs a script with the repository in the path, writing the NumPy and pandas
+# modules it loaded to stderr. The interpreter is isolated (-I), so neither
+# the user's site packages nor $PYTHONPATH add to its startup.
+BOOTSTRAP = """
+import json, runpy, sys
+sys.path.insert(0, {root_path!r})
+sys.argv = {argv!r}
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit as e:
+    if e.code:
+        raise
+heavy_modules = [name for name in sys.modules
+                 if name.startswith(('numpy.', 'pandas.'))]
+sys.stderr.write(json.dumps(heavy_modules))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = min(_time([sys.executable, '-I', '-c', 'pass'])
+                           for _ in range(RUNS))
+
+    def test_help_doesnt_load_numpy_nor_pandas(self):
+        for script in ['rice_index', 'rollmean', 'change_points']:
+            with self.subTest(script=script):
+                elapsed, heavy_modules = self._run_script(script, ['--help'])
+
+                self.assertEqual(heavy_modules, [])
+                self.assertLess(elapsed - self.baseline, HELP_BUDGET)
+
+    def test_tiny_inputs(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        store_path = os.path.join(path, 'store')
+        VoteMatrixStore(store_path).write(
+            [[1, 0, 1], [1, 1, None]],
+            pd.DataFrame({'id': [1, 2], 'name': ['A', 'B'],
+                          'party': ['PT', 'PT'], 'state': ['PB', 'PE']}),
+            pd.DataFrame({'id': [10, 20, 30]})
+        )
+        series_path = os.path.join(path, 'series.csv')
+        with open(series_path, 'w') as series_file:
+            series_file.write('10,20,30\n1.0,0.5,1.0\n')
+        test_cases = [
+            ('rice_index', ['--input', store_path, '--groupby', 'party']),
+            ('rollmean', ['--input', series_path, '--width', '2']),
+        ]
+
+        for script, args in test_cases:
+            with self.subTest(script=script):
+                elapsed, _ = self._run_script(script, args)
+
+                self.assertLess(elapsed - self.baseline, RUN_BUDGET)
+
+    def _run_script(self, script, args):
+        """Returns the script's best time and the heavy modules it loaded"""
+        code = BOOTSTRAP.format(root_path=ROOT_PATH,
+                                argv=[os.path.join(BIN_PATH, script)] + args)
+        command = [sys.executable, '-I', '-c', code]
+        elapsed = min(_time(command) for _ in range(RUNS))
+        result = subprocess.run(command, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, check=True)
+        return elapsed, json.loads(result.stderr.decode('utf-8'))
+
+
+def _time(command):
+    started_at = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started_at
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy
+
+import pipeline.models as models
+from pipeline.upgrade_db import UpgradeDB
+
+
+NEW_INDEXES = ['ix_votacoes_data', 'ix_votos_votacao_id_parlamentar']
+
+
+class TestUpgradeDB(unittest.TestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.engine = sqlalchemy.create_engine(
+            'sqlite:///%s' % os.path.join(path, 'dados.db')
+        )
+        self.addCleanup(self.engine.dispose)
+        # A DB created before the indexes were added to the models
+        models.Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            for index in NEW_INDEXES:
+                connection.exec_driver_sql('DROP INDEX %s' % index)
+
+    def test_upgrade_creates_only_the_missing_indexes(self):
+        upgrade_db = UpgradeDB()
+
+        self.assertEqual(upgrade_db.upgrade(self.engine), NEW_INDEXES)
+        self.assertEqual(upgrade_db.upgrade(self.engine), [])
+
+    def test_normalize_parties_merges_the_old_names(self):
+        votos = [('PFL', 1), ('pcdob', 2), ('PCdoB', 3), ('PT', 4),
+                 ('SDD', 5), (None, 6)]
+        autores_partidos = [(1, 'PPB'), (2, 'PP'), (3, 'PSOL')]
+        with self.engine.begin() as connection:
+            connection.execute(models.Voto.__table__.insert(), [
+                {'parlamentar_partido': partido, 'parlamentar_id': 100,
+                 'votacao_id': votacao_id}
+                for partido, votacao_id in votos
+            ])
+            connection.execute(models.Proposicao.__table__.insert(), [
+                {'id': the_id, 'autor_partido': partido}
+                for the_id, partido in autores_partidos
+            ])
+        upgrade_db = UpgradeDB()
+
+        num_rows = upgrade_db.normalize_parties(self.engine)
+
+        with self.engine.connect() as connection:
+            partidos = [row[0] for row in connection.exec_driver_sql(
+                'SELECT parlamentar_partido FROM votos ORDER BY votacao_id'
+            )]
+            autores_partidos = [row[0] for row in connection.exec_driver_sql(
+                'SELECT autor_partido FROM proposicoes ORDER BY id'
+            )]
+        self.assertEqual(num_rows, 5)
+        self.assertEqual(partidos, ['PFL>DEM', 'PCdoB', 'PCdoB', 'PT', 'SD',
+                                    None])
+        self.assertEqual(autores_partidos, ['PDS>PP', 'PDS>PP', 'PSOL'])
+        self.assertEqual(upgrade_db.normalize_parties(self.engine), 0)
+
+    def test_upgrade_removes_the_full_scans(self):
+        upgrade_db = UpgradeDB()
+        plans_before = upgrade_db.query_plans(self.engine)
+
+        upgrade_db.upgrade(self.engine)
+        plans_after = upgrade_db.query_plans(self.engine)
+
+        for name in plans_before.keys():
+            with self.subTest(query=name):
+                self.assertIn('votos',
+                              upgrade_db.full_scans(plans_before[name]))
+                self.assertEqual(upgrade_db.full_scans(plans_after[name]),
+                                 [])
+
+    def test_full_scans(self):
+        plan = [
+            'SCAN votos USING INDEX sqlite_autoindex_votos_1',
+            'SEARCH votacoes USING INTEGER PRIMARY KEY (rowid=?)',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ]
+
+        self.assertEqual(UpgradeDB.full_scans(plan), ['votos'])
@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import os
+import csv
+import shutil
+import tempfile
 import unittest
+import collections
+from unittest import mock
 
-from pipeline.votes_to_csv import VotesToCSV
+from pipeline.votes_to_csv import VotesToCSV, _LegislatureOutput
+
+
+Voto = collections.namedtuple('Voto', ['parlamentar_id', 'parlamentar_nome',
+                                       'parlamentar_partido', 'parlamentar_uf',
+                                       'votacao_id', 'voto'])
 
 
 class TestVotesToCSV(unittest.TestCase):
@@ -18,3 +29,113 @@ class TestVotesToCSV(unittest.TestCase):
             with self.subTest(legislature=legislature):
                 self.assertEqual(VotesToCSV()._legislature_dates(legislature),
                                  dates)
+
+    def test_legislature_accepts_ranges_and_lists(self):
+        test_cases = {
+            '54': [54],
+            '48-50': [48, 49, 50],
+            '55,48,52': [48, 52, 55],
+            '48-49,55': [48, 49, 55],
+        }
+        parser = VotesToCSV().parser
+
+        for legislature, expected_result in test_cases.items():
+            with self.subTest(legislature=legislature):
+                options = parser.parse_args(['--legislature', legislature])
+                self.assertEqual(options.legislature, expected_result)
+
+    def test_multiple_legislatures_require_placeholder_in_paths(self):
+        args = ['--legislature', '48-55', '--votes-output-path', 'votos.csv']
+        with self.assertRaises(SystemExit):
+            VotesToCSV().run(args)
+
+    def test_write_to_csv_writes_each_legislator_as_soon_as_possible(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        votos_path = os.path.join(path, 'votos.csv')
+        votacoes_path = os.path.join(path, 'votacoes.csv')
+        votacoes = [
+            {'id': 10, 'id_sessao': 1, 'proposicao_id': 1,
+             'data': '2015-02-01', 'resumo': '', 'obj_votacao': ''},
+            {'id': 20, 'id_sessao': 1, 'proposicao_id': 1,
+             'data': '2015-02-02', 'resumo': '', 'obj_votacao': ''},
+        ]
+        votos = [
+            Voto(None, 'Sem ID', 'PT', 'PB', 10, 'Sim'),
+            Voto(1, 'Joao', 'PT', 'PB', 10, 'Sim'),
+            Voto(1, 'Joao', 'PT', 'PB', 20, 'Não'),
+            Voto(2, 'Pedro', 'PSOL', 'PE', 20, 'Abstenção'),
+            Voto(3, 'Maria', 'PT', 'SP', 20, 'Sim'),
+        ]
+        consumed = []
+        exhausted = []
+
+        def lazy_votos():
+            for voto in votos:
+                consumed.append(voto)
+                yield voto
+            exhausted.append(True)
+
+        # How many votes were consumed when each legislator was written
+        written = []
+        write_row = _LegislatureOutput._write_row
+
+        def recording_write_row(output, legislator, votes):
+            written.append((legislator[0], len(consumed), bool(exhausted)))
+            write_row(output, legislator, votes)
+
+        with mock.patch.object(_LegislatureOutput, '_write_row',
+                               recording_write_row):
+            VotesToCSV()._write_to_csv(lazy_votos(), votacoes,
+                                       votos_path, votacoes_path)
+
+        with open(votos_path, 'r') as csv_file:
+            result = list(csv.reader(csv_file))
+        # Each legislator is written once the next one's first vote is read
+        self.assertEqual(written, [(1, 4, False), (2, 5, False),
+                                   (3, 5, True)])
+        self.assertEqual(result, [
+            ['id', 'name', 'party', 'state', '10', '20'],
+            ['1', 'Joao', 'PT', 'PB', '1', '0'],
+            ['2', 'Pedro', 'PSOL', 'PE', '', ''],
+            ['3', 'Maria', 'PT', 'SP', '', '1'],
+        ])
+
+    def test_write_legislatures_splits_legislators_votes(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        votacoes = {
+            54: [{'id': 10, 'id_sessao': 1, 'proposicao_id': 1,
+                  'data': '2014-02-01', 'resumo': '', 'obj_votacao': ''}],
+            55: [{'id': 20, 'id_sessao': 2, 'proposicao_id': 1,
+                  'data': '2015-02-02', 'resumo': '', 'obj_votacao': ''}],
+        }
+        legislatures = {10: 54, 20: 55}
+        votos = [
+            Voto(1, 'Joao', 'PT', 'PB', 10, 'Sim'),
+            Voto(1, 'Joao', 'PSOL', 'PB', 20, 'Não'),
+            Voto(2, 'Pedro', 'PSOL', 'PE', 20, 'Sim'),
+        ]
+        outputs = {}
+        for legislature, the_votacoes in votacoes.items():
+            outputs[legislature] = _LegislatureOutput(
+                the_votacoes,
+                os.path.join(path, '%d.csv' % legislature),
+                os.path.join(path, '%d-votacoes.csv' % legislature),
+            )
+
+        VotesToCSV()._write_legislatures(
+            iter(votos), outputs, lambda v: legislatures[v.votacao_id]
+        )
+
+        result = {}
+        for legislature in votacoes.keys():
+            with open(os.path.join(path, '%d.csv' % legislature)) as f:
+                result[legislature] = list(csv.reader(f))
+        self.assertEqual(result, {
+            54: [['id', 'name', 'party', 'state', '10'],
+                 ['1', 'Joao', 'PT', 'PB', '1']],
+            55: [['id', 'name', 'party', 'state', '20'],
+                 ['1', 'Joao', 'PSOL', 'PB', '0'],
+                 ['2', 'Pedro', 'PSOL', 'PE', '1']],
+        })
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import collections
+from datetime import datetime
+
+import sqlalchemy
+
+import pipeline.db as db
+import pipeline.models as models
+import pipeline.parties as parties
+from pipeline.votes_to_csv import VotesToCSV
+from pipeline.parties_and_coalitions_changes import PartiesAndCoalitionsChanges
+
+
+class UpgradeDB(object):
+    """Adds the indexes missing in DBs created by older versions
+
+    `models.Base.metadata.create_all` only creates the missing tables, so the
+    indexes added to existing tables since the DB was created have to be
+    created here. The table statistics are then updated with `ANALYZE`, so
+    SQLite's query planner picks them.
+
+    The parties' names are normalized at ingest time, and the incremental
+    loads leave the existing rows untouched, so the rows loaded by older
+    versions have their parties normalized here too.
+    """
+    def __init__(self):
+        self.parser = self._create_parser()
+
+    def run(self, args=sys.argv[1:], output=sys.stdout):
+        options = self.parser.parse_args(args)
+        db.configure(options.db_path, read_only=options.report_only)
+        if not options.report_only:
+            num_rows = self.normalize_parties(db.get_engine())
+            output.write('Normalized the parties of %d rows\n' % num_rows)
+            for index in self.upgrade(db.get_engine()):
+                output.write('Created index %s\n' % index)
+        output.write(self.report(db.get_engine(), options.legislature))
+
+    def upgrade(self, engine):
+        """Creates the missing indexes and analyzes the tables
+
+        Returns:
+            list: The names of the created indexes.
+        """
+        created = []
+        with engine.begin() as connection:
+            inspector = sqlalchemy.inspect(connection)
+            tables = set(inspector.get_table_names())
+            for table in models.Base.metadata.sorted_tables:
+                if table.name not in tables:
+                    continue
+                existing = {index['name']
+                            for index in inspector.get_indexes(table.name)}
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name not in existing:
+                        index.create(connection)
+                        created.append(index.name)
+            connection.exec_driver_sql('ANALYZE')
+        return created
+
+    def normalize_parties(self, engine):
+        """Merges the parties' old names in `votos` and `proposicoes`
+
+        Each table is rewritten with a single UPDATE, mapping each alias in
+        `parties.PARTIES_ALIASES` to its party case insensitively, as
+        `parties.normalize_party_name` does at ingest time.
+
+        Returns:
+            int: The number of updated rows.
+        """
+        parties_by_alias = collections.OrderedDict(
+            (alias.lower(), party)
+            for party, aliases in parties.PARTIES_ALIASES
+            for alias in aliases
+        )
+        columns = [models.Voto.__table__.c.parlamentar_partido,
+                   models.Proposicao.__table__.c.autor_partido]
+
+        num_rows = 0
+        with engine.begin() as connection:
+            tables = set(sqlalchemy.inspect(connection).get_table_names())
+            for column in columns:
+                if column.table.name not in tables:
+                    continue
+                alias = sqlalchemy.func.lower(column)
+                result = connection.execute(
+                    column.table.update()
+                          .where(alias.in_(list(parties_by_alias)))
+                          .where(column.notin_(set(parties_by_alias.values())))
+                          .values({column.name: sqlalchemy.case(
+                              parties_by_alias, value=alias
+                          )})
+                )
+                num_rows += result.rowcount
+        return num_rows
+
+    def query_plans(self, engine, legislature=54):
+        """Returns the SQLite query plans of the main queries
+
+        The queries are the ones in `VotesToCSV.run` and
+        `PartiesAndCoalitionsChanges.run`, over the legislature's dates.
+
+        Returns:
+            OrderedDict: Each query's name to its plan's lines.
+        """
+        start, end = VotesToCSV()._legislature_dates(legislature)
+        queries = collections.OrderedDict([
+            ('VotesToCSV.run', VotesToCSV()._votos_query([legislature])),
+            ('PartiesAndCoalitionsChanges.run',
+             PartiesAndCoalitionsChanges()._votos_by_date_query(
+                 datetime.strptime(start, '%Y-%m-%d'),
+                 datetime.strptime(end, '%Y-%m-%d'),
+             )),
+        ])
+
+        result = collections.OrderedDict()
+        with engine.connect() as connection:
+            for name, query in queries.items():
+                compiled = query.compile(dialect=engine.dialect)
+                params = compiled.construct_params()
+                plan = connection.exec_driver_sql(
+                    'EXPLAIN QUERY PLAN %s' % compiled,
+                    tuple(params[key] for key in compiled.positiontup)
+                )
+                result[name] = [row[-1] for row in plan]
+        return result
+
+    def report(self, engine, legislature=54):
+        """Formats the `query_plans` flagging the full table scans"""
+        lines = []
+        for name, plan in self.query_plans(engine, legislature).items():
+            full_scans = self.full_scans(plan)
+            if full_scans:
+                status = 'full scans on %s' % ', '.join(full_scans)
+            else:
+                status = 'index scans only'
+            lines.append('%s (%s):' % (name, status))
+            lines += ['    %s' % step for step in plan]
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def full_scans(plan):
+        """Returns the tables read whole in a query plan
+
+        SQLite describes them as "SCAN <table>", even when it's read through
+        an index to avoid sorting, while index lookups are "SEARCH <table>".
+        """
+        return [step.split()[1] for step in plan if step.startswith('SCAN ')]
+
+    def _create_parser(self):
+        parser = argparse.ArgumentParser(
+            description="Adds the missing indexes to the votes' DB and shows "
+                        "the main queries' plans"
+        )
+        parser.add_argument(
+            "--report-only", action="store_true",
+            help="only show the query plans, without changing the DB "
+                 "(default: False)"
+        )
+        parser.add_argument(
+            "--legislature", type=int, default=54,
+            help="legislature whose dates are used in the queries "
+                 "(default: 54)"
+        )
+        parser.add_argument(
+            "--db-path", default=None,
+            help="path to the votes' DB (default: $%s or data/dados.db)" %
+                 db.DB_PATH_VARIABLE
+        )
+        return parser
@@ -1,70 +1,184 @@
 # -*- coding: utf-8 -*-
 
 import csv
-import copy
 import sys
 import argparse
+import collections
+import multiprocessing
 from itertools import groupby
+from operator import attrgetter
+
+import sqlalchemy
 
 import pipeline.db as db
 import pipeline.models as models
+from pipeline.lazy import lazy_import
+from pipeline.metrics.store import VoteMatrixStore, encode_votes, MISSING
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class VotesToCSV(object):
+    LEGISLATOR_KEYS = ['id', 'name', 'party', 'state']
+    ROLLCALL_KEYS = ['id', 'id_sessao', 'proposicao_id',
+                     'data', 'resumo', 'obj_votacao']
+    # How many votes are fetched from the DB at a time
+    BATCH_SIZE = 10000
+
     def __init__(self):
         self.parser = self._create_parser()
 
-    def run(self):
-        options = self.parser.parse_args(sys.argv[1:])
+    def run(self, args=sys.argv[1:]):
+        """Writes the legislatures' votes and rollcalls
 
-        start_date, end_date = self._legislature_dates(options.legislature)
-        inside_year = models.Votacao.data.between(start_date,
-                                                  end_date)
-        votos = db.session.query(models.Voto)\
-                  .order_by(models.Voto.parlamentar_id)\
-                  .order_by(models.Voto.parlamentar_partido)\
-                  .join(models.Votacao)\
-                  .filter(inside_year)\
-                  .all()
+        The votes of every legislature are read in a single pass, streamed
+        from the DB in batches ordered by legislator. Each legislator's rows
+        are written as soon as all their votes were read, so only a single
+        legislator's votes are kept in memory (plus an int8 row per
+        legislator, if writing a store as well).
 
-        votacoes = db.session.query(models.Votacao)\
-                     .filter(inside_year)\
-                     .order_by(models.Votacao.data)\
-                     .all()
+        With `--jobs` larger than 1, the legislators' rows are kept as int8
+        rows instead, and each legislature's files are written in parallel
+        by a process pool after the scan.
+        """
+        options = self.parser.parse_args(args)
+        db.configure(options.db_path, read_only=True)
+        legislatures = options.legislature
+        if len(legislatures) > 1:
+            for path in [options.votes_output_path,
+                         options.rollcalls_output_path,
+                         options.store_output_path]:
+                if path and '{legislature}' not in path:
+                    self.parser.error('the output paths must have a '
+                                      '{legislature} placeholder when '
+                                      'exporting multiple legislatures')
 
-        votos_path = options.votes_output_path
-        votacoes_path = options.rollcalls_output_path
+        votacoes = self._get_votacoes(legislatures)
+        votos = self._get_votos(legislatures)
 
-        return self._write_to_csv(votos, votacoes, votos_path, votacoes_path)
+        outputs = {}
+        for legislature in legislatures:
+            format_path = lambda path: path and path.format(
+                legislature=legislature
+            )
+            outputs[legislature] = _LegislatureOutput(
+                votacoes[legislature],
+                format_path(options.votes_output_path),
+                format_path(options.rollcalls_output_path),
+                format_path(options.store_output_path),
+            )
 
-    def _write_to_csv(self, votos, votacoes, votos_path, votacoes_path):
-        votacoes = [self._shallow_convert_to_dict(v) for v in votacoes]
-        votacoes_ids = [v['id'] for v in votacoes]
+        return self._write_legislatures(votos, outputs,
+                                        attrgetter('legislature'),
+                                        options.jobs)
 
-        res = []
-        votos_groupped = groupby(votos, lambda p: (p.parlamentar_id))
-        for (parlamentar_id), votos_parlamentar in votos_groupped:
-            if not parlamentar_id:
-                continue
-            res += [self._convert_to_vote_list(parlamentar_id,
-                                               list(votos_parlamentar))]
+    def _get_votacoes(self, legislatures):
+        """Returns the rollcalls of each legislature ordered by date"""
+        votacoes = models.Votacao.__table__
+        query = sqlalchemy.select([votacoes.c[key]
+                                   for key in self.ROLLCALL_KEYS] +
+                                  [self._legislature_column(legislatures)])\
+                          .where(self._inside_legislatures(legislatures))\
+                          .order_by(votacoes.c.data)
 
-        with open(votos_path, 'w', newline='') as csv_file:
-            keys = ['id', 'name', 'party', 'state']
-            fieldnames = keys + list(votacoes_ids)
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        result = collections.OrderedDict((l, []) for l in legislatures)
+        for votacao in db.session.execute(query):
+            votacao = dict(votacao)
+            result[votacao.pop('legislature')].append(votacao)
+        return result
 
-            writer.writeheader()
-            writer.writerows(res)
+    def _get_votos(self, legislatures):
+        """Streams the votes in the legislatures ordered by legislator"""
+        query = self._votos_query(legislatures)
+        return self._fetch_in_batches(db.session.execute(query))
 
-        with open(votacoes_path, 'w', newline='') as csv_file:
-            keys = ['id', 'id_sessao', 'proposicao_id',
-                    'data', 'resumo', 'obj_votacao']
-            fieldnames = keys
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+    def _votos_query(self, legislatures):
+        votos = models.Voto.__table__
+        votacoes = models.Votacao.__table__
+        query = sqlalchemy.select([votos.c.parlamentar_id,
+                                   votos.c.parlamentar_nome,
+                                   votos.c.parlamentar_partido,
+                                   votos.c.parlamentar_uf,
+                                   votos.c.votacao_id,
+                                   votos.c.voto,
+                                   self._legislature_column(legislatures)])\
+                          .select_from(votos.join(votacoes))\
+                          .where(self._inside_legislatures(legislatures))\
+                          .order_by(votos.c.parlamentar_id)\
+                          .order_by(votos.c.parlamentar_partido)\
+                          .execution_options(stream_results=True)
+        return query
 
-            writer.writeheader()
-            writer.writerows(votacoes)
+    def _inside_legislatures(self, legislatures):
+        data = models.Votacao.__table__.c.data
+        return sqlalchemy.or_(*[data.between(*self._legislature_dates(l))
+                                for l in legislatures])
+
+    def _legislature_column(self, legislatures):
+        data = models.Votacao.__table__.c.data
+        whens = [(data.between(*self._legislature_dates(l)), l)
+                 for l in legislatures]
+        return sqlalchemy.case(whens).label('legislature')
+
+    def _fetch_in_batches(self, result):
+        while True:
+            rows = result.fetchmany(self.BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def _write_to_csv(self, votos, votacoes, votos_path, votacoes_path,
+                      store_path=None):
+        """Writes a single legislature's votes and rollcalls
+
+        Args:
+            votos (iterable): Votes ordered by legislator. They can be
+                consumed lazily.
+            votacoes (list of dicts): The rollcalls, in the columns' order.
+        """
+        output = _LegislatureOutput(votacoes, votos_path, votacoes_path,
+                                    store_path)
+        self._write_legislatures(votos, {None: output}, lambda voto: None)
+
+    def _write_legislatures(self, votos, outputs, get_legislature, jobs=1):
+        """Writes each legislator's votes to their legislatures' outputs
+
+        Args:
+            votos (iterable): Votes ordered by legislator.
+            outputs (dict): `_LegislatureOutput` by legislature.
+            get_legislature (function): Returns the legislature of a vote.
+            jobs (int): Number of processes writing the outputs. If it's 1,
+                they're written while `votos` is consumed.
+        """
+        deferred = jobs > 1
+        for output in outputs.values():
+            output.open(deferred)
+
+        votos_groupped = groupby(votos, attrgetter('parlamentar_id'))
+        for (parlamentar_id), votos_parlamentar in votos_groupped:
+            if not parlamentar_id:
+                continue
+            votos_por_legislatura = collections.OrderedDict()
+            for voto in votos_parlamentar:
+                legislature = get_legislature(voto)
+                votos_por_legislatura.setdefault(legislature, []).append(voto)
+            for legislature, votos_legislatura in votos_por_legislatura.items():
+                row = self._convert_to_vote_list(parlamentar_id,
+                                                 votos_legislatura)
+                outputs[legislature].add(row)
+
+        if deferred:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                pool.map(_write_deferred_output, outputs.values())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for output in outputs.values():
+                output.close()
 
     def _legislature_dates(self, legislature):
         if legislature < 48:
@@ -80,11 +194,6 @@ class VotesToCSV(object):
         elif voto == 'Não':
             return 0
 
-    def _shallow_convert_to_dict(self, model):
-        res = copy.copy(model.__dict__)
-        del res['_sa_instance_state']
-        return res
-
     def _convert_to_vote_list(self, the_id, votos):
         res = {
             'id': the_id,
@@ -105,19 +214,121 @@ class VotesToCSV(object):
                 raise argparse.ArgumentTypeError(msg)
             return legislature
 
+        def _parse_legislatures(legislatures):
+            """Parses "54", "48-55" or "48,52,54" into a list"""
+            result = []
+            for part in legislatures.split(','):
+                if '-' in part:
+                    start, end = [_validate_legislature(l)
+                                  for l in part.split('-', 1)]
+                    result += range(start, end + 1)
+                else:
+                    result.append(_validate_legislature(part))
+            if not result:
+                raise argparse.ArgumentTypeError("No legislature given")
+            return sorted(set(result))
+
         parser = argparse.ArgumentParser(
             description="Converts votes in the DB to a CSV file"
         )
         parser.add_argument(
-            "--legislature", type=_validate_legislature, default=54,
-            help="output the votes from which legislature (default: 54)"
+            "--legislature", type=_parse_legislatures, default=[54],
+            help="output the votes from which legislature, a range (e.g. "
+                 "48-55) or a list (e.g. 48,52) (default: 54)"
         )
         parser.add_argument(
             "--votes-output-path", default="votos.csv",
-            help="path to the votes' csv file (default: votos.csv)"
+            help="path to the votes' csv file. With multiple legislatures, "
+                 "use {legislature} in it (e.g. {legislature}.csv) "
+                 "(default: votos.csv)"
         )
         parser.add_argument(
             "--rollcalls-output-path", default="votacoes.csv",
-            help="path to the rollcalls' csv file (default: votacoes.csv)"
+            help="path to the rollcalls' csv file. With multiple "
+                 "legislatures, use {legislature} in it (default: "
+                 "votacoes.csv)"
+        )
+        parser.add_argument(
+            "--store-output-path", default=None,
+            help="directory to also save the votes as a binary store, which "
+                 "loads much faster than the CSV (default: None)"
+        )
+        parser.add_argument(
+            "--jobs", type=int, default=1,
+            help="processes writing the legislatures' files in parallel "
+                 "(default: 1)"
+        )
+        parser.add_argument(
+            "--db-path", default=None,
+            help="path to the votes' DB, opened as read-only (default: "
+                 "$%s or data/dados.db)" % db.DB_PATH_VARIABLE
         )
         return parser
+
+
+class _LegislatureOutput(object):
+    """A legislature's votes and rollcalls files
+
+    The legislators' rows are written as they're added, unless it's opened
+    as deferred. In that case, they're kept as compact int8 rows until
+    `write_deferred` is called, possibly on another process.
+    """
+    def __init__(self, votacoes, votos_path, votacoes_path, store_path=None):
+        self.votacoes = votacoes
+        self.votacoes_ids = [v['id'] for v in votacoes]
+        self.votos_path = votos_path
+        self.votacoes_path = votacoes_path
+        self.store_path = store_path
+        self.legislators = []
+        self.votes = []
+        self._csv_file = None
+        self._writer = None
+
+    def open(self, deferred=False):
+        if deferred:
+            return
+        with open(self.votacoes_path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file,
+                                    fieldnames=VotesToCSV.ROLLCALL_KEYS)
+            writer.writeheader()
+            writer.writerows(self.votacoes)
+
+        self._csv_file = open(self.votos_path, 'w', newline='')
+        self._writer = csv.writer(self._csv_file)
+        self._writer.writerow(VotesToCSV.LEGISLATOR_KEYS + self.votacoes_ids)
+
+    def add(self, row):
+        legislator = [row[key] for key in VotesToCSV.LEGISLATOR_KEYS]
+        votes = encode_votes([row.get(votacao_id)
+                              for votacao_id in self.votacoes_ids])
+        if self._writer is not None:
+            self._write_row(legislator, votes)
+        if self._writer is None or self.store_path:
+            self.legislators.append(legislator)
+            self.votes.append(votes)
+
+    def write_deferred(self):
+        self.open()
+        for legislator, votes in zip(self.legislators, self.votes):
+            self._write_row(legislator, votes)
+        self.close()
+
+    def close(self):
+        self._csv_file.close()
+        if self.store_path:
+            legislators = pd.DataFrame(self.legislators,
+                                       columns=VotesToCSV.LEGISLATOR_KEYS)
+            rollcalls = pd.DataFrame([[v['id'], v['data']]
+                                      for v in self.votacoes],
+                                     columns=['id', 'data'])
+            votes = np.vstack(self.votes) if self.votes else []
+            VoteMatrixStore(self.store_path).write(votes, legislators,
+                                                   rollcalls)
+
+    def _write_row(self, legislator, votes):
+        votes = np.where(votes == MISSING, '', votes.astype(str))
+        self._writer.writerow(legislator + votes.tolist())
+
+
+def _write_deferred_output(output):
+    output.write_deferred()
@@ -10,7 +10,8 @@ setup(
     version=__version__,
     packages=['pipeline', 'pipeline.metrics'],
     scripts=['bin/rice_index', 'bin/rollmean', 'bin/breakout_detection',
-             'bin/parties_and_coalitions_changes', 'bin/votes_to_csv'],
+             'bin/change_points', 'bin/parties_and_coalitions_changes',
+             'bin/votes_to_csv', 'bin/upgrade_db'],
     test_suite='pipeline.test',
 
     install_requires=[